@@ -4,7 +4,7 @@ For ENT (Unified National Testing) preparation
 Integrated into ozger project
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
@@ -12,23 +12,79 @@ import asyncio
 import time
 import json
 import hashlib
-from collections import OrderedDict
+import hmac
+import threading
+import tracemalloc
+from concurrent.futures import Future
 
 
 load_dotenv()
 
 from services.gemini_service import get_gemini_service, GeminiService
-from services.pdf_service import extract_text_from_pdf
+from services.history_quiz import get_history_quiz
+from services.pdf_service import extract_pdf_text, warm_up as warm_up_pdf
+from services.admission import AdmissionRejected, admission_priority
+from services.chronology import timeline
+from services.deadline import DeadlineExceeded, degraded_reason, mark_degraded, remaining, request_budget
+from services.material import Material, as_material, material_digest, parse_page_range
+from services.metrics import (
+    CACHE_EVENTS,
+    DEADLINE_EVENTS,
+    GENERATIONS_IN_FLIGHT,
+    RATE_LIMIT_REJECTIONS,
+    REQUEST_LATENCY,
+    TOPUPS,
+    render_all,
+)
+from services.profiling import CACHE_KEY_ENVIRON, ProfilerMiddleware
+from services.sessions import PracticeSession, recent_limit, session_id_for
+from services.stores import CompressedCache, TrackedDict, memory_report, track
+from services.tracing import end_trace, log_trace, span, start_trace
+from services.workers import get_executor
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["ETag", "Server-Timing", "X-Degraded"])
 
+if os.getenv("AI_PROFILE_DIR") and os.getenv("AI_ADMIN_TOKEN"):
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, os.getenv("AI_PROFILE_DIR"), os.getenv("AI_ADMIN_TOKEN"))
 
-materials_store = {}
 
+materials_store = TrackedDict("materials")
 
-_cache = OrderedDict()
-_rate_limits = {}
+
+def _cache_limits() -> tuple[int, int, int]:
+    """Byte budget, optional entry cap and zlib level for the response cache"""
+    try:
+        max_bytes = int(os.getenv("AI_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    except Exception:
+        max_bytes = 64 * 1024 * 1024
+    try:
+        max_entries = int(os.getenv("AI_CACHE_MAX", "0"))
+    except Exception:
+        max_entries = 0
+    if os.getenv("AI_CACHE_MAX") is not None and max_entries <= 0:
+        max_bytes = 0
+    try:
+        level = int(os.getenv("AI_CACHE_COMPRESS_LEVEL", "6"))
+    except Exception:
+        level = 6
+    return max_bytes, max_entries, level
+
+
+_cache_max_bytes, _cache_max_entries, _cache_level = _cache_limits()
+# Entries hold the serialized JSON body gzip-compressed, ready to be written to the response
+_cache = CompressedCache(
+    "response_cache", max_bytes=_cache_max_bytes, max_entries=_cache_max_entries, level=_cache_level, fmt="gzip"
+)
+_rate_limits = TrackedDict("rate_limits")
+
+
+def _is_admin_request() -> bool:
+    token = os.getenv("AI_ADMIN_TOKEN", "").strip()
+    if not token:
+        return False
+    sent = request.headers.get("X-Admin-Token", "")
+    return hmac.compare_digest(sent.encode("utf-8"), token.encode("utf-8"))
 
 def _get_client_key(data: dict | None) -> str:
     user_id = None
@@ -60,50 +116,158 @@ def _rate_limit_check(key: str) -> tuple[bool, int]:
         return True, 0
     record["count"] += 1
     if record["count"] > limit:
+        RATE_LIMIT_REJECTIONS.inc()
         retry_after = record["start"] + window - now
         return False, retry_after
     return True, 0
 
-def _cache_key(endpoint: str, data: dict, material: str | None) -> str:
-    payload = dict(data or {})
-    if material:
-        payload["material_hash"] = hashlib.sha256(material.encode("utf-8")).hexdigest()
-        payload.pop("material", None)
-    if payload.get("exclude_questions"):
+def _normalize_lang(lang: str | None) -> str:
+    if not lang:
+        return "kk"
+    lang = lang.strip().lower()
+    if lang.startswith("ru"):
+        return "ru"
+    if lang.startswith("en"):
+        return "en"
+    return "kk"
+
+def _cache_key(endpoint: str, params: dict) -> str:
+    """
+    Key built only from the parameters that shape the generation (not user id or
+    other request noise), so background precompute can predict it.
+    """
+    payload = {
+        # "continue" is the same generation as practice with a longer exclude list
+        "endpoint": "practice" if endpoint == "continue" else endpoint,
+        "material_hash": material_digest(params["material"]),
+        "language": _normalize_lang(params.get("language")),
+        "history_mode": bool(params.get("history_mode")),
+    }
+    if endpoint != "learn":
+        payload["count"] = params.get("count")
+    if params.get("exclude_questions"):
         payload["exclude_questions_hash"] = hashlib.sha256(
-            "\n".join(payload["exclude_questions"]).encode("utf-8")
+            "\n".join(params["exclude_questions"]).encode("utf-8")
         ).hexdigest()
-        payload.pop("exclude_questions", None)
-    payload["endpoint"] = endpoint
     return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
 
-def _cache_get(key: str):
+def _cache_lookup(key: str) -> tuple[dict | None, bool]:
+    """
+    Return (entry, stale). Entries past AI_CACHE_TTL_SECONDS but within
+    AI_CACHE_STALE_SECONDS are still returned, flagged stale, so the caller can
+    serve them immediately and refresh in the background. Partial entries (short
+    of questions) turn stale after AI_CACHE_PARTIAL_TTL_SECONDS instead.
+    """
     try:
         ttl = int(os.getenv("AI_CACHE_TTL_SECONDS", "3600"))
     except Exception:
         ttl = 3600
-    if ttl <= 0:
-        return None
-    item = _cache.get(key)
-    if not item:
-        return None
-    if time.time() - item["ts"] > ttl:
-        _cache.pop(key, None)
-        return None
-    _cache.move_to_end(key)
-    return item["value"]
-
-def _cache_set(key: str, value):
     try:
-        max_size = int(os.getenv("AI_CACHE_MAX", "64"))
+        grace = max(0, int(os.getenv("AI_CACHE_STALE_SECONDS", "0")))
     except Exception:
-        max_size = 64
-    if max_size <= 0:
-        return
-    _cache[key] = {"ts": time.time(), "value": value}
-    _cache.move_to_end(key)
-    while len(_cache) > max_size:
-        _cache.popitem(last=False)
+        grace = 0
+    if ttl <= 0 or not _cache.enabled:
+        return None, False
+    item, event = _cache.lookup(key, ttl + grace)
+    if item is None:
+        CACHE_EVENTS.inc(cache="response", event=event)
+        return None, False
+    fresh_for = ttl
+    if item.get("partial"):
+        try:
+            fresh_for = min(ttl, max(0, int(os.getenv("AI_CACHE_PARTIAL_TTL_SECONDS", "300"))))
+        except Exception:
+            fresh_for = min(ttl, 300)
+    if time.time() - item["ts"] > fresh_for:
+        CACHE_EVENTS.inc(cache="response", event="stale")
+        return item, True
+    CACHE_EVENTS.inc(cache="response", event="hit")
+    return item, False
+
+def _cache_set(key: str, value, store: bool = True, partial: bool = False, prefetched: bool = False) -> dict:
+    """
+    Serialize and compress a result once; the entry is returned even when caching is off.
+    Flags are set before the entry is stored: partial (short of questions, refreshed
+    early, see _cache_lookup) and prefetched (generated ahead of the request).
+    """
+    with span("serialize"):
+        entry = _cache.encode(value)
+        entry["etag"] = f'"{key[:32]}-{entry["crc"]:08x}"'
+    if partial:
+        entry["partial"] = True
+    if prefetched:
+        entry["prefetched"] = True
+    if not store:
+        return entry
+    evicted = _cache.put_entry(key, entry)
+    if evicted:
+        CACHE_EVENTS.inc(evicted, cache="response", event="eviction")
+    return entry
+
+def _json_response(entry: dict) -> Response:
+    """
+    Send a cache entry: the stored gzip body or its inflated form. A matching
+    If-None-Match answers 304 on GET/HEAD and 412 on other methods (RFC 7232 3.2).
+    """
+    etag = entry["etag"]
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("If-None-Match", "")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        if request.method in ("GET", "HEAD"):
+            return Response(status=304, headers=headers)
+        return Response(status=412, headers=headers)
+    if request.accept_encodings.quality("gzip") > 0:
+        headers["Content-Encoding"] = "gzip"
+        return Response(entry["data"], mimetype="application/json", headers=headers)
+    return Response(_cache.raw(entry), mimetype="application/json", headers=headers)
+
+
+_refreshing: set = set()
+_refreshing_lock = threading.Lock()
+
+_precompute_status = TrackedDict("precompute_status")
+_jobs = TrackedDict("jobs")
+_jobs_lock = threading.Lock()
+_sessions = TrackedDict("practice_sessions")
+_sessions_lock = threading.Lock()
+_pending_generations: dict[str, Future] = {}
+_pending_lock = threading.Lock()
+track("pending_generations", lambda: _pending_generations)
+track("refreshing", lambda: _refreshing)
+
+
+def _generate_to_cache(endpoint: str, cache_key: str, params: dict) -> dict:
+    """
+    Generate outside a request (refresh, precompute, jobs) and cache the result; one
+    that came back short of questions is cached flagged partial
+    """
+    with request_budget(None):
+        result = _generate(endpoint, params)
+        partial = degraded_reason() == "incomplete"
+    return _cache_set(cache_key, result, partial=partial)
+
+
+def _refresh_in_background(endpoint: str, cache_key: str, params: dict) -> None:
+    """Regenerate a stale entry once; concurrent stale hits on the same key do not pile up"""
+    with _refreshing_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+
+    def refresh():
+        try:
+            with admission_priority("background"):
+                _generate_to_cache(endpoint, cache_key, params)
+            CACHE_EVENTS.inc(cache="response", event="refresh")
+        except Exception:
+            CACHE_EVENTS.inc(cache="response", event="refresh_error")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(cache_key)
+
+    if get_executor("refresh", default_workers=2, default_pending=16).submit(refresh) is None:
+        with _refreshing_lock:
+            _refreshing.discard(cache_key)
 
 
 def run_async(coro):
@@ -116,12 +280,201 @@ def run_async(coro):
         loop.close()
 
 
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    g.trace = start_trace()
+    if not _warmup_started.is_set():
+        _start_warm_up()
+
+
+@app.after_request
+def _record_request_latency(response):
+    started = getattr(g, "request_started", None)
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    if started is not None:
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - started,
+            endpoint=endpoint,
+            method=request.method,
+            status=str(response.status_code),
+        )
+    trace = getattr(g, "trace", None)
+    if trace is not None and endpoint != "/api/metrics":
+        if os.getenv("AI_SERVER_TIMING", "true").strip().lower() in ("1", "true", "yes"):
+            response.headers["Server-Timing"] = trace.server_timing()
+        if os.getenv("AI_TIMING_LOG", "false").strip().lower() in ("1", "true", "yes"):
+            log_trace(trace, endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def _finish_trace(exc):
+    end_trace()
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({"status": "ok", "message": "AI Teacher API is running"})
 
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """
+    Readiness probe: 503 until warm_up() has finished, and while the provider client
+    cannot be created, so a load balancer only sends traffic to workers whose
+    provider client and indexes are built
+    
+    Response:
+        - state: warming / ready / failed / skipped
+        - seconds: How long the warm-up took
+        - errors: Steps that failed; a failed provider step keeps the worker
+          not ready (retried on each probe), other steps just stay cold
+    """
+    if _warmup_status.get("state") == "failed":
+        try:
+            get_gemini_service()
+        except Exception as e:
+            _warmup_status["errors"]["provider"] = str(e)
+        else:
+            _warmup_status["errors"].pop("provider", None)
+            _warmup_status["state"] = "ready"
+    ready = _warmup_done.is_set() and _warmup_status.get("state") != "failed"
+    return jsonify(_warmup_status), 200 if ready else 503
+
+
+_warmup_done = threading.Event()
+_warmup_started = threading.Event()
+_warmup_lock = threading.Lock()
+_warmup_status: dict = {"state": "warming"}
+
+
+def warm_up() -> dict:
+    """
+    Build what the first requests would otherwise pay for: the provider client
+    (SDK import, configuration and an open connection), PyMuPDF and the history
+    quiz index. Started by the server entry point, or else by the first request
+    (a readiness probe is enough), as configured by AI_WARMUP (background, sync or
+    off); importing the app (tests, benchmarks, the reloader parent) does not start it.
+    """
+    started = time.perf_counter()
+    errors = {}
+    steps = (
+        ("provider", lambda: get_gemini_service().warm_up()),
+        ("pdf", warm_up_pdf),
+        ("history_quiz", get_history_quiz),
+    )
+    for name, step in steps:
+        try:
+            with span(f"warmup_{name}"):
+                step()
+        except Exception as e:
+            errors[name] = str(e)
+    state = "failed" if "provider" in errors else "ready"
+    _warmup_status.update(state=state, seconds=round(time.perf_counter() - started, 3), errors=errors)
+    _warmup_done.set()
+    return _warmup_status
+
+
+def _start_warm_up() -> None:
+    """Start warm_up() once per process"""
+    with _warmup_lock:
+        if _warmup_started.is_set():
+            return
+        _warmup_started.set()
+    mode = os.getenv("AI_WARMUP", "background").strip().lower()
+    if mode == "off":
+        _warmup_status["state"] = "skipped"
+        _warmup_done.set()
+    elif mode == "sync":
+        warm_up()
+    else:
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus metrics for this worker process
+
+    Protected by AI_METRICS_TOKEN (Authorization: Bearer <token>) when it is set.
+    """
+    token = os.getenv("AI_METRICS_TOKEN", "").strip()
+    if token and request.headers.get("Authorization", "") != f"Bearer {token}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(render_all(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route('/api/admin/memory', methods=['GET'])
+def admin_memory():
+    """
+    Memory accounting for the in-process stores (admin only, X-Admin-Token header)
+
+    Query:
+        - top: Number of largest entries to list per store (default 5)
+        - tracemalloc: "start" / "stop", or "1" to include the top allocators
+        
+    Response:
+        - stores: Entry count, approximate bytes and largest entries per store: every
+          TrackedDict plus the pending-generation, refresh and admission queues;
+          anything else only shows up in process and tracemalloc
+        - process: Current and peak RSS in bytes
+        - tracemalloc: Top allocation sites (when tracing is active)
+    """
+    if not _is_admin_request():
+        return jsonify({"error": "Forbidden"}), 403
+
+    try:
+        top = max(0, min(50, int(request.args.get("top", "5"))))
+    except ValueError:
+        top = 5
+
+    stores = memory_report(top)
+    result = {
+        "stores": stores,
+        "total_bytes": sum(s["bytes"] for s in stores.values()),
+        "process": _process_memory(),
+    }
+
+    mode = request.args.get("tracemalloc", "").strip().lower()
+    if mode == "start" and not tracemalloc.is_tracing():
+        try:
+            frames = max(1, int(os.getenv("AI_TRACEMALLOC_FRAMES", "1")))
+        except Exception:
+            frames = 1
+        tracemalloc.start(frames)
+    elif mode == "stop" and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        info = {"current_bytes": current, "peak_bytes": peak}
+        if mode in ("1", "true", "yes"):
+            snapshot = tracemalloc.take_snapshot()
+            info["top"] = [
+                {"where": str(stat.traceback), "bytes": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:20]
+            ]
+        result["tracemalloc"] = info
+
+    return jsonify(result)
+
+
+def _process_memory() -> dict:
+    info = {}
+    try:
+        import resource
+        info["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except Exception:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            info["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        pass
+    return info
+
+
 @app.route('/api/upload', methods=['POST'])
 def upload_material():
     """
@@ -129,19 +482,27 @@ def upload_material():
     
     Request:
         - Form data with 'file' (PDF) or 'text' field
+        - Optional 'language', 'mode' (learn/practice/realtest) and 'history_mode'
+          hints used by background precompute
         
     Response:
         - material_id: ID to reference the material
         - preview: First 500 characters of extracted text
+        - pages: Number of [PAGE N] sections (0 for plain text)
+        - compaction: For PDFs, raw_chars vs chars kept, ratio and what was stripped
+          (repeated_lines, page_numbers, empty_pages)
+        - precompute: Background precompute status (when AI_PRECOMPUTE_ENABLED)
     """
     try:
         material_text = ""
+        compaction = None
         
        
         if 'file' in request.files:
             file = request.files['file']
             if file.filename.lower().endswith('.pdf'):
-                material_text = extract_text_from_pdf(file)
+                with span("extract"):
+                    material_text, compaction = extract_pdf_text(file)
             else:
                 return jsonify({"error": "Тек PDF файлдары қолдау көрсетіледі"}), 400
         
@@ -156,72 +517,889 @@ def upload_material():
             return jsonify({"error": "Материал табылмады"}), 400
         
 
-        import hashlib
         material_id = hashlib.md5(material_text[:100].encode()).hexdigest()[:12]
         
 
-        materials_store[material_id] = material_text
+        # Digest, normalized text and page index are computed here, once per upload
+        material = Material(material_text)
+        materials_store[material_id] = material
         
-        return jsonify({
+        response = {
             "material_id": material_id,
             "preview": material_text[:500] + ("..." if len(material_text) > 500 else ""),
-            "length": len(material_text)
-        })
+            "length": len(material_text),
+            "pages": material.page_count
+        }
+        if compaction is not None:
+            response["compaction"] = compaction
+        if _precompute_enabled():
+            options = request.get_json(silent=True) if request.is_json else request.form
+            options = options or {}
+            response["precompute"] = _start_precompute(
+                material_id,
+                material,
+                client_key=_get_client_key(options),
+                language=options.get("language") or options.get("lang"),
+                mode=options.get("mode"),
+                history_mode=str(options.get("history_mode", "")).lower() in ("1", "true", "yes"),
+            )
+        return jsonify(response)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/api/generate/learn', methods=['POST'])
-def generate_learn():
+@app.route('/api/materials/<material_id>/precompute', methods=['GET'])
+def precompute_status(material_id):
     """
-    Generate learning plan with content and questions
+    Progress of the background precompute started at upload
     
-    Request JSON:
-        - material_id: ID of uploaded material
-        OR
-        - material: Raw material text
-        - history_mode: Boolean for History Mode (3-view format)
-        
     Response:
-        - plan: Array of learning sections with content and questions
+        - status: queued / running / done / failed / rejected
+        - steps: Per-step state (prepare, practice, realtest, learn); a step is
+          "cancelled" when a request generated it first and "rate_limited" when the
+          uploader's limit was used up
+    """
+    status = _precompute_status.get(material_id)
+    if status is None:
+        return jsonify({"error": "Материал табылмады"}), 404
+    return jsonify(status)
+
+
+@app.route('/api/materials/<material_id>/timeline', methods=['GET'])
+def material_timeline(material_id):
+    """
+    Dated events found in the material, built locally (no LLM call)
+    
+    Response:
+        - timeline: Array of {year, event, page} sorted by year; page is the
+          [PAGE N] marker of PDF uploads or null
+    """
+    material = materials_store.get(material_id)
+    if material is None:
+        return jsonify({"error": "Материал табылмады"}), 404
+    return jsonify({"timeline": timeline(material)})
+
+
+def _precompute_enabled() -> bool:
+    return os.getenv("AI_PRECOMPUTE_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+
+
+def _precompute_plan(mode: str | None) -> list[str]:
+    """Which generations to warm; all common ones when the client gave no mode hint"""
+    if mode in ("learn", "practice", "realtest"):
+        return [mode]
+    return [m.strip() for m in os.getenv("AI_PRECOMPUTE_MODES", "practice,learn").split(",") if m.strip()]
+
+
+def _start_precompute(material_id: str, material: str, *, client_key: str, language: str | None,
+                      mode: str | None, history_mode: bool) -> dict:
+    """
+    Queue summarization + default generations for a fresh upload; returns the status
+    record. Each generation counts against the uploader's rate limit when it runs.
     """
     try:
-        data = request.get_json()
-        
-     
-        client_key = _get_client_key(data)
+        count = int(os.getenv("AI_PRECOMPUTE_COUNT", "10"))
+    except Exception:
+        count = 10
+
+    steps = []
+    for endpoint in _precompute_plan(mode):
+        params = {"material": material, "language": language, "history_mode": history_mode}
+        if endpoint in ("practice", "realtest"):
+            params["count"] = count
+            if endpoint == "practice":
+                params["exclude_questions"] = []
+        elif endpoint != "learn":
+            continue
+        cache_key = _cache_key(endpoint, params)
+        if _cache_lookup(cache_key)[0] is not None:
+            continue
+        steps.append((endpoint, params, cache_key))
+
+    # Keys another precompute is already producing are left to it
+    futures = {}
+    with _pending_lock:
+        for endpoint, _, cache_key in steps:
+            if cache_key not in _pending_generations:
+                futures[cache_key] = Future()
+                _pending_generations[cache_key] = futures[cache_key]
+    steps = [step for step in steps if step[2] in futures]
+
+    status = {
+        "status": "queued",
+        "steps": {"prepare": "queued", **{endpoint: "queued" for endpoint, _, _ in steps}},
+        "created": time.time(),
+    }
+    if not steps:
+        status["status"] = "done"
+        status["steps"] = {}
+        _set_precompute_status(material_id, status)
+        return status
+
+    _set_precompute_status(material_id, status)
+    submitted = get_executor("precompute", default_workers=2, default_pending=16).submit(
+        _run_precompute_in_background, material_id, material, client_key, language, history_mode, steps, futures
+    )
+    if submitted is None:
+        _release_pending(futures, None)
+        status["status"] = "rejected"
+        status["steps"] = {name: "skipped" for name in status["steps"]}
+    return {**status, "steps": dict(status["steps"])}
+
+
+def _run_precompute_in_background(*args) -> None:
+    with admission_priority("background"):
+        _run_precompute(*args)
+
+
+def _run_precompute(material_id: str, material: str, client_key: str, language: str | None,
+                    history_mode: bool, steps: list, futures: dict) -> None:
+    status = _precompute_status.get(material_id)
+    if status is None:
+        _release_pending(futures, None)
+        return
+    status["status"] = "running"
+    failed = False
+
+    try:
+        gemini = get_gemini_service()
+        targets = sorted({70000 if (e == "learn" and history_mode) else 50000 for e, _, _ in steps})
+        status["steps"]["prepare"] = "running"
+        for target in targets:
+            gemini._prepare_large_material(material, target_chars=target, lang=language)
+        status["steps"]["prepare"] = "done"
+    except Exception:
+        status["steps"]["prepare"] = "failed"
+        failed = True
+
+    for endpoint, params, cache_key in steps:
+        future = futures.get(cache_key)
+        if failed:
+            status["steps"][endpoint] = "skipped"
+            _release_pending({cache_key: future}, None)
+            continue
+        # A step blocks waiters only once it actually runs; until then an interactive
+        # request for the same key cancels it and generates at its own priority
+        if future is not None and not future.set_running_or_notify_cancel():
+            status["steps"][endpoint] = "cancelled"
+            _release_pending({cache_key: future}, None)
+            continue
+        if not _rate_limit_check(client_key)[0]:
+            status["steps"][endpoint] = "rate_limited"
+            _release_pending({cache_key: future}, None)
+            continue
+        status["steps"][endpoint] = "running"
+        try:
+            entry = _generate_to_cache(endpoint, cache_key, params)
+            status["steps"][endpoint] = "done"
+            _release_pending({cache_key: future}, entry)
+        except Exception as e:
+            status["steps"][endpoint] = "failed"
+            _release_pending({cache_key: future}, None, e)
+
+    status["status"] = "failed" if any(v == "failed" for v in status["steps"].values()) else "done"
+    status["finished"] = time.time()
+    _precompute_status.resize(material_id)
+
+
+def _set_precompute_status(material_id: str, status: dict) -> None:
+    _precompute_status[material_id] = status
+    _precompute_status.move_to_end(material_id)
+    while len(_precompute_status) > 256:
+        _precompute_status.popitem(last=False)
+
+
+def _release_pending(futures: dict, entry: dict | None, error: Exception | None = None) -> None:
+    """Resolve precompute futures and drop them from the pending table"""
+    with _pending_lock:
+        for cache_key, future in futures.items():
+            if _pending_generations.get(cache_key) is future:
+                _pending_generations.pop(cache_key, None)
+    for future in futures.values():
+        if future is None or future.done():
+            continue
+        if not future.running():
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(entry)
+
+
+def _await_precompute(cache_key: str) -> dict | None:
+    """
+    If background precompute or prefetch is already generating this key, wait for it instead of
+    issuing a duplicate provider call. Steps still queued are cancelled and the
+    request generates directly.
+    """
+    with _pending_lock:
+        future = _pending_generations.get(cache_key)
+    if future is None:
+        return None
+    if future.cancel():
+        # Drop it here too: the precompute worker may not reach this step for a while,
+        # and until then later precomputes would skip the key
+        with _pending_lock:
+            if _pending_generations.get(cache_key) is future:
+                _pending_generations.pop(cache_key, None)
+        return None
+    try:
+        wait = float(os.getenv("AI_PRECOMPUTE_WAIT_SECONDS", "120"))
+    except Exception:
+        wait = 120.0
+    left = remaining()
+    if left is not None:
+        wait = max(0.0, min(wait, left))
+    try:
+        return future.result(timeout=wait)
+    except Exception:
+        return None
+
+
+def _generation_params(endpoint: str, data: dict) -> dict | None:
+    """Normalize a generate request body; None when no material can be resolved"""
+    material_id = data.get('material_id')
+    material = data.get('material')
+    session = None
+    if endpoint in ("practice", "continue") and data.get('session_id'):
+        session = _sessions.get(data['session_id'])
+        if session is None:
+            return None
+        material_id = session.material_id
+    if material_id and material_id in materials_store:
+        material = materials_store[material_id]
+    if not material:
+        return None
+    material = as_material(material)
+    if data.get('pages') is not None:
+        # Only the chosen pages go to the provider; the slice has its own digest,
+        # so it gets its own cache entries
+        first, last = parse_page_range(data['pages'])
+        material = material.page_slice(first, last)
+        if material is None:
+            return None
+
+    # History mode also decides whether practice/realtest take date questions from the local timeline
+    params = {
+        "material": material,
+        "language": data.get('language') or data.get('lang'),
+        "history_mode": bool(data.get('history_mode', False)),
+    }
+    if endpoint == "learn":
+        return params
+
+    count = data.get('count', 10)
+    if endpoint in ("practice", "realtest", "flashcards") and count not in [10, 15, 20, 25, 30]:
+        count = 10
+    params["count"] = count
+    if session is not None:
+        # Only the recent window goes to the model; older repeats are filtered on serve
+        params["session_id"] = session.session_id
+        params["exclude_questions"] = session.exclusions()
+    elif endpoint == "practice":
+        params["exclude_questions"] = data.get('exclude_questions', [])
+    elif endpoint == "continue":
+        params["exclude_questions"] = data.get('previous_questions', [])
+    return params
+
+
+def _generate(endpoint: str, params: dict) -> dict:
+    """Run one generation against the provider (blocking)"""
+    gemini = get_gemini_service()
+    material = params["material"]
+    language = params["language"]
+    with GENERATIONS_IN_FLIGHT.track(endpoint=endpoint):
+        if endpoint == "flashcards" or (
+            endpoint in ("practice", "realtest") and _bundle_enabled() and not params.get("exclude_questions")
+        ):
+            return _generate_bundle(endpoint, params)
+        if endpoint == "learn":
+            return run_async(gemini.generate_learn_content(material, params["history_mode"], language))
+        if endpoint == "realtest":
+            return run_async(gemini.generate_realtest_questions(
+                material, params["count"], language, params.get("history_mode", False)
+            ))
+        return run_async(gemini.generate_practice_questions(
+            material, params["count"], params["exclude_questions"], language, params.get("history_mode", False)
+        ))
+
+
+BUNDLE_VIEWS = ("practice", "realtest", "flashcards")
+
+
+def _bundle_enabled() -> bool:
+    return os.getenv("AI_BUNDLE_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+
+
+def _bundle_pool_size(count: int) -> int:
+    """Enough questions for separate practice and realtest sets, within AI_BUNDLE_POOL_MAX"""
+    try:
+        limit = int(os.getenv("AI_BUNDLE_POOL_MAX", "40"))
+    except Exception:
+        limit = 40
+    return max(count, min(limit, 2 * count))
+
+
+def _bundle_views(pool: list, count: int) -> dict:
+    """
+    Practice takes the head of the pool and realtest the tail, without explanations
+    (the two overlap only when the pool is smaller than 2 * count); flashcards are
+    built from the practice set.
+    """
+    practice = [{**q, "id": i + 1} for i, q in enumerate(pool[:count])]
+    realtest = [
+        {**{k: v for k, v in q.items() if k != "explanation"}, "id": i + 1}
+        for i, q in enumerate(pool[-count:] if pool else [])
+    ]
+    flashcards = [{"id": q["id"], "front": q["question"], "back": q["correct"]} for q in practice]
+    return {
+        "practice": {"questions": practice},
+        "realtest": {"questions": realtest},
+        "flashcards": {"flashcards": flashcards},
+    }
+
+
+def _generate_bundle(endpoint: str, params: dict) -> dict:
+    """
+    One provider call for a question pool with explanations, served as practice,
+    realtest and flashcards. The views not asked for go into their own cache slots;
+    requests for them that arrive meanwhile wait instead of generating again.
+    """
+    try:
+        count = int(params["count"])
+    except Exception:
+        count = 10
+    base = {"material": params["material"], "language": params["language"], "count": count,
+            "history_mode": params.get("history_mode", False)}
+    keys = {view: _cache_key(view, base) for view in BUNDLE_VIEWS}
+
+    futures = {}
+    with _pending_lock:
+        for view, key in keys.items():
+            if view != endpoint and key not in _pending_generations and key not in _cache:
+                futures[key] = Future()
+                _pending_generations[key] = futures[key]
+    for future in futures.values():
+        future.set_running_or_notify_cancel()
+
+    left = remaining()
+    try:
+        # Own budget scope: a pool short of 2 * count is fine as long as each view is full
+        with request_budget(max(0.001, left) if left is not None else None):
+            pool = run_async(get_gemini_service().generate_practice_questions(
+                base["material"], _bundle_pool_size(count), None, base["language"], base["history_mode"]
+            ))
+            pool_degraded = degraded_reason()
+    except Exception as e:
+        _release_pending(futures, None, e)
+        raise
+
+    views = _bundle_views(pool.get("questions") or [], count)
+    filled = {view: len(next(iter(result.values()))) for view, result in views.items()}
+    if pool_degraded == "deadline":
+        mark_degraded("deadline")
+    elif filled[endpoint] < count:
+        mark_degraded("incomplete")
+
+    # Views short of count (the provider fell short even after top-up) are cached
+    # flagged partial, so they are served at once and regenerated in the background
+    for view, key in keys.items():
+        if key not in futures:
+            continue
+        entry = None
+        if pool_degraded != "deadline" and filled[view]:
+            entry = _cache_set(key, views[view], partial=filled[view] < count)
+            CACHE_EVENTS.inc(cache="bundle", event=view)
+        _release_pending({key: futures[key]}, entry)
+    return views[endpoint]
+
+
+def _prefetch_enabled() -> bool:
+    return os.getenv("AI_PREFETCH_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+
+
+def _prefetch_next_batch(endpoint: str, params: dict, entry: dict, client_key: str) -> None:
+    """
+    After serving a practice/continue batch, speculatively generate the next one in
+    the background (opt-in via AI_PREFETCH_ENABLED), so "continue" is a cache hit
+    """
+    if endpoint not in ("practice", "continue") or not _prefetch_enabled():
+        return
+    get_executor("prefetch", default_workers=2, default_pending=16).submit(_run_prefetch, params, entry, client_key)
+
+
+def _run_prefetch(params: dict, entry: dict, client_key: str) -> None:
+    """
+    The follow-up request sends everything served so far as its exclude list, with
+    the same material, language and count; park its result under that key. The
+    generation is charged to the client's rate limit, like precompute, and skipped
+    once the client has no quota left.
+    """
+    try:
+        served = [
+            q["question"] for q in (_cache.decode(entry).get("questions") or [])
+            if isinstance(q, dict) and q.get("question")
+        ]
+    except Exception:
+        return
+    if not served:
+        return
+    exclude = list(params.get("exclude_questions") or []) + served
+    if params.get("session_id"):
+        exclude = exclude[-recent_limit():] if recent_limit() else []
+    next_params = {**params, "exclude_questions": exclude}
+    cache_key = _cache_key("continue", next_params)
+    if cache_key in _cache:
+        return
+
+    future = Future()
+    with _pending_lock:
+        if cache_key in _pending_generations:
+            return
+        _pending_generations[cache_key] = future
+    if not _rate_limit_check(client_key)[0]:
+        CACHE_EVENTS.inc(cache="prefetch", event="rate_limited")
+        _release_pending({cache_key: future}, None)
+        return
+    # Already running: a follow-up that arrives now waits for this result
+    future.set_running_or_notify_cancel()
+    CACHE_EVENTS.inc(cache="prefetch", event="scheduled")
+    try:
+        with admission_priority("background"), request_budget(None):
+            result = _generate("continue", next_params)
+            partial = degraded_reason() == "incomplete"
+        next_entry = _cache_set(cache_key, result, partial=partial, prefetched=True)
+        CACHE_EVENTS.inc(cache="prefetch", event="done")
+        _release_pending({cache_key: future}, next_entry)
+    except Exception as e:
+        CACHE_EVENTS.inc(cache="prefetch", event="error")
+        _release_pending({cache_key: future}, None, e)
+
+
+def _request_budget() -> float | None:
+    """
+    Seconds this request may still spend generating, minus time already spent; None
+    (no deadline) unless opted in. Opt in server-wide with AI_REQUEST_BUDGET_SECONDS
+    (default 0 = off) or per request with an X-Request-Budget header (the smaller of
+    the two wins). Past the budget, optional work (chunk summaries) is cut, such
+    results are not cached, and a provider call that cannot finish answers 504. Set
+    it above the provider's own worst case (timeout x GEMINI_MAX_RETRIES plus
+    summarization), or slow but healthy generations turn into 504s.
+    """
+    try:
+        budget = float(os.getenv("AI_REQUEST_BUDGET_SECONDS", "0"))
+    except Exception:
+        budget = 0.0
+    try:
+        asked = float(request.headers.get("X-Request-Budget", "0"))
+    except Exception:
+        asked = 0.0
+    if asked > 0:
+        budget = min(budget, asked) if budget > 0 else asked
+    if budget <= 0:
+        return None
+    started = getattr(g, "request_started", None)
+    if started is not None:
+        budget -= time.perf_counter() - started
+    return max(0.001, budget)
+
+
+def _handle_generation(endpoint: str):
+    """
+    Shared body of the /api/generate/* routes: cache lookup, rate limit, generate,
+    respond. Only requests that reach the provider are charged to the rate limit;
+    cached and precomputed results are free.
+    """
+    data = request.get_json()
+    client_key = _get_client_key(data)
+
+    if endpoint in ("practice", "continue") and data.get('session_id') and data['session_id'] not in _sessions:
+        return jsonify({"error": "Сессия табылмады"}), 404
+
+    if data.get('pages') is not None and parse_page_range(data['pages']) is None:
+        return jsonify({"error": "Бет аралығы қате"}), 400
+
+    params = _generation_params(endpoint, data)
+    if params is None:
+        return jsonify({"error": "Материал табылмады"}), 400
+
+    with span("cache"):
+        cache_key = _cache_key(endpoint, params)
+        request.environ[CACHE_KEY_ENVIRON] = cache_key
+        cached, stale = _cache_lookup(cache_key)
+    if cached:
+        if stale:
+            _refresh_in_background(endpoint, cache_key, params)
+        if cached.get("prefetched"):
+            CACHE_EVENTS.inc(cache="prefetch", event="hit")
+        response = _serve_generation(endpoint, cache_key, params, cached, client_key)
+        if cached.get("partial"):
+            response.headers["X-Degraded"] = "incomplete"
+        return response
+
+    with request_budget(_request_budget()):
+        with span("precompute_wait"):
+            cached = _await_precompute(cache_key)
+        if cached:
+            return _serve_generation(endpoint, cache_key, params, cached, client_key)
+
         allowed, retry_after = _rate_limit_check(client_key)
         if not allowed:
             return jsonify({"error": "Лимит запросов достигнут. Попробуйте позже."}), 429, {
                 "Retry-After": str(retry_after)
             }
 
-  
-        material_id = data.get('material_id')
-        material = data.get('material')
-        history_mode = data.get('history_mode', False)
-        language = data.get('language') or data.get('lang')
+        try:
+            with admission_priority("realtest" if endpoint == "realtest" else "interactive"):
+                result = _generate(endpoint, params)
+        except AdmissionRejected as e:
+            return jsonify({"error": "Сервер бос емес. Кейінірек қайталаңыз."}), 503, {
+                "Retry-After": str(e.retry_after)
+            }
+        except DeadlineExceeded:
+            DEADLINE_EVENTS.inc(endpoint=endpoint, event="exceeded")
+            return jsonify({"error": "Уақыт шегі асып кетті. Кейінірек қайталаңыз."}), 504
+        degraded = degraded_reason()
+
+    # A result built from cut-down material is served but not cached; one short of
+    # questions is cached flagged partial, so repeats are served from the cache while
+    # a complete version is generated in the background
+    entry = _cache_set(cache_key, result, store=degraded != "deadline", partial=degraded == "incomplete")
+    response = _serve_generation(endpoint, cache_key, params, entry, client_key, prefetch=not degraded)
+    if degraded:
+        DEADLINE_EVENTS.inc(endpoint=endpoint, event=degraded)
+        response.headers["X-Degraded"] = degraded
+    return response
+
+
+def _serve_generation(endpoint: str, cache_key: str, params: dict, entry: dict, client_key: str,
+                      prefetch: bool = True) -> Response:
+    """Respond with a generation; within a practice session, drop repeats and record what was served"""
+    entry = _session_entry(endpoint, cache_key, params, entry)
+    if prefetch:
+        _prefetch_next_batch(endpoint, params, entry, client_key)
+    return _json_response(entry)
+
+
+def _session_entry(endpoint: str, cache_key: str, params: dict, entry: dict) -> dict:
+    """The entry as served to the params' practice session (repeats dropped and topped up), recorded as served"""
+    session = _sessions.get(params["session_id"]) if params.get("session_id") else None
+    if session is None:
+        return entry
+    result = _cache.decode(entry)
+    questions = result.get("questions") if isinstance(result, dict) else None
+    if isinstance(questions, list):
+        fresh = session.filter_new(questions)
+        if len(fresh) < len(questions):
+            fresh = _top_up_session(endpoint, params, session, fresh, questions)
+            entry = _cache_set(cache_key, {**result, "questions": fresh}, store=False)
+        session.record(fresh)
+        with _sessions_lock:
+            if session.session_id in _sessions:
+                _sessions.resize(session.session_id)
+                _sessions.move_to_end(session.session_id)
+    return entry
+
+
+def _top_up_session(endpoint: str, params: dict, session: PracticeSession, fresh: list, served: list) -> list:
+    """
+    Refill a session batch that lost repeats: one more provider call for the missing
+    questions, with the recent window and this batch in the prompt. Best effort; if
+    the call fails the shorter batch is served.
+    """
+    try:
+        count = int(params.get("count") or 0)
+    except Exception:
+        count = 0
+    if len(fresh) >= count:
+        return fresh
+    exclude = session.exclusions() + [q["question"] for q in served if isinstance(q, dict) and q.get("question")]
+    try:
+        with admission_priority("interactive"):
+            extra = _generate(endpoint, {**params, "count": count - len(fresh), "exclude_questions": exclude})
+    except Exception:
+        TOPUPS.inc(provider="session", outcome="error")
+        return fresh
+    extra = extra.get("questions") if isinstance(extra, dict) else None
+    topped = session.filter_new(fresh + list(extra or []))[:count]
+    TOPUPS.inc(provider="session", outcome="ok" if len(topped) >= count else "short")
+    return [{**q, "id": i + 1} if isinstance(q, dict) else q for i, q in enumerate(topped)]
+
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    """
+    Start (or restart) a practice session for a user and material
+    
+    Request JSON:
+        - material_id: ID of uploaded material OR material: Raw text
+        - user_id: Optional user ID (sessions are per user and material)
+        - served_questions: Optional questions already shown (e.g. when an expired
+          session is replaced), so they are not repeated
         
-        if material_id and material_id in materials_store:
-            material = materials_store[material_id]
+    Response (201):
+        - session_id: Send it to /api/generate/practice or /continue instead of
+          exclude_questions / previous_questions
+    """
+    try:
+        data = request.get_json() or {}
+        material_id = data.get('material_id')
+        if not material_id or material_id not in materials_store:
+            material = data.get('material')
+            if not material:
+                return jsonify({"error": "Материал табылмады"}), 400
+            material_id = hashlib.md5(material[:100].encode()).hexdigest()[:12]
+            materials_store[material_id] = Material(material)
+
+        _collect_sessions()
+        session = PracticeSession(session_id_for(_get_client_key(data), material_id), material_id)
+        served = data.get('served_questions')
+        if isinstance(served, list) and served:
+            session.record([{"question": q} for q in served[-500:] if isinstance(q, str)])
+        with _sessions_lock:
+            _sessions[session.session_id] = session
+            _sessions.move_to_end(session.session_id)
+        return jsonify(session.as_dict()), 201
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/sessions/<session_id>', methods=['GET', 'DELETE'])
+def practice_session(session_id):
+    """
+    Inspect or end a practice session
+    
+    Response:
+        - served: How many distinct questions were served so far
+        - rounds: How many batches were served
+    """
+    session = _sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Сессия табылмады"}), 404
+    if request.method == 'DELETE':
+        with _sessions_lock:
+            _sessions.pop(session_id, None)
+        return jsonify({"success": True})
+    return jsonify(session.as_dict())
+
+
+def _collect_sessions() -> None:
+    """Drop sessions idle for AI_SESSION_TTL_SECONDS and the oldest beyond AI_SESSION_MAX"""
+    try:
+        ttl = float(os.getenv("AI_SESSION_TTL_SECONDS", "21600"))
+    except Exception:
+        ttl = 21600.0
+    try:
+        limit = int(os.getenv("AI_SESSION_MAX", "10000"))
+    except Exception:
+        limit = 10000
+    now = time.time()
+    with _sessions_lock:
+        for session_id, session in list(_sessions.items()):
+            if now - session.updated > ttl:
+                _sessions.pop(session_id, None)
+        while len(_sessions) > max(1, limit):
+            _sessions.popitem(last=False)
+
+
+GENERATION_KINDS = ("learn", "practice", "realtest", "continue", "flashcards")
+
+
+@app.route('/api/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    """
+    Start a generation in the background and return immediately
+    
+    Request JSON:
+        - Same body as the matching /api/generate/<kind> route
         
-        if not material:
+    Response (202):
+        - job_id: ID to poll (identical requests from the same client share one job)
+        - status: queued / running / done / failed
+        - status_url, result_url: Where to poll and fetch the result
+    """
+    if kind not in GENERATION_KINDS:
+        return jsonify({"error": "Unknown job type"}), 404
+    try:
+        data = request.get_json()
+
+        if data.get('pages') is not None and parse_page_range(data['pages']) is None:
+            return jsonify({"error": "Бет аралығы қате"}), 400
+
+        params = _generation_params(kind, data)
+        if params is None:
             return jsonify({"error": "Материал табылмады"}), 400
-        
-      
-        cache_key = _cache_key("learn", data, material)
-        cached = _cache_get(cache_key)
-        if cached:
-            return jsonify(cached)
 
-        
-        gemini = get_gemini_service()
-        result = run_async(gemini.generate_learn_content(material, history_mode, language))
-        _cache_set(cache_key, result)
+        cache_key = _cache_key(kind, params)
+        request.environ[CACHE_KEY_ENVIRON] = cache_key
+        job, retry_after = _get_or_create_job(kind, cache_key, params, _get_client_key(data))
+        if job is None and retry_after is not None:
+            return jsonify({"error": "Лимит запросов достигнут. Попробуйте позже."}), 429, {
+                "Retry-After": str(retry_after)
+            }
+        if job is None:
+            return jsonify({"error": "Сервер бос емес. Кейінірек қайталаңыз."}), 503, {
+                "Retry-After": os.getenv("AI_JOB_RETRY_AFTER", "10")
+            }
+        return jsonify(_job_view(job)), 202 if job["status"] != "done" else 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Poll a background generation
+    
+    Response:
+        - status: queued / running / done / failed (+ error when failed)
+    """
+    _collect_jobs()
+    job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    job["polled"] = time.time()
+    return jsonify(_job_view(job))
 
-        return jsonify(result)
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """
+    Fetch the result of a finished job (same body as the synchronous route)
+    
+    Response:
+        - 200 with the generation, 202 while still running, 500 if it failed
+    """
+    _collect_jobs()
+    job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    job["polled"] = time.time()
+    if job["status"] == "failed":
+        return jsonify({"error": job.get("error") or "Job failed"}), 500
+    if job["status"] != "done":
+        return jsonify(_job_view(job)), 202
+    if job.get("session_id"):
+        # Filtered for the session once, when the job finished
+        return _json_response(job["entry"])
+    entry, _ = _cache_lookup(job["cache_key"])
+    return _json_response(entry or job["entry"])
+
+
+def _job_view(job: dict) -> dict:
+    view = {k: job[k] for k in ("job_id", "kind", "status", "created", "started", "finished") if job.get(k)}
+    if job.get("error"):
+        view["error"] = job["error"]
+    view["status_url"] = f"/api/jobs/{job['job_id']}"
+    view["result_url"] = f"/api/jobs/{job['job_id']}/result"
+    return view
+
+
+def _get_or_create_job(kind: str, cache_key: str, params: dict, client_key: str) -> tuple[dict | None, int | None]:
+    """
+    Return this client's live job for the cache key, or start one. Only a job that
+    will call the provider is charged to the rate limit: (None, retry_after) when the
+    client is over it, (None, None) when the pool is full.
+    """
+    _collect_jobs()
+    # Keyed with the session secret, so one client cannot derive another's job id
+    job_id = session_id_for(client_key, f"job:{cache_key}")
+    now = time.time()
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None and job["status"] != "failed":
+            job["polled"] = now
+            return job, None
+
+        job = {"job_id": job_id, "kind": kind, "cache_key": cache_key, "status": "queued",
+               "created": now, "polled": now}
+        if params.get("session_id"):
+            job["session_id"] = params["session_id"]
+        cached, _ = _cache_lookup(cache_key)
+        # Session jobs always go through _run_job, which filters the result for the session
+        if cached is not None and not params.get("session_id"):
+            job.update(status="done", finished=now, entry=cached)
+            _jobs[job_id] = job
+            return job, None
+
+        if cached is None:
+            allowed, retry_after = _rate_limit_check(client_key)
+            if not allowed:
+                return None, retry_after
+        future = get_executor("jobs", default_workers=2, default_pending=32).submit(_run_job, job, params)
+        if future is None:
+            return None, None
+        job["future"] = future
+        _jobs[job_id] = job
+    return job, None
+
+
+def _run_job(job: dict, params: dict) -> None:
+    job["status"] = "running"
+    job["started"] = time.time()
+    try:
+        entry, _ = _cache_lookup(job["cache_key"])
+        if entry is None:
+            entry = _await_precompute(job["cache_key"])
+        if entry is None:
+            entry = _generate_to_cache(job["kind"], job["cache_key"], params)
+        job["entry"] = _session_entry(job["kind"], job["cache_key"], params, entry)
+        job["status"] = "done"
+    except Exception as e:
+        job["error"] = str(e)
+        job["status"] = "failed"
+    finally:
+        job["finished"] = time.time()
+        job.pop("future", None)
+        with _jobs_lock:
+            if _jobs.get(job["job_id"]) is job:
+                _jobs.resize(job["job_id"])
+
+
+def _collect_jobs() -> None:
+    """
+    Drop finished jobs after AI_JOB_TTL_SECONDS and queued jobs nobody has polled
+    for AI_JOB_ABANDON_SECONDS (cancelled before they reach the provider).
+    """
+    try:
+        ttl = float(os.getenv("AI_JOB_TTL_SECONDS", "600"))
+    except Exception:
+        ttl = 600.0
+    try:
+        abandon = float(os.getenv("AI_JOB_ABANDON_SECONDS", "300"))
+    except Exception:
+        abandon = 300.0
+    now = time.time()
+    with _jobs_lock:
+        for job_id, job in list(_jobs.items()):
+            if job["status"] in ("done", "failed"):
+                if now - job.get("finished", now) > ttl:
+                    _jobs.pop(job_id, None)
+            elif job["status"] == "queued" and now - job["polled"] > abandon:
+                future = job.get("future")
+                if future is None or future.cancel():
+                    _jobs.pop(job_id, None)
+
+
+@app.route('/api/generate/learn', methods=['POST'])
+def generate_learn():
+    """
+    Generate learning plan with content and questions
+    
+    Request JSON:
+        - material_id: ID of uploaded material
+        OR
+        - material: Raw material text
+        - history_mode: Boolean for History Mode (3-view format)
+        - pages: Optional page range of a PDF material, e.g. "12-18" or [12, 18]
         
+    Response:
+        - plan: Array of learning sections with content and questions
+    """
+    try:
+        return _handle_generation("learn")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -235,52 +1413,16 @@ def generate_practice():
         - material_id: ID of uploaded material OR material: Raw text
         - count: Number of questions (10, 15, 20, 25, 30)
         - exclude_questions: Optional array of questions to exclude
+        - session_id: Optional practice session (replaces material and exclude_questions)
+        - history_mode: Optional; history material gets part of its set as local date questions
+        - pages: Optional page range of a PDF material, e.g. "12-18" or [12, 18]
         
     Response:
         - flashcards: Array of flashcard objects
         - questions: Array of question objects with explanations
     """
     try:
-        data = request.get_json()
-        
-      
-        client_key = _get_client_key(data)
-        allowed, retry_after = _rate_limit_check(client_key)
-        if not allowed:
-            return jsonify({"error": "Лимит запросов достигнут. Попробуйте позже."}), 429, {
-                "Retry-After": str(retry_after)
-            }
-
-
-        material_id = data.get('material_id')
-        material = data.get('material')
-        count = data.get('count', 10)
-        exclude_questions = data.get('exclude_questions', [])
-        language = data.get('language') or data.get('lang')
-        
-        if material_id and material_id in materials_store:
-            material = materials_store[material_id]
-        
-        if not material:
-            return jsonify({"error": "Материал табылмады"}), 400
-        
-        
-        if count not in [10, 15, 20, 25, 30]:
-            count = 10
-        
-        
-        cache_key = _cache_key("practice", data, material)
-        cached = _cache_get(cache_key)
-        if cached:
-            return jsonify(cached)
-
-       
-        gemini = get_gemini_service()
-        result = run_async(gemini.generate_practice_questions(material, count, exclude_questions, language))
-        _cache_set(cache_key, result)
-
-        return jsonify(result)
-        
+        return _handle_generation("practice")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -293,50 +1435,36 @@ def generate_realtest():
     Request JSON:
         - material_id: ID of uploaded material OR material: Raw text
         - count: Number of questions
+        - history_mode: Optional; history material gets part of its set as local date questions
+        - pages: Optional page range of a PDF material, e.g. "12-18" or [12, 18]
         
     Response:
         - questions: Array of question objects (no explanations)
     """
     try:
-        data = request.get_json()
-        
-        
-        client_key = _get_client_key(data)
-        allowed, retry_after = _rate_limit_check(client_key)
-        if not allowed:
-            return jsonify({"error": "Лимит запросов достигнут. Попробуйте позже."}), 429, {
-                "Retry-After": str(retry_after)
-            }
-
-        
-        material_id = data.get('material_id')
-        material = data.get('material')
-        count = data.get('count', 10)
-        language = data.get('language') or data.get('lang')
-        
-        if material_id and material_id in materials_store:
-            material = materials_store[material_id]
-        
-        if not material:
-            return jsonify({"error": "Материал табылмады"}), 400
-        
-       
-        if count not in [10, 15, 20, 25, 30]:
-            count = 10
-        
-       
-        cache_key = _cache_key("realtest", data, material)
-        cached = _cache_get(cache_key)
-        if cached:
-            return jsonify(cached)
+        return _handle_generation("realtest")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-       
-        gemini = get_gemini_service()
-        result = run_async(gemini.generate_realtest_questions(material, count, language))
-        _cache_set(cache_key, result)
 
-        return jsonify(result)
+@app.route('/api/generate/flashcards', methods=['POST'])
+def generate_flashcards():
+    """
+    Generate flashcards (question on the front, answer on the back)
+    
+    Request JSON:
+        - material_id: ID of uploaded material OR material: Raw text
+        - count: Number of flashcards (10, 15, 20, 25, 30)
+        - pages: Optional page range of a PDF material, e.g. "12-18" or [12, 18]
         
+    Response:
+        - flashcards: Array of {id, front, back}
+    
+    Built from the same question pool as practice and realtest, so asking for
+    flashcards also fills those caches.
+    """
+    try:
+        return _handle_generation("flashcards")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -350,49 +1478,53 @@ def generate_continue():
         - material_id: ID of uploaded material OR material: Raw text
         - count: Number of new questions
         - previous_questions: Array of previous question texts to exclude
+        OR
+        - session_id: Practice session from /api/sessions (the server tracks served questions)
+        - pages: Optional page range of a PDF material, e.g. "12-18" or [12, 18]
         
     Response:
         - flashcards: New flashcards
         - questions: New questions (different from previous)
     """
     try:
-        data = request.get_json()
-        
-        
-        client_key = _get_client_key(data)
-        allowed, retry_after = _rate_limit_check(client_key)
-        if not allowed:
-            return jsonify({"error": "Лимит запросов достигнут. Попробуйте позже."}), 429, {
-                "Retry-After": str(retry_after)
-            }
+        return _handle_generation("continue")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        material_id = data.get('material_id')
-        material = data.get('material')
-        count = data.get('count', 10)
-        previous_questions = data.get('previous_questions', [])
-        language = data.get('language') or data.get('lang')
-        
-        if material_id and material_id in materials_store:
-            material = materials_store[material_id]
-        
-        if not material:
-            return jsonify({"error": "Материал табылмады"}), 400
-        
-       
-        cache_key = _cache_key("continue", data, material)
-        cached = _cache_get(cache_key)
-        if cached:
-            return jsonify(cached)
 
+@app.route('/api/quiz/history', methods=['POST'])
+def history_quiz():
+    """
+    History questions built locally from the historical figures dataset (no LLM call)
+    
+    Request JSON:
+        - count: Number of questions (default 10, max 30)
+        - language: kk | ru | en
+        - level: Optional fact level (1, 2, 3)
+        - figure_ids: Optional array of figure IDs to ask about
+        - seed: Optional integer for a reproducible set
         
-        gemini = get_gemini_service()
-        result = run_async(gemini.generate_practice_questions(material, count, previous_questions, language))
-        _cache_set(cache_key, result)
+    Response:
+        - questions: Array of question objects with explanations
+    """
+    quiz = get_history_quiz()
+    if quiz is None or not len(quiz):
+        return jsonify({"error": "Тарихи деректер қолжетімсіз"}), 503
+    data = request.get_json(silent=True) or {}
+    try:
+        count = max(1, min(30, int(data.get('count', 10))))
+        level = int(data['level']) if data.get('level') is not None else None
+        seed = int(data['seed']) if data.get('seed') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "Параметрлер қате"}), 400
+    figure_ids = data.get('figure_ids')
+    if figure_ids is not None and not isinstance(figure_ids, list):
+        return jsonify({"error": "Параметрлер қате"}), 400
 
-        return jsonify(result)
-        
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    result = quiz.generate(count, _normalize_lang(data.get('language')), level, figure_ids, seed)
+    if not result["questions"]:
+        return jsonify({"error": "Сұрақтар құрылмады"}), 404
+    return jsonify(result)
 
 
 if __name__ == '__main__':
@@ -402,5 +1534,8 @@ if __name__ == '__main__':
     print(f"🚀 AI Teacher API starting on port {port}")
     print(f"📚 Ready to help with ENT preparation!")
     
+    # The debug reloader's parent process only watches files; warm up the serving child
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        _start_warm_up()
     app.run(host='0.0.0.0', port=port, debug=debug)
 
@@ -0,0 +1,243 @@
+"""
+End-to-end load test for the AI Teacher API
+
+Drives /api/upload and every /api/generate/* route at a fixed concurrency and
+reports throughput plus p50/p95/p99 latency per route.
+
+By default the app is loaded in-process with the fake LLM provider
+(AI_PROVIDER=fake), so no Gemini quota is used. Pass --url to hit a running
+server instead.
+
+Usage:
+    python bench/loadtest.py --concurrency 16 --iterations 200
+    python bench/loadtest.py --url http://localhost:5000 --concurrency 4
+    FAKE_LLM_LATENCY_MS=2000 FAKE_LLM_ERROR_RATE=0.05 python bench/loadtest.py --json out.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+ROUTES = ["learn", "practice", "realtest", "flashcards", "continue"]
+
+_SENTENCES = [
+    "1465 жылы Керей мен Жәнібек сұлтандар Қазақ хандығын құрды.",
+    "Әбілқайыр хан Дешті Қыпшақ даласының шығыс бөлігін биледі.",
+    "Тәуке хан тұсында «Жеті жарғы» заңдар жинағы қабылданды.",
+    "В 1731 году Абулхаир хан принял российское подданство.",
+    "Восстание Кенесары Касымова продолжалось с 1837 по 1847 год.",
+    "Ұлы Жібек жолы бойындағы қалалар сауда мен мәдениеттің орталығы болды.",
+    "Отырар апаты 1219 жылы монғол шапқыншылығы кезінде болды.",
+    "Алаш партиясы 1917 жылы құрылып, ұлттық автономияны көздеді.",
+]
+
+
+def build_material(chars: int, salt: int) -> str:
+    """Synthetic Cyrillic study material of roughly `chars` characters"""
+    rng = random.Random(salt)
+    parts = [f"[PAGE 1]\nМатериал #{salt}"]
+    size = len(parts[0])
+    page = 1
+    while size < chars:
+        if rng.random() < 0.05:
+            page += 1
+            parts.append(f"\n\n[PAGE {page}]")
+        sentence = rng.choice(_SENTENCES)
+        parts.append(sentence)
+        size += len(sentence) + 1
+    return " ".join(parts)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class InProcessClient:
+    """Calls the Flask app through its test client (one client per thread)"""
+
+    def __init__(self):
+        os.environ.setdefault("AI_PROVIDER", "fake")
+        os.environ.setdefault("AI_RATE_LIMIT_ENABLED", "false")
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import app as app_module
+
+        self._app = app_module.app
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._app.test_client()
+            self._local.client = client
+        return client
+
+    def post(self, path: str, payload: dict) -> tuple[int, dict]:
+        response = self._client().post(path, json=payload)
+        return response.status_code, response.get_json(silent=True) or {}
+
+
+class HttpClient:
+    """Calls a running server over HTTP"""
+
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def post(self, path: str, payload: dict) -> tuple[int, dict]:
+        body = json.dumps(payload).encode("utf-8")
+        req = urllib.request.Request(
+            self.base_url + path, data=body, headers={"Content-Type": "application/json"}, method="POST"
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return resp.status, json.loads(resp.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            try:
+                return e.code, json.loads(e.read() or b"{}")
+            except Exception:
+                return e.code, {}
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.statuses: dict[str, dict[int, int]] = {}
+
+    def record(self, route: str, seconds: float, status: int) -> None:
+        with self._lock:
+            self.samples.setdefault(route, []).append(seconds)
+            by_status = self.statuses.setdefault(route, {})
+            by_status[status] = by_status.get(status, 0) + 1
+            if status >= 400:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+def run_iteration(client, recorder: Recorder, idx: int, args) -> None:
+    """One simulated student: upload a material, then walk through the requested routes"""
+    material_salt = idx % args.distinct_materials
+    payload = {"text": build_material(args.material_chars, material_salt)}
+
+    start = time.perf_counter()
+    status, body = client.post("/api/upload", payload)
+    recorder.record("upload", time.perf_counter() - start, status)
+    material_id = body.get("material_id")
+    if not material_id:
+        return
+
+    base = {"material_id": material_id, "language": args.language, "user_id": f"load-{idx}"}
+    served: list[str] = []
+    for route in args.routes:
+        data = dict(base)
+        if route == "learn":
+            data["history_mode"] = bool(idx % 2)
+        elif route in ("practice", "realtest", "flashcards"):
+            data["count"] = args.count
+        elif route == "continue":
+            data["count"] = args.count
+            data["previous_questions"] = served
+
+        start = time.perf_counter()
+        status, body = client.post(f"/api/generate/{route}", data)
+        recorder.record(route, time.perf_counter() - start, status)
+        if route == "practice":
+            served = [q.get("question", "") for q in body.get("questions", []) if isinstance(q, dict)]
+
+
+def report(recorder: Recorder, wall: float) -> dict:
+    summary = {"wall_seconds": round(wall, 3), "routes": {}}
+    total = 0
+    for route, samples in recorder.samples.items():
+        total += len(samples)
+        summary["routes"][route] = {
+            "requests": len(samples),
+            "errors": recorder.errors.get(route, 0),
+            "statuses": {str(k): v for k, v in sorted(recorder.statuses.get(route, {}).items())},
+            "throughput_rps": round(len(samples) / wall, 3) if wall else 0.0,
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+            "max_ms": round(max(samples) * 1000, 2),
+        }
+    summary["total_requests"] = total
+    summary["throughput_rps"] = round(total / wall, 3) if wall else 0.0
+    return summary
+
+
+def print_report(summary: dict) -> None:
+    header = f"{'route':<10} {'reqs':>6} {'errs':>5} {'rps':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for route, row in summary["routes"].items():
+        print(
+            f"{route:<10} {row['requests']:>6} {row['errors']:>5} {row['throughput_rps']:>8.2f} "
+            f"{row['p50_ms']:>10.1f} {row['p95_ms']:>10.1f} {row['p99_ms']:>10.1f}"
+        )
+    print("-" * len(header))
+    print(f"total {summary['total_requests']} requests in {summary['wall_seconds']}s "
+          f"({summary['throughput_rps']:.2f} req/s)")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base URL of a running server; in-process fake provider if omitted")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=50, help="Number of simulated student sessions")
+    parser.add_argument("--routes", default=",".join(ROUTES), help="Comma-separated generate routes to call")
+    parser.add_argument("--count", type=int, default=10, help="Question count for practice/realtest/flashcards/continue")
+    parser.add_argument("--material-chars", type=int, default=20000)
+    parser.add_argument("--distinct-materials", type=int, default=0,
+                        help="Number of distinct materials (default: one per iteration, i.e. cold cache)")
+    parser.add_argument("--language", default="kk")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--json", dest="json_out", help="Write the summary to this file")
+    args = parser.parse_args(argv)
+
+    args.routes = [r.strip() for r in args.routes.split(",") if r.strip() in ROUTES]
+    if args.distinct_materials <= 0:
+        args.distinct_materials = args.iterations
+
+    client = HttpClient(args.url, args.timeout) if args.url else InProcessClient()
+    recorder = Recorder()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        futures = [pool.submit(run_iteration, client, recorder, i, args) for i in range(args.iterations)]
+        for future in futures:
+            future.result()
+    wall = time.perf_counter() - start
+
+    summary = report(recorder, wall)
+    summary["config"] = {
+        "url": args.url or "in-process",
+        "concurrency": args.concurrency,
+        "iterations": args.iterations,
+        "routes": args.routes,
+        "count": args.count,
+        "material_chars": args.material_chars,
+        "distinct_materials": args.distinct_materials,
+    }
+    print_report(summary)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
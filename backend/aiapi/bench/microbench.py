@@ -0,0 +1,298 @@
+"""
+Microbenchmarks for the CPU-side text-processing hot paths
+
+Covers GeminiService._chunk_text, GeminiService._clean_json_response,
+app._cache_key and pdf_service.extract_text_from_pdf against synthetic
+corpora (multi-MB Cyrillic text, large truncated JSON, multi-hundred-page PDFs),
+plus cold_start: a fresh interpreter importing the app and serving /api/health,
+and cold_start_ready: the same with the real Gemini SDK, until /api/ready answers
+200 (skipped when google-generativeai is not installed; no network calls).
+
+Each case records wall time (min/median/mean over --repeat runs) and peak
+Python heap usage (tracemalloc, measured in a separate run so it does not skew
+timings). Results are written as JSON and can be compared between revisions.
+
+Usage:
+    python bench/microbench.py --out bench-results.json
+    python bench/microbench.py --out new.json --compare bench-results.json --threshold 0.15
+    python bench/microbench.py --only chunk_text,cache_key --quick
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+AIAPI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, AIAPI_DIR)
+os.environ.setdefault("AI_PROVIDER", "fake")
+
+_WORDS = (
+    "Қазақ хандығы 1465 жылы Керей Жәнібек сұлтандар Әбілқайыр Дешті Қыпшақ "
+    "Моғолстан Жетісу өңірі Тәуке хан Жеті жарғы билер кеңесі Абылай "
+    "Казахское ханство образовано году султаны Керей Жанибек восстание "
+    "Кенесары Касымова продолжалось российское подданство Младший жуз"
+).split()
+
+
+def cyrillic_text(chars: int, seed: int = 7) -> str:
+    """Paragraphed Cyrillic prose with [PAGE N] markers, roughly `chars` long"""
+    rng = random.Random(seed)
+    out: list[str] = []
+    size = 0
+    page = 1
+    while size < chars:
+        paragraph = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(40, 120))) + "."
+        if rng.random() < 0.15:
+            page += 1
+            paragraph = f"[PAGE {page}]\n{paragraph}"
+        out.append(paragraph)
+        size += len(paragraph) + 2
+    return "\r\n\r\n".join(out)
+
+
+def truncated_json(questions: int, seed: int = 11) -> str:
+    """A fenced `questions` payload cut off in the middle of a string, like a max-token stop"""
+    rng = random.Random(seed)
+
+    def phrase(n):
+        return " ".join(rng.choice(_WORDS) for _ in range(n))
+
+    items = [
+        {
+            "id": i + 1,
+            "question": phrase(14) + "?",
+            "correct": phrase(4),
+            "wrong": [phrase(4) for _ in range(3)],
+            "explanation": phrase(30),
+        }
+        for i in range(questions)
+    ]
+    text = json.dumps({"questions": items}, ensure_ascii=False, indent=2)
+    cut = int(len(text) * 0.93)
+    while text[cut - 1] in '{}[]",: \n':
+        cut -= 1
+    return "```json\n" + text[:cut]
+
+
+def pdf_bytes(pages: int, seed: int = 5) -> bytes:
+    """Generate a text PDF with `pages` pages using PyMuPDF"""
+    import fitz
+
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        lines = [f"Тарих оқулығы — {n + 1}"]
+        for _ in range(38):
+            lines.append(" ".join(rng.choice(_WORDS) for _ in range(9)))
+        page.insert_text((40, 40), "\n".join(lines), fontsize=9, fontname="helv")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def build_cases(scale: float) -> dict:
+    """Return {name: (setup_fn, run_fn, params)}; setup builds inputs once, run is what gets timed"""
+    text_chars = int(4_000_000 * scale)
+    json_questions = int(2000 * scale)
+    pdf_pages = max(10, int(400 * scale))
+
+    def setup_service():
+        from services.fake_service import FakeGeminiService
+        return FakeGeminiService()
+
+    def chunk_setup():
+        from services.material import Material
+        return setup_service(), Material(cyrillic_text(text_chars))
+
+    def chunk_run(state):
+        service, text = state
+        service._chunk_text(text, max_chars=200000, overlap=1200)
+
+    def clean_setup():
+        return setup_service(), truncated_json(json_questions)
+
+    def clean_run(state):
+        service, text = state
+        json.loads(service._clean_json_response(text))
+
+    def cache_key_setup():
+        import app as app_module
+        from services.material import Material
+        params = {
+            # Uploaded materials carry their digest, so this times the per-request work
+            "material": Material(cyrillic_text(text_chars)),
+            "count": 30,
+            "language": "kk",
+            "exclude_questions": [f"Сұрақ {i}: " + " ".join(_WORDS[:12]) for i in range(300)],
+        }
+        return app_module, params
+
+    def cache_key_run(state):
+        app_module, params = state
+        app_module._cache_key("practice", params)
+
+    def pdf_setup():
+        from services.pdf_service import extract_text_from_pdf
+        return extract_text_from_pdf, pdf_bytes(pdf_pages)
+
+    def pdf_run(state):
+        extract, data = state
+        extract(data)
+
+    def cold_start_setup():
+        # A fresh interpreter per run; AI_WARMUP=off so only import + first request is timed
+        script = (
+            "import app; "
+            "r = app.app.test_client().get('/api/health'); "
+            "assert r.status_code == 200"
+        )
+        env = {**os.environ, "AI_PROVIDER": "fake", "AI_WARMUP": "off"}
+        return [sys.executable, "-c", script], env
+
+    def cold_start_run(state):
+        cmd, env = state
+        subprocess.run(cmd, cwd=AIAPI_DIR, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def cold_start_ready_setup():
+        # The lazy SDK path: the first request starts warm-up, which imports the SDK and
+        # builds the client; the ping is off so nothing leaves the machine
+        script = (
+            "import time, app; "
+            "c = app.app.test_client(); "
+            "deadline = time.monotonic() + 60\n"
+            "while c.get('/api/ready').status_code != 200:\n"
+            "    assert time.monotonic() < deadline, app._warmup_status\n"
+            "    time.sleep(0.005)"
+        )
+        env = {
+            **os.environ, "AI_PROVIDER": "gemini", "AI_WARMUP": "background", "GEMINI_WARMUP_PING": "false",
+            "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY") or "bench-placeholder",
+        }
+        return [sys.executable, "-c", script], env
+
+    cases = {
+        "chunk_text": (chunk_setup, chunk_run, {"chars": text_chars}),
+        "clean_json_response": (clean_setup, clean_run, {"questions": json_questions}),
+        "cache_key": (cache_key_setup, cache_key_run, {"chars": text_chars, "exclude_questions": 300}),
+        "extract_text_from_pdf": (pdf_setup, pdf_run, {"pages": pdf_pages}),
+        "cold_start": (cold_start_setup, cold_start_run, {"route": "/api/health"}),
+    }
+    if importlib.util.find_spec("google.generativeai") is not None:
+        cases["cold_start_ready"] = (cold_start_ready_setup, cold_start_run, {"route": "/api/ready"})
+    return cases
+
+
+def measure(setup, run, repeat: int) -> dict:
+    state = setup()
+    run(state)  # warm-up
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(state)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    run(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "min_ms": round(min(timings) * 1000, 3),
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "peak_kb": round((peak - base) / 1024, 1),
+        "repeat": repeat,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=AIAPI_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Print a side-by-side table; return names of cases that regressed beyond threshold"""
+    regressions = []
+    if current.get("scale") != baseline.get("scale"):
+        print(f"\nwarning: comparing scale {current.get('scale')} against scale {baseline.get('scale')}")
+    print(f"\n{'case':<24} {'base ms':>10} {'new ms':>10} {'Δ time':>8} {'base KB':>10} {'new KB':>10} {'Δ mem':>8}")
+    for name, row in current["cases"].items():
+        old = baseline.get("cases", {}).get(name)
+        if not old:
+            print(f"{name:<24} {'-':>10} {row['median_ms']:>10.2f}")
+            continue
+        dt = (row["median_ms"] - old["median_ms"]) / old["median_ms"] if old["median_ms"] else 0.0
+        dm = (row["peak_kb"] - old["peak_kb"]) / old["peak_kb"] if old["peak_kb"] else 0.0
+        flag = ""
+        if dt > threshold or dm > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            f"{name:<24} {old['median_ms']:>10.2f} {row['median_ms']:>10.2f} {dt:>+8.1%} "
+            f"{old['peak_kb']:>10.1f} {row['peak_kb']:>10.1f} {dm:>+8.1%}{flag}"
+        )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench-results.json", help="Where to write the results")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative slowdown counted as a regression")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="Comma-separated subset of cases")
+    parser.add_argument("--quick", action="store_true", help="Use corpora 10x smaller")
+    args = parser.parse_args(argv)
+
+    scale = 0.1 if args.quick else 1.0
+    cases = build_cases(scale)
+    selected = [c.strip() for c in args.only.split(",")] if args.only else list(cases)
+
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "cases": {},
+    }
+    for name in selected:
+        if name not in cases:
+            print(f"unknown case: {name}", file=sys.stderr)
+            return 2
+        setup, run, params = cases[name]
+        row = measure(setup, run, max(1, args.repeat))
+        row["params"] = params
+        results["cases"][name] = row
+        print(f"{name:<24} median {row['median_ms']:>10.2f} ms   min {row['min_ms']:>10.2f} ms   peak {row['peak_kb']:>10.1f} KB")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nregressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
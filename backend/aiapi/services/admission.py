@@ -0,0 +1,172 @@
+"""
+Admission control for provider-bound work
+A process-wide concurrency limiter with a bounded, priority-ordered wait queue in
+front of every LLM call. When the queue is full, callers are rejected at once
+(the API answers 503 + Retry-After) instead of piling onto a rate-limited provider.
+
+Priorities (lower runs first): realtest < interactive < background. The current
+priority is carried in a context variable set by the caller.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from services.metrics import ADMISSION_QUEUE, ADMISSION_REJECTIONS, ADMISSION_WAIT
+from services.stores import track
+
+
+PRIORITIES = {"realtest": 0, "interactive": 1, "background": 2}
+
+_priority: ContextVar[str] = ContextVar("aiapi_admission_priority", default="interactive")
+
+
+class AdmissionRejected(Exception):
+    """Raised when provider capacity is exhausted; carries a Retry-After hint in seconds"""
+
+    def __init__(self, retry_after: int, reason: str = "queue full"):
+        super().__init__(f"Provider capacity exhausted ({reason})")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "rejected")
+
+    def __init__(self, priority: int, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.rejected = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait: float, retry_after: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.active = 0
+        self._waiters: list[_Waiter] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    def _reject(self, priority_name: str, reason: str) -> AdmissionRejected:
+        ADMISSION_REJECTIONS.inc(priority=priority_name, reason=reason)
+        return AdmissionRejected(self.retry_after, reason)
+
+    def acquire(self, priority_name: str, timeout: float | None = None) -> None:
+        priority = PRIORITIES.get(priority_name, PRIORITIES["interactive"])
+        wait = self.max_wait if timeout is None else min(self.max_wait, max(0.0, timeout))
+        with self._cond:
+            if self.active < self.max_concurrent and not self._waiters:
+                self.active += 1
+                return
+
+            if len(self._waiters) >= self.max_queue:
+                # Make room by shedding the least important waiter, if it ranks below us
+                worst = max(self._waiters) if self._waiters else None
+                if worst is None or worst.priority <= priority:
+                    raise self._reject(priority_name, "queue full")
+                self._waiters.remove(worst)
+                heapq.heapify(self._waiters)
+                worst.rejected = True
+                self._cond.notify_all()
+
+            me = _Waiter(priority, next(self._seq))
+            heapq.heappush(self._waiters, me)
+            ADMISSION_QUEUE.set(len(self._waiters))
+            started = time.perf_counter()
+            deadline = time.monotonic() + wait
+            try:
+                while True:
+                    if me.rejected:
+                        raise self._reject(priority_name, "shed")
+                    if self._waiters and self._waiters[0] is me and self.active < self.max_concurrent:
+                        heapq.heappop(self._waiters)
+                        self.active += 1
+                        # Let the next waiter re-check in case more slots are free
+                        self._cond.notify_all()
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._waiters.remove(me)
+                        heapq.heapify(self._waiters)
+                        self._cond.notify_all()
+                        raise self._reject(priority_name, "timeout")
+                    self._cond.wait(remaining)
+            finally:
+                ADMISSION_QUEUE.set(len(self._waiters))
+                ADMISSION_WAIT.observe(time.perf_counter() - started, priority=priority_name)
+
+    def release(self) -> None:
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timeout: float | None = None):
+        if not self.enabled:
+            yield
+            return
+        self.acquire(_priority.get(), timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+_controller: AdmissionController | None = None
+_controller_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    """Process-wide controller configured from AI_PROVIDER_* env vars (0 concurrency disables it)"""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                try:
+                    max_concurrent = int(os.getenv("AI_PROVIDER_CONCURRENCY", "16"))
+                except Exception:
+                    max_concurrent = 16
+                try:
+                    max_queue = int(os.getenv("AI_PROVIDER_QUEUE_MAX", "64"))
+                except Exception:
+                    max_queue = 64
+                try:
+                    max_wait = float(os.getenv("AI_PROVIDER_QUEUE_TIMEOUT", "30"))
+                except Exception:
+                    max_wait = 30.0
+                try:
+                    retry_after = int(os.getenv("AI_PROVIDER_RETRY_AFTER", "5"))
+                except Exception:
+                    retry_after = 5
+                _controller = AdmissionController(max_concurrent, max_queue, max_wait, retry_after)
+                track("admission_waiters", lambda: _controller._waiters)
+    return _controller
+
+
+def provider_slot(timeout: float | None = None):
+    """Context manager guarding a single provider call"""
+    return get_admission().slot(timeout)
+
+
+@contextmanager
+def admission_priority(name: str):
+    """Run the block (and the provider calls it makes) at the given priority"""
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
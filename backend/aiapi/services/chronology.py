@@ -0,0 +1,256 @@
+"""
+Local chronology questions
+Scans material (plain or [PAGE N]-marked PDF text) for sentences tied to a year
+("1465 жылы", "в 1465 году", "1465 г.", "in 1465") and builds a timeline index.
+"Which year" and "which came first" questions are generated from that index in
+milliseconds, so the provider only has to write the conceptual ones.
+"""
+
+import hashlib
+import os
+import random
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from services.material import material_digest
+from services.metrics import LOCAL_QUESTIONS
+from services.sessions import question_fingerprint
+from services.validation import validate_questions
+
+
+WRONG_OPTIONS = 3
+
+_PAGE_RE = re.compile(r"\[PAGE (\d+)\]")
+_YEAR_RE = re.compile(
+    r"\b(1[0-9]{3}|20[0-9]{2})\s*(?:-?\s*(?:жылы|жылдың|жылғы|жылға|жыл|ж\.)|(?:-?м|-?й)?\s*(?:году|года|год|г\.))"
+    r"|\b(?:in|In)\s+(1[0-9]{3}|20[0-9]{2})\b"
+)
+_BARE_YEAR_RE = re.compile(r"\b(?:1[0-9]{3}|20[0-9]{2})\b")
+_SENTENCE_RE = re.compile(r"[^.!?\n]+(?:[.!?]+|$)")
+# A single line break inside a paragraph (PDF line wrap); blank lines and [PAGE N] markers stay
+_WRAP_RE = re.compile(r"(?<!\n)(?<!\])\n(?![ \t]*\n|\[PAGE )")
+
+MIN_SENTENCE = 25
+MAX_SENTENCE = 280
+MAX_CACHED = 32
+
+_events_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_events_lock = threading.Lock()
+
+# Prompt rule for the provider call when part of the set is built here
+DATES_RULE = "- Жылын немесе датасын сұрайтын сұрақ құрма (хронология сұрақтары бөлек дайындалған), тек ұғымдық сұрақтар құр"
+
+_TEMPLATES = {
+    "year": {
+        "kk": "Қай жылы болды: «{event}»?",
+        "ru": "В каком году: «{event}»?",
+        "en": "In which year: “{event}”?",
+    },
+    "earliest": {
+        "kk": "Төмендегі оқиғалардың қайсысы ең ерте болды?",
+        "ru": "Какое из событий произошло раньше всех?",
+        "en": "Which of these events happened first?",
+    },
+    "latest": {
+        "kk": "Төмендегі оқиғалардың қайсысы ең кеш болды?",
+        "ru": "Какое из событий произошло позже всех?",
+        "en": "Which of these events happened last?",
+    },
+    "page": {"kk": "{page}-бет", "ru": "стр. {page}", "en": "p. {page}"},
+}
+
+
+@dataclass(frozen=True)
+class DatedEvent:
+    year: int
+    text: str       # sentence as written in the material
+    masked: str     # same sentence with the date replaced by "…"
+    page: Optional[int]
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def extract_events(text: str) -> tuple[DatedEvent, ...]:
+    """Sentences that mention exactly one year, in order of appearance (cached per material digest)"""
+    key = material_digest(text)
+    with _events_lock:
+        cached = _events_cache.get(key)
+        if cached is not None:
+            _events_cache.move_to_end(key)
+            return cached
+    events = _scan_events(text)
+    with _events_lock:
+        _events_cache[key] = events
+        while len(_events_cache) > MAX_CACHED:
+            _events_cache.popitem(last=False)
+    return events
+
+
+def _scan_events(text: str) -> tuple[DatedEvent, ...]:
+    pages = [(m.start(), int(m.group(1))) for m in _PAGE_RE.finditer(text)]
+    # Same length as the text, so match offsets still map onto the page index
+    joined = _WRAP_RE.sub(" ", text)
+    events = []
+    seen = set()
+    page_idx = -1
+    for match in _SENTENCE_RE.finditer(joined):
+        start = match.start()
+        while page_idx + 1 < len(pages) and pages[page_idx + 1][0] <= start:
+            page_idx += 1
+        sentence = " ".join(_PAGE_RE.sub("", match.group(0)).split())
+        if not MIN_SENTENCE <= len(sentence) <= MAX_SENTENCE:
+            continue
+        years = {int(m.group(1) or m.group(2)) for m in _YEAR_RE.finditer(sentence)}
+        # "1465 және 1466 жылдар" names two years even though only one carries the suffix
+        if len(years) != 1 or {int(y) for y in _BARE_YEAR_RE.findall(sentence)} != years:
+            continue
+        masked = _YEAR_RE.sub(lambda m: m.group(0).replace(m.group(1) or m.group(2), "…"), sentence)
+        key = sentence.casefold()
+        if key in seen:
+            continue
+        seen.add(key)
+        events.append(DatedEvent(years.pop(), sentence, masked, pages[page_idx][1] if page_idx >= 0 else None))
+    return tuple(events)
+
+
+def timeline(text: str) -> list[dict]:
+    """Timeline index of the material: [{year, event, page}] sorted by year"""
+    return [
+        {"year": e.year, "event": e.text, "page": e.page}
+        for e in sorted(extract_events(text), key=lambda e: e.year)
+    ]
+
+
+def _wrong_years(rng: random.Random, year: int, years: list[int]) -> list[str]:
+    """Other years from the material, nearest first; invented neighbours if there are too few"""
+    others = sorted({y for y in years if y != year}, key=lambda y: abs(y - year))[: WRONG_OPTIONS * 2]
+    picked = rng.sample(others, min(WRONG_OPTIONS, len(others)))
+    while len(picked) < WRONG_OPTIONS:
+        candidate = year + rng.choice((-1, 1)) * rng.randint(1, 30)
+        if candidate != year and candidate not in picked:
+            picked.append(candidate)
+    return [str(y) for y in picked]
+
+
+def _explanation(event: DatedEvent, lang: str) -> str:
+    text = f"{event.year} — {event.text}"
+    if event.page is not None:
+        text += f" ({_TEMPLATES['page'][lang].format(page=event.page)})"
+    return text
+
+
+def chronology_questions(material: str, count: int, exclude_questions: Optional[list] = None,
+                         lang: str = "kk", with_explanation: bool = True) -> list[dict]:
+    """
+    Up to `count` date and ordering questions built from the material's timeline.
+    Deterministic for a given material and exclude list, so cached and regenerated
+    sets agree; questions in exclude_questions are skipped.
+    """
+    events = extract_events(material)
+    years = sorted({e.year for e in events})
+    if count <= 0 or len(years) < 2:
+        return []
+    lang = lang if lang in ("kk", "ru", "en") else "kk"
+    seed = hashlib.blake2b(
+        (material[:2000] + "\n".join(exclude_questions or [])).encode("utf-8"), digest_size=8
+    ).digest()
+    rng = random.Random(int.from_bytes(seed, "big"))
+    excluded = {question_fingerprint(q) for q in exclude_questions or [] if isinstance(q, str)}
+
+    by_year: dict[int, list[DatedEvent]] = {}
+    for event in events:
+        by_year.setdefault(event.year, []).append(event)
+
+    questions: list[dict] = []
+    seen = set(excluded)
+    for event in rng.sample(list(events), len(events)):
+        if len(questions) >= count:
+            break
+        ordering = len(by_year) > WRONG_OPTIONS and rng.random() < 0.35
+        if ordering:
+            kind = rng.choice(("earliest", "latest"))
+            picks = [rng.choice(by_year[y]) for y in rng.sample([y for y in by_year if y != event.year], WRONG_OPTIONS)]
+            group = sorted(picks + [event], key=lambda e: e.year)
+            answer = group[0] if kind == "earliest" else group[-1]
+            item = {
+                "question": _TEMPLATES[kind][lang],
+                "correct": answer.masked,
+                "wrong": [e.masked for e in group if e is not answer],
+            }
+            explanation = "; ".join(_explanation(e, lang) for e in group)
+        else:
+            item = {
+                "question": _TEMPLATES["year"][lang].format(event=event.masked),
+                "correct": str(event.year),
+                "wrong": _wrong_years(rng, event.year, years),
+            }
+            explanation = _explanation(event, lang)
+        # Sets are deduplicated by stem, so each fixed ordering stem is used once per set
+        fp = question_fingerprint(item["question"])
+        if fp in seen:
+            continue
+        seen.add(fp)
+        if with_explanation:
+            item["explanation"] = explanation
+        questions.append({"id": len(questions) + 1, **item})
+    return questions
+
+
+def local_share(material: str, count: int, history_mode: bool = False) -> int:
+    """
+    How many of `count` questions to build locally: AI_CHRONOLOGY_SHARE of them for
+    history materials (default 0.3) and AI_CHRONOLOGY_SHARE_OTHER for the rest
+    (default 0, years in a maths or biology text do not make good questions), only
+    for materials with at least AI_CHRONOLOGY_MIN_EVENTS dated sentences (default 8)
+    """
+    try:
+        count = max(0, int(count))
+    except Exception:
+        return 0
+    if history_mode:
+        share = _env_float("AI_CHRONOLOGY_SHARE", 0.3)
+    else:
+        share = _env_float("AI_CHRONOLOGY_SHARE_OTHER", 0.0)
+    share = min(1.0, max(0.0, share))
+    if share <= 0 or len(extract_events(material)) < _env_float("AI_CHRONOLOGY_MIN_EVENTS", 8):
+        return 0
+    return int(count * share)
+
+
+def split_chronology(material: str, count, exclude_questions: Optional[list], lang: str,
+                     with_explanation: bool, history_mode: bool = False) -> tuple[list[dict], int]:
+    """(local chronology questions, how many the provider still has to write)"""
+    try:
+        count = max(1, int(count))
+    except Exception:
+        count = 10
+    share = local_share(material, count, history_mode)
+    local = chronology_questions(material, share, exclude_questions, lang, with_explanation)
+    if local:
+        LOCAL_QUESTIONS.inc(len(local), kind="chronology")
+    return local, count - len(local)
+
+
+def merge_local(result: dict, local: list[dict], with_explanation: bool) -> dict:
+    """Spread the local questions through the provider's ones and renumber the set"""
+    generated = list(result.get("questions") or [])
+    if not local:
+        return result
+    step = max(1, (len(generated) + len(local)) // len(local))
+    merged = []
+    pending = list(local)
+    for item in generated:
+        if pending and len(merged) % step == step - 1:
+            merged.append(pending.pop(0))
+        merged.append(item)
+    merged.extend(pending)
+    questions, _ = validate_questions(merged, len(merged), with_explanation)
+    return {**result, "questions": questions}
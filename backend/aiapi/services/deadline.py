@@ -0,0 +1,69 @@
+"""
+Per-request time budget
+The API sets a deadline when a request starts; service code reads the remaining
+budget to size provider timeouts and to stop optional work (chunk summaries) early.
+A request that had to cut corners is flagged as degraded (with a short reason) so its
+result is not cached.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of its time budget before the provider answered"""
+
+
+class _Budget:
+    __slots__ = ("deadline", "degraded")
+
+    def __init__(self, deadline: Optional[float]):
+        self.deadline = deadline
+        self.degraded: Optional[str] = None
+
+
+_budget: ContextVar[Optional[_Budget]] = ContextVar("aiapi_request_budget", default=None)
+
+
+@contextmanager
+def request_budget(seconds: Optional[float]):
+    """Run the block with a deadline `seconds` from now (None or <= 0 means unlimited)"""
+    deadline = time.monotonic() + seconds if seconds and seconds > 0 else None
+    token = _budget.set(_Budget(deadline))
+    try:
+        yield
+    finally:
+        _budget.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current budget, or None when there is no deadline"""
+    budget = _budget.get()
+    if budget is None or budget.deadline is None:
+        return None
+    return budget.deadline - time.monotonic()
+
+
+def check(min_seconds: float = 0.0) -> Optional[float]:
+    """Return the remaining budget, raising DeadlineExceeded if it is below min_seconds"""
+    left = remaining()
+    if left is not None and left <= min_seconds:
+        raise DeadlineExceeded("Request time budget exhausted")
+    return left
+
+
+def mark_degraded(reason: str = "deadline") -> None:
+    budget = _budget.get()
+    if budget is not None and budget.degraded is None:
+        budget.degraded = reason
+
+
+def is_degraded() -> bool:
+    return degraded_reason() is not None
+
+
+def degraded_reason() -> Optional[str]:
+    budget = _budget.get()
+    return budget.degraded if budget is not None else None
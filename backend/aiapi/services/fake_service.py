@@ -0,0 +1,242 @@
+"""
+Fake LLM provider
+Deterministic offline stand-in for Gemini, used for benchmarks and load tests.
+
+Enable with AI_PROVIDER=fake. Behaviour is tuned through environment variables:
+    FAKE_LLM_SEED                 - RNG seed (default 1234)
+    FAKE_LLM_LATENCY_DIST         - fixed | uniform | normal | lognormal (default lognormal)
+    FAKE_LLM_LATENCY_MS           - median latency per call in ms (default 800)
+    FAKE_LLM_LATENCY_JITTER_MS    - spread of the distribution in ms (default 400)
+    FAKE_LLM_TRUNCATE_RATE        - share of responses cut off mid-JSON (default 0)
+    FAKE_LLM_ERROR_RATE           - share of calls raising a provider error (default 0)
+    FAKE_LLM_DEFECT_RATE          - share of generated questions with missing or duplicate options (default 0)
+    FAKE_LLM_CONTEXT_CACHE        - support provider-side context caching (default true)
+
+Counters on FakeModel (calls, input_chars, context_calls, contexts_created, ...) show
+how much prompt text was actually sent and whether cached prefixes were reused.
+"""
+
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+from services.gemini_service import GeminiService
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+class FakeResponse:
+    """Mimics the `.text` attribute of a Gemini response"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeModel:
+    """Drop-in replacement for `genai.GenerativeModel` that never leaves the process"""
+
+    def __init__(self, seed: Optional[int] = None):
+        if seed is None:
+            try:
+                seed = int(os.getenv("FAKE_LLM_SEED", "1234"))
+            except Exception:
+                seed = 1234
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.latency_dist = os.getenv("FAKE_LLM_LATENCY_DIST", "lognormal").strip().lower()
+        self.latency_ms = max(0.0, _env_float("FAKE_LLM_LATENCY_MS", 800.0))
+        self.jitter_ms = max(0.0, _env_float("FAKE_LLM_LATENCY_JITTER_MS", 400.0))
+        self.truncate_rate = min(1.0, max(0.0, _env_float("FAKE_LLM_TRUNCATE_RATE", 0.0)))
+        self.error_rate = min(1.0, max(0.0, _env_float("FAKE_LLM_ERROR_RATE", 0.0)))
+        self.defect_rate = min(1.0, max(0.0, _env_float("FAKE_LLM_DEFECT_RATE", 0.0)))
+
+        self.context_cache = os.getenv("FAKE_LLM_CONTEXT_CACHE", "true").strip().lower() in ("1", "true", "yes")
+
+        self.calls = 0
+        self.errors = 0
+        self.truncations = 0
+        self.input_chars = 0
+        self.context_calls = 0
+        self.contexts_created = 0
+
+    def _sample_latency(self, rng: random.Random) -> float:
+        """Return a latency in seconds drawn from the configured distribution"""
+        mean = self.latency_ms
+        spread = self.jitter_ms
+        if self.latency_dist == "fixed" or mean <= 0:
+            ms = mean
+        elif self.latency_dist == "uniform":
+            ms = rng.uniform(mean - spread, mean + spread)
+        elif self.latency_dist == "normal":
+            ms = rng.gauss(mean, spread)
+        else:
+            ms = mean * math.exp(rng.gauss(0.0, math.log1p(spread / mean)))
+        return min(max(0.0, ms), mean + 10 * spread) / 1000.0
+
+    def generate_content(self, prompt, _prefix: Optional[str] = None, **kwargs) -> FakeResponse:
+        prompt = prompt if isinstance(prompt, str) else str(prompt)
+        with self._lock:
+            self.calls += 1
+            self.input_chars += len(prompt)
+            if _prefix is not None:
+                self.context_calls += 1
+            rng = random.Random(self._rng.random())
+        if _prefix is not None:
+            prompt = _prefix + prompt
+
+        latency = self._sample_latency(rng)
+        timeout = (kwargs.get("request_options") or {}).get("timeout")
+        if timeout is not None and latency > timeout:
+            time.sleep(max(0.0, timeout))
+            raise Exception("504 Deadline Exceeded (fake)")
+        time.sleep(latency)
+
+        if rng.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            raise Exception("503 The model is overloaded. Please try again later. (fake)")
+
+        config = kwargs.get("generation_config") or {}
+        json_mode = config.get("response_mime_type") == "application/json"
+        text = _build_response(prompt, rng, fenced=not json_mode, defect_rate=self.defect_rate)
+
+        # Output past max_output_tokens (~3 chars per token) is cut off like the real API;
+        # schema-constrained output is otherwise never malformed
+        limit = config.get("max_output_tokens")
+        if limit and len(text) > limit * 3:
+            with self._lock:
+                self.truncations += 1
+            text = text[: limit * 3]
+        elif not json_mode and "{" in text[:16] and rng.random() < self.truncate_rate:
+            with self._lock:
+                self.truncations += 1
+            text = text[: int(len(text) * rng.uniform(0.5, 0.95))]
+
+        return FakeResponse(text)
+
+
+_COUNT_RE = re.compile(r"Нақты (\d+) сұрақ")
+
+
+def _material_words(prompt: str) -> list[str]:
+    """Pick words from the material section of the prompt to make answers look grounded"""
+    for marker in ("МАТЕРИАЛ:", "МӘТІН:", "КОНСПЕКТ:"):
+        idx = prompt.find(marker)
+        if idx != -1:
+            body = prompt[idx + len(marker): idx + len(marker) + 20000]
+            break
+    else:
+        body = prompt[-20000:]
+    words = [w for w in re.findall(r"\w{4,}", body) if not w.isdigit()]
+    return words or ["материал", "тақырып", "оқиға", "тұлға", "кезең"]
+
+
+def _phrase(rng: random.Random, words: list[str], n: int) -> str:
+    return " ".join(rng.choice(words) for _ in range(n))
+
+
+def _question(rng: random.Random, words: list[str], idx: int, with_explanation: bool) -> dict:
+    item = {
+        "id": idx,
+        "question": f"{idx}. {_phrase(rng, words, 6)}?",
+        "correct": _phrase(rng, words, 3),
+        "wrong": [_phrase(rng, words, 3) for _ in range(3)],
+    }
+    if with_explanation:
+        item["explanation"] = _phrase(rng, words, 12)
+    return item
+
+
+def _json_text(payload: dict, fenced: bool) -> str:
+    text = json.dumps(payload, ensure_ascii=False, indent=2)
+    return "```json\n" + text + "\n```" if fenced else text
+
+
+def _damage(rng: random.Random, item: dict) -> dict:
+    """Break a question the way real outputs go wrong"""
+    kind = rng.randrange(3)
+    if kind == 0:
+        item.pop("wrong", None)
+    elif kind == 1:
+        item["wrong"] = [item["correct"], item["wrong"][0], item["wrong"][0]]
+    else:
+        item["correct"] = ""
+    return item
+
+
+def _build_response(prompt: str, rng: random.Random, fenced: bool = True, defect_rate: float = 0.0) -> str:
+    """Produce a schema-valid answer for whichever GeminiService prompt was sent"""
+    words = _material_words(prompt)
+    tail = prompt.rstrip()
+
+    if tail.endswith("КОНСПЕКТ:") or tail.endswith("ЫҚШАМ НӘТИЖЕ:"):
+        lines = [f"- {_phrase(rng, words, 10)}" for _ in range(40)]
+        return "Key facts\n" + "\n".join(lines)
+
+    if '"plan"' in prompt:
+        history = '"timeline"' in prompt
+        sections = []
+        for s_idx in range(rng.randint(3, 5) if history else rng.randint(2, 4)):
+            if history:
+                content = {
+                    "general": ". ".join(_phrase(rng, words, 10) for _ in range(6)) + ".",
+                    "summary": [_phrase(rng, words, 6) for _ in range(6)],
+                    "timeline": [
+                        {"period": f"{rng.randint(1200, 1991)} жыл", "event": _phrase(rng, words, 12)}
+                        for _ in range(4)
+                    ],
+                }
+            else:
+                content = {"type": "text", "data": ". ".join(_phrase(rng, words, 10) for _ in range(8)) + "."}
+            sections.append({
+                "title": _phrase(rng, words, 3).capitalize(),
+                "content": content,
+                "questions": [_question(rng, words, q + 1, True) for q in range(3)],
+            })
+        return _json_text({"plan": sections}, fenced)
+
+    match = _COUNT_RE.search(prompt)
+    count = int(match.group(1)) if match else 10
+    with_explanation = '"explanation"' in prompt
+    questions = [_question(rng, words, i + 1, with_explanation) for i in range(count)]
+    questions = [_damage(rng, q) if rng.random() < defect_rate else q for q in questions]
+    return _json_text({"questions": questions}, fenced)
+
+
+class FakeCachedModel:
+    """FakeModel bound to a registered prefix; calls send only the per-call suffix"""
+
+    def __init__(self, model: FakeModel, prefix: str):
+        self._model = model
+        self._prefix = prefix
+
+    def generate_content(self, prompt, **kwargs) -> FakeResponse:
+        return self._model.generate_content(prompt, _prefix=self._prefix, **kwargs)
+
+
+class FakeGeminiService(GeminiService):
+    """GeminiService backed by FakeModel: same prompts, retries and parsing, no network"""
+
+    def _select_api_key(self) -> Optional[str]:
+        return "fake"
+
+    def _init_client(self) -> None:
+        self.model = FakeModel()
+
+    def _create_context(self, prefix: str, ttl: int):
+        if not self.model.context_cache:
+            raise Exception("400 Context caching is not supported for this model (fake)")
+        with self.model._lock:
+            self.model.contexts_created += 1
+        return FakeCachedModel(self.model, prefix), None
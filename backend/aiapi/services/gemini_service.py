@@ -3,15 +3,35 @@ Google Gemini API Service
 Handles all AI generation for learning content, questions, and tests
 """
 
-import google.generativeai as genai
 import json
 import os
 import time
 import datetime
 import math
 import hashlib
+import threading
 from collections import OrderedDict
-from typing import Optional, Tuple
+from typing import Optional
+
+from services.admission import AdmissionRejected, provider_slot
+from services.chronology import DATES_RULE, merge_local, split_chronology
+from services.deadline import DeadlineExceeded, check, mark_degraded, remaining
+from services.material import Material, material_digest
+from services.metrics import (
+    CACHE_EVENTS,
+    JSON_REPAIRS,
+    MATERIAL_CHUNKS,
+    PROVIDER_ERRORS,
+    PROVIDER_LATENCY,
+    QUESTIONS_DROPPED,
+    TOPUPS,
+    classify_error,
+    key_label,
+)
+from services.schemas import RESPONSE_SCHEMAS, normalize_learn_plan, output_token_budget
+from services.stores import CompressedCache
+from services.tracing import record_provider_call, span
+from services.validation import salvage_questions, validate_plan, validate_questions
 
 
 class GeminiService:
@@ -22,19 +42,9 @@ class GeminiService:
         self.api_key = api_key or self._select_api_key()
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY is required")
+        self._key_label = key_label(self.api_key)
         
-        genai.configure(api_key=self.api_key)
-        
-        
-        generation_config = genai.GenerationConfig(
-            temperature=0.7,
-            max_output_tokens=16384,  
-        )
-        
-        self.model = genai.GenerativeModel(
-            'gemini-3-flash-preview',
-            generation_config=generation_config
-        )
+        self._init_client()
         
         
         try:
@@ -46,6 +56,33 @@ class GeminiService:
         except Exception:
             self.retry_delay = 2.0 
         
+        # Constrain JSON generations to a response schema (no fences, rarely truncated)
+        schema_flag = os.getenv("GEMINI_JSON_SCHEMA", "true").strip().lower()
+        self.json_schema = schema_flag in ("1", "true", "yes")
+
+        # Follow-up calls asking only for the questions a response came back short of
+        try:
+            self.topup_rounds = max(0, int(os.getenv("GEMINI_TOPUP_ROUNDS", "1")))
+        except Exception:
+            self.topup_rounds = 1
+
+        # Provider-side context caching of the material prefix (0 TTL disables)
+        try:
+            self.context_cache_ttl = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "600"))
+        except Exception:
+            self.context_cache_ttl = 600
+        try:
+            self.context_cache_min_chars = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_CHARS", "16000"))
+        except Exception:
+            self.context_cache_min_chars = 16000
+        try:
+            self.context_cache_max = max(1, int(os.getenv("GEMINI_CONTEXT_CACHE_MAX", "64")))
+        except Exception:
+            self.context_cache_max = 64
+        self._contexts: OrderedDict = OrderedDict()
+        self._contexts_creating: dict = {}
+        self._contexts_lock = threading.Lock()
+
         summarize_flag = os.getenv("GEMINI_SUMMARIZE_LARGE", "false").strip().lower()
         self.summarize_large = summarize_flag in ("1", "true", "yes")
         try:
@@ -61,14 +98,36 @@ class GeminiService:
             self.max_chunk_chars = int(os.getenv("GEMINI_MAX_CHUNK_CHARS", "200000"))
         except Exception:
             self.max_chunk_chars = 200000
+        # Seconds of the request budget kept back for the final generation; once the
+        # map phase would eat into it, the rest of the material is truncated instead
+        try:
+            self.generation_reserve = max(0.0, float(os.getenv("GEMINI_GENERATION_RESERVE_SECONDS", "25")))
+        except Exception:
+            self.generation_reserve = 25.0
 
-        # In-memory cache for summarized materials (reduces repeat calls)
+        # In-memory cache for summarized materials (reduces repeat calls),
+        # bounded by compressed bytes; GEMINI_SUMMARY_CACHE_MAX adds an optional entry cap
         try:
-            self.summary_cache_max = int(os.getenv("GEMINI_SUMMARY_CACHE_MAX", "32"))
+            self.summary_cache_max_bytes = int(os.getenv("GEMINI_SUMMARY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
         except Exception:
-            self.summary_cache_max = 32
+            self.summary_cache_max_bytes = 32 * 1024 * 1024
+        try:
+            self.summary_cache_max = int(os.getenv("GEMINI_SUMMARY_CACHE_MAX", "0"))
+        except Exception:
+            self.summary_cache_max = 0
         self.summary_cache_max = max(0, min(200, self.summary_cache_max))
-        self._summary_cache: "OrderedDict[str, str]" = OrderedDict()
+        if os.getenv("GEMINI_SUMMARY_CACHE_MAX") is not None and self.summary_cache_max <= 0:
+            self.summary_cache_max_bytes = 0
+        try:
+            compress_level = int(os.getenv("AI_CACHE_COMPRESS_LEVEL", "6"))
+        except Exception:
+            compress_level = 6
+        self._summary_cache = CompressedCache(
+            "summary_cache",
+            max_bytes=self.summary_cache_max_bytes,
+            max_entries=self.summary_cache_max,
+            level=compress_level,
+        )
 
         
         self.system_prompt = """
@@ -89,6 +148,39 @@ IMPORTANT RULES:
 5. Wrong answers should be confusing but incorrect
 """
 
+    def _init_client(self) -> None:
+        """Configure the SDK and build the generative model"""
+        # Imported here: the SDK takes most of the process start-up time and
+        # routes like /api/health and /api/upload never need it
+        import google.generativeai as genai
+
+        genai.configure(api_key=self.api_key)
+        
+        self.generation_config = genai.GenerationConfig(
+            temperature=0.7,
+            max_output_tokens=16384,  
+        )
+        self.model_name = 'gemini-3-flash-preview'
+        
+        self.model = genai.GenerativeModel(
+            self.model_name,
+            generation_config=self.generation_config
+        )
+
+    def warm_up(self) -> None:
+        """
+        Open the connection to the API before the first user request: a count_tokens
+        call (free, no generation) goes through the same client as generate_content.
+        Disabled with GEMINI_WARMUP_PING=false; failures only mean a cold first call.
+        """
+        if os.getenv("GEMINI_WARMUP_PING", "true").strip().lower() not in ("1", "true", "yes"):
+            return
+        try:
+            with span("warmup"):
+                self.model.count_tokens("ping", request_options={"timeout": 10})
+        except Exception:
+            pass
+
     def _select_api_key(self) -> Optional[str]:
         """Select API key based on time window (hourly rotation)."""
         raw_keys = os.getenv("GEMINI_API_KEYS", "").strip()
@@ -128,7 +220,7 @@ IMPORTANT RULES:
         if not text:
             return []
 
-        text = text.replace("\r\n", "\n")
+        text = text.normalized if isinstance(text, Material) else text.replace("\r\n", "\n")
         max_chars = max(2000, int(max_chars))
         overlap = max(0, int(overlap))
         if overlap >= max_chars:
@@ -162,27 +254,23 @@ IMPORTANT RULES:
         return chunks
 
     def _cache_key(self, material: str, target_chars: int, lang: Optional[str]) -> str:
-        digest = hashlib.sha256(material.encode("utf-8")).hexdigest()
+        digest = material_digest(material)
         lang_norm = self._normalize_lang(lang)
         return f"{digest}:{target_chars}:{lang_norm}:{'sum' if self.summarize_large else 'trunc'}"
 
     def _cache_get(self, key: str) -> Optional[str]:
-        if self.summary_cache_max <= 0:
+        if not self._summary_cache.enabled:
             return None
-        if key not in self._summary_cache:
+        entry, event = self._summary_cache.lookup(key)
+        CACHE_EVENTS.inc(cache="summary", event=event)
+        if entry is None:
             return None
-        value = self._summary_cache.pop(key)
-        self._summary_cache[key] = value
-        return value
+        return self._summary_cache.decode(entry)
 
     def _cache_set(self, key: str, value: str) -> None:
-        if self.summary_cache_max <= 0:
-            return
-        if key in self._summary_cache:
-            self._summary_cache.pop(key)
-        self._summary_cache[key] = value
-        while len(self._summary_cache) > self.summary_cache_max:
-            self._summary_cache.popitem(last=False)
+        evicted = self._summary_cache.put(key, value)
+        if evicted:
+            CACHE_EVENTS.inc(evicted, cache="summary", event="eviction")
 
     def _prepare_large_material(self, material: str, *, target_chars: int, lang: Optional[str] = None) -> str:
         """
@@ -209,6 +297,7 @@ IMPORTANT RULES:
         
         max_chars = max(self.min_chunk_chars, min(self.max_chunk_chars, max_chars))
         chunks = self._chunk_text(material, max_chars=max_chars, overlap=1200)
+        MATERIAL_CHUNKS.observe(len(chunks), provider="gemini")
 
        
         if len(chunks) > max_chunks:
@@ -221,8 +310,16 @@ IMPORTANT RULES:
             return truncated
 
         notes_parts: list[str] = []
+        map_seconds = 0.0
 
         for idx, chunk in enumerate(chunks, start=1):
+            # Stop summarizing once another chunk would cut into the time reserved
+            # for the main generation; the remaining text is truncated instead
+            left = remaining()
+            per_chunk = map_seconds / (idx - 1) if idx > 1 else 0.0
+            if left is not None and left - per_chunk < self.generation_reserve:
+                return self._degraded_material(notes_parts, chunks[idx - 1:], target_chars)
+
             lang_instruction = self._language_instruction(lang)
             prompt = f"""{self.system_prompt}
 {lang_instruction}
@@ -241,7 +338,10 @@ IMPORTANT RULES:
 
 КОНСПЕКТ:"""
 
-            part = self._generate_with_retry(prompt).strip()
+            started = time.perf_counter()
+            with span("map"):
+                part = self._generate_with_retry(prompt).strip()
+            map_seconds += time.perf_counter() - started
             if part:
                 notes_parts.append(part)
 
@@ -251,7 +351,11 @@ IMPORTANT RULES:
             self._cache_set(cache_key, combined_notes)
             return combined_notes
 
-        
+        left = remaining()
+        if left is not None and left < self.generation_reserve + map_seconds / len(chunks):
+            # No time for the reduce pass: keep the notes as they are, cut to size
+            return self._degraded_material(notes_parts, [], target_chars)
+
         lang_instruction = self._language_instruction(lang)
         reduce_prompt = f"""{self.system_prompt}
 {lang_instruction}
@@ -266,10 +370,112 @@ IMPORTANT RULES:
 
 ЫҚШАМ НӘТИЖЕ:"""
 
-        reduced = self._generate_with_retry(reduce_prompt).strip()
+        with span("reduce"):
+            reduced = self._generate_with_retry(reduce_prompt).strip()
         self._cache_set(cache_key, reduced)
         return reduced
 
+    def _degraded_material(self, notes_parts: list[str], pending: list[str], target_chars: int) -> str:
+        """
+        Deadline fallback: notes summarized so far followed by the raw text of the chunks
+        that were skipped, cut to target_chars. The request is marked degraded so neither
+        this material nor the result built from it is cached.
+        """
+        mark_degraded()
+        notes = "\n\n---\n\n".join(notes_parts)
+        tail = "\n\n".join(pending)
+        if notes and tail:
+            material = notes + "\n\n---\n\n" + tail
+        else:
+            material = notes or tail
+        return material[:target_chars] + "\n\n[Материал қысқартылды (уақыт шектеуі)]"
+
+    def _material_prefix(self, material: str) -> str:
+        """Stable start of every generation prompt on this material (cacheable provider-side)"""
+        return f"""{self.system_prompt}
+Тек төмендегі материалды пайдалан.
+
+МАТЕРИАЛ:
+{material}
+
+"""
+
+    def _context_model(self, prefix: str):
+        """
+        Model bound to a provider-side cached copy of `prefix`, created on first use and
+        kept for GEMINI_CONTEXT_CACHE_TTL_SECONDS; None when caching is off, the prefix is
+        too short to qualify, or registering it failed recently.
+        """
+        if self.context_cache_ttl <= 0 or len(prefix) < self.context_cache_min_chars:
+            return None
+        digest = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        with self._contexts_lock:
+            entry = self._contexts.get(digest)
+            if entry is not None and entry["expires"] > time.time():
+                self._contexts.move_to_end(digest)
+                if entry["model"] is not None:
+                    CACHE_EVENTS.inc(cache="context", event="hit")
+                return entry["model"]
+            creating = self._contexts_creating.setdefault(digest, threading.Lock())
+
+        with creating:
+            with self._contexts_lock:
+                entry = self._contexts.get(digest)
+                if entry is not None and entry["expires"] > time.time():
+                    return entry["model"]
+            try:
+                with provider_slot(timeout=check()):
+                    model, handle = self._create_context(prefix, self.context_cache_ttl)
+                # Stop using it a little before the provider drops it
+                expires = time.time() + max(1, self.context_cache_ttl - 30)
+                CACHE_EVENTS.inc(cache="context", event="created")
+            except (AdmissionRejected, DeadlineExceeded):
+                return None
+            except Exception:
+                # Provider or model without context caching: plain prompts for a while
+                model, handle = None, None
+                expires = time.time() + 300
+                CACHE_EVENTS.inc(cache="context", event="error")
+            with self._contexts_lock:
+                self._contexts[digest] = {"model": model, "handle": handle, "expires": expires}
+                self._contexts.move_to_end(digest)
+                self._contexts_creating.pop(digest, None)
+                while len(self._contexts) > self.context_cache_max:
+                    _, old = self._contexts.popitem(last=False)
+                    self._delete_context(old.get("handle"))
+            return model
+
+    def _drop_context(self, prefix: str) -> None:
+        digest = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        with self._contexts_lock:
+            entry = self._contexts.pop(digest, None)
+        if entry is not None:
+            self._delete_context(entry.get("handle"))
+
+    def _create_context(self, prefix: str, ttl: int):
+        """Register `prefix` as cached content; returns (model using it, cache handle)"""
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        handle = caching.CachedContent.create(
+            model=self.model_name,
+            contents=[prefix],
+            ttl=datetime.timedelta(seconds=ttl),
+        )
+        model = genai.GenerativeModel.from_cached_content(
+            cached_content=handle,
+            generation_config=self.generation_config,
+        )
+        return model, handle
+
+    def _delete_context(self, handle) -> None:
+        if handle is None:
+            return
+        try:
+            handle.delete()
+        except Exception:
+            pass
+
     def _clean_json_response(self, text: str) -> str:
         """Clean and extract JSON from response text"""
         
@@ -290,6 +496,7 @@ IMPORTANT RULES:
             
             
             if open_braces > 0 or open_brackets > 0:
+                JSON_REPAIRS.inc(provider="gemini")
 
                 
                 
@@ -311,26 +518,78 @@ IMPORTANT RULES:
         
         return text
     
-    def _generate_with_retry(self, prompt: str) -> str:
-        """Generate content with retry logic for timeouts"""
+    def _json_config(self, kind: str, count: Optional[int] = None) -> dict:
+        """
+        Per-call generation config for a JSON generation: output budget (with the
+        thinking reserve, the model is a thinking model) and, if enabled, schema
+        """
+        config = {"max_output_tokens": output_token_budget(kind, count, thinking=True)}
+        if self.json_schema:
+            config["response_mime_type"] = "application/json"
+            config["response_schema"] = RESPONSE_SCHEMAS[kind]
+        return config
+
+    def _generate_with_retry(self, prompt: str, generation_config: Optional[dict] = None,
+                             prefix: Optional[str] = None) -> str:
+        """
+        Generate content; `prefix` is the stable material part of the prompt. When it is
+        registered as provider-side cached context only `prompt` is sent, otherwise (or if
+        the cached context turns out to be gone) the two are sent together.
+        """
+        if prefix:
+            context_model = self._context_model(prefix)
+            if context_model is not None:
+                try:
+                    return self._call_with_retry(context_model, prompt, generation_config)
+                except (AdmissionRejected, DeadlineExceeded):
+                    raise
+                except Exception as e:
+                    error_str = str(e).lower()
+                    if not ('cache' in error_str or 'not found' in error_str or '404' in error_str or '403' in error_str):
+                        raise
+                    self._drop_context(prefix)
+                    CACHE_EVENTS.inc(cache="context", event="fallback")
+            prompt = prefix + prompt
+        return self._call_with_retry(self.model, prompt, generation_config)
+
+    def _call_with_retry(self, model, prompt: str, generation_config: Optional[dict] = None) -> str:
+        """Generate content with retry logic for timeouts, bounded by the request deadline"""
         last_error = None
         
         for attempt in range(self.max_retries):
-            try:
-                response = self.model.generate_content(prompt)
-                return response.text
-            except Exception as e:
-                last_error = e
-                error_str = str(e).lower()
-                
-                
-                if 'timeout' in error_str or '504' in error_str or '503' in error_str or '500' in error_str:
-                    if attempt < self.max_retries - 1:
-                        time.sleep(self.retry_delay * (attempt + 1))
-                        continue
-                
-                
-                raise
+            with provider_slot(timeout=check()):
+                timeout = check()
+                kwargs = {}
+                if generation_config:
+                    kwargs["generation_config"] = generation_config
+                if timeout is not None:
+                    kwargs["request_options"] = {"timeout": timeout}
+                started = time.perf_counter()
+                try:
+                    response = model.generate_content(prompt, **kwargs)
+                    elapsed = time.perf_counter() - started
+                    record_provider_call(elapsed)
+                    PROVIDER_LATENCY.observe(elapsed, provider="gemini", key=self._key_label, outcome="ok")
+                    return response.text
+                except Exception as e:
+                    elapsed = time.perf_counter() - started
+                    record_provider_call(elapsed)
+                    PROVIDER_LATENCY.observe(elapsed, provider="gemini", key=self._key_label, outcome="error")
+                    PROVIDER_ERRORS.inc(provider="gemini", key=self._key_label, kind=classify_error(e))
+                    last_error = e
+                    error_str = str(e).lower()
+                    retryable = 'timeout' in error_str or '504' in error_str or '503' in error_str or '500' in error_str
+                    left = remaining()
+                    if left is not None and left <= 0:
+                        raise DeadlineExceeded(f"Request time budget exhausted: {e}") from e
+                    if not retryable or attempt >= self.max_retries - 1:
+                        raise
+                    if left is not None and left <= self.retry_delay * (attempt + 1):
+                        # A retry could not finish in time anyway
+                        raise DeadlineExceeded(f"Request time budget exhausted: {e}") from e
+            
+            # Back off outside the admission slot so waiting calls can use it
+            time.sleep(self.retry_delay * (attempt + 1))
         
         raise last_error
 
@@ -345,6 +604,7 @@ IMPORTANT RULES:
         
         target_chars = 70000 if history_mode else 50000
         material = self._prepare_large_material(material, target_chars=target_chars, lang=lang)
+        prefix = self._material_prefix(material)
         lang_instruction = self._language_instruction(lang)
         
         if history_mode:
@@ -393,9 +653,6 @@ JSON ФОРМАТ:
   ]
 }}
 
-МАТЕРИАЛ:
-{material}
-
 JSON:"""
         else:
             
@@ -422,42 +679,38 @@ JSON:
   ]
 }}
 
-МАТЕРИАЛ:
-{material}
-
 JSON:"""
 
         try:
-            response_text = self._generate_with_retry(prompt)
-            json_text = self._clean_json_response(response_text)
-            return json.loads(json_text)
+            with span("generate"):
+                config = self._json_config("history" if history_mode else "learn")
+                response_text = self._generate_with_retry(prompt, config, prefix=prefix)
+            with span("parse"):
+                json_text = self._clean_json_response(response_text)
+                result = json.loads(json_text)
+                if not history_mode:
+                    result = normalize_learn_plan(result)
+                plan = validate_plan(result, history_mode)
+                if not plan:
+                    raise Exception("Оқу жоспары құрылмады")
+                return {**result, "plan": plan}
+        except (AdmissionRejected, DeadlineExceeded):
+            raise
         except json.JSONDecodeError as e:
             raise Exception(f"JSON форматында қате: {str(e)}")
         except Exception as e:
             raise Exception(f"Gemini API қатесі: {str(e)}")
 
-    async def generate_practice_questions(self, material: str, count: int, exclude_questions: list = None, lang: Optional[str] = None) -> dict:
-        """
-        Generate practice questions.
-        
-        Args:
-            material: Source material text
-            count: Number of questions to generate
-            exclude_questions: List of questions to exclude (for "continue with other questions")
-            
-        Returns:
-            Dictionary with questions
-        """
-        
-        material = self._prepare_large_material(material, target_chars=50000, lang=lang)
+    def _practice_prompt(self, count: int, exclude_questions: list = None, lang: Optional[str] = None,
+                         skip_dates: bool = False) -> str:
         lang_instruction = self._language_instruction(lang)
 
         exclude_text = ""
         if exclude_questions:
             exclude_text = f"\n\nБҰЛ СҰРАҚТАРДЫ ҚАЙТАЛАМА:\n" + "\n".join(exclude_questions)
+        dates_rule = f"\n{DATES_RULE}" if skip_dates else ""
 
-        prompt = f"""{self.system_prompt}
-{lang_instruction}
+        return f"""{lang_instruction}
 
 ТАПСЫРМА: Материал бойынша {count} практика сұрақтарын құр.
 
@@ -478,40 +731,21 @@ JSON:"""
 - Нақты {count} сұрақ құр
 - Қате жауаптар шатастыратын болсын (ЕНТ стилінде)
 - Қате жауаптардың ұзындығы дұрыс жауаппен шамалас болсын (өте қысқа немесе өте ұзын болмасын)
-- Әр сұраққа түсіндірме жаз
+- Әр сұраққа түсіндірме жаз{dates_rule}
 {exclude_text}
 
-МАТЕРИАЛ:
-{material}
-
 JSON жауап:"""
 
-        try:
-            response_text = self._generate_with_retry(prompt)
-            json_text = self._clean_json_response(response_text)
-            return json.loads(json_text)
-        except json.JSONDecodeError as e:
-            raise Exception(f"JSON форматында қате: {str(e)}")
-        except Exception as e:
-            raise Exception(f"Gemini API қатесі: {str(e)}")
-
-    async def generate_realtest_questions(self, material: str, count: int, lang: Optional[str] = None) -> dict:
-        """
-        Generate real test questions (no explanations, no hints).
-        
-        Args:
-            material: Source material text
-            count: Number of questions to generate
-            
-        Returns:
-            Dictionary with test questions
-        """
-        
-        material = self._prepare_large_material(material, target_chars=50000, lang=lang)
+    def _realtest_prompt(self, count: int, exclude_questions: list = None, lang: Optional[str] = None,
+                         skip_dates: bool = False) -> str:
         lang_instruction = self._language_instruction(lang)
 
-        prompt = f"""{self.system_prompt}
-{lang_instruction}
+        exclude_text = ""
+        if exclude_questions:
+            exclude_text = f"\n\nБҰЛ СҰРАҚТАРДЫ ҚАЙТАЛАМА:\n" + "\n".join(exclude_questions)
+        dates_rule = f"\n{DATES_RULE}" if skip_dates else ""
+
+        return f"""{lang_instruction}
 
 ТАПСЫРМА: Материал бойынша {count} тест сұрақтарын құр (нақты ЕНТ форматында).
 
@@ -532,17 +766,126 @@ JSON жауап:"""
 - Сұрақтар ЕНТ деңгейінде болсын (күрделі)
 - Қате жауаптар өте шатастыратын болсын
 - Қате жауаптардың ұзындығы дұрыс жауаппен шамалас болсын
-- Тек материалдағы фактілерді пайдалан
-
-МАТЕРИАЛ:
-{material}
+- Тек материалдағы фактілерді пайдалан{dates_rule}
+{exclude_text}
 
 JSON жауап:"""
 
+    def _parse_questions(self, response_text: str) -> dict:
+        """Parse a questions response, keeping the complete items of a truncated one"""
+        json_text = self._clean_json_response(response_text)
+        try:
+            result = json.loads(json_text)
+        except json.JSONDecodeError:
+            salvaged = salvage_questions(response_text)
+            if not salvaged:
+                raise
+            return {"questions": salvaged}
+        return result if isinstance(result, dict) else {"questions": result}
+
+    def _complete_questions(self, kind: str, prefix: str, count: int, exclude_questions: list,
+                            lang: Optional[str], result: dict, skip_dates: bool = False) -> dict:
+        """
+        Validate the parsed questions and, if some are missing, ask only for the missing
+        ones (GEMINI_TOPUP_ROUNDS follow-up calls at most) and merge them in.
+        """
+        with_explanation = kind == "practice"
+        build_prompt = self._practice_prompt if kind == "practice" else self._realtest_prompt
+        questions, missing = validate_questions(result.get("questions"), count, with_explanation)
+        dropped = len(result.get("questions") or []) - len(questions)
+        if dropped > 0:
+            QUESTIONS_DROPPED.inc(dropped, provider="gemini")
+
+        for _ in range(self.topup_rounds):
+            if missing <= 0:
+                break
+            known = list(exclude_questions or []) + [q["question"] for q in questions]
+            # Ask for a few spare ones, since some of the top-up may fail validation too
+            ask = missing + max(1, missing // 5)
+            prompt = build_prompt(ask, known, lang, skip_dates)
+            try:
+                with span("topup"):
+                    response_text = self._generate_with_retry(prompt, self._json_config(kind, ask), prefix=prefix)
+                extra = self._parse_questions(response_text).get("questions") or []
+            except Exception:
+                TOPUPS.inc(provider="gemini", outcome="error")
+                break
+            questions, missing = validate_questions(questions + extra, count, with_explanation)
+            TOPUPS.inc(provider="gemini", outcome="ok" if missing <= 0 else "short")
+
+        if not questions:
+            raise Exception("Сұрақтар құрылмады")
+        if missing > 0:
+            mark_degraded("incomplete")
+        return {**result, "questions": questions}
+
+    async def generate_practice_questions(self, material: str, count: int, exclude_questions: list = None, lang: Optional[str] = None,
+                                          history_mode: bool = False) -> dict:
+        """
+        Generate practice questions.
+        
+        Args:
+            material: Source material text
+            count: Number of questions to generate
+            exclude_questions: List of questions to exclude (for "continue with other questions")
+            history_mode: History material; part of the set is built from its local timeline
+            
+        Returns:
+            Dictionary with questions
+        """
+        
+        # Date questions come from the local timeline; the model writes the rest
+        local, ask = split_chronology(material, count, exclude_questions, self._normalize_lang(lang), True, history_mode)
+        if ask <= 0:
+            return {"questions": local}
+        material = self._prepare_large_material(material, target_chars=50000, lang=lang)
+        prefix = self._material_prefix(material)
+        prompt = self._practice_prompt(ask, exclude_questions, lang, bool(local))
+
+        try:
+            with span("generate"):
+                response_text = self._generate_with_retry(prompt, self._json_config("practice", ask), prefix=prefix)
+            with span("parse"):
+                result = self._parse_questions(response_text)
+            result = self._complete_questions("practice", prefix, ask, exclude_questions, lang, result, bool(local))
+            return merge_local(result, local, True)
+        except (AdmissionRejected, DeadlineExceeded):
+            raise
+        except json.JSONDecodeError as e:
+            raise Exception(f"JSON форматында қате: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Gemini API қатесі: {str(e)}")
+
+    async def generate_realtest_questions(self, material: str, count: int, lang: Optional[str] = None,
+                                          history_mode: bool = False) -> dict:
+        """
+        Generate real test questions (no explanations, no hints).
+        
+        Args:
+            material: Source material text
+            count: Number of questions to generate
+            history_mode: History material; part of the set is built from its local timeline
+            
+        Returns:
+            Dictionary with test questions
+        """
+        
+        local, ask = split_chronology(material, count, None, self._normalize_lang(lang), False, history_mode)
+        if ask <= 0:
+            return {"questions": local}
+        material = self._prepare_large_material(material, target_chars=50000, lang=lang)
+        prefix = self._material_prefix(material)
+        prompt = self._realtest_prompt(ask, None, lang, bool(local))
+
         try:
-            response_text = self._generate_with_retry(prompt)
-            json_text = self._clean_json_response(response_text)
-            return json.loads(json_text)
+            with span("generate"):
+                response_text = self._generate_with_retry(prompt, self._json_config("realtest", ask), prefix=prefix)
+            with span("parse"):
+                result = self._parse_questions(response_text)
+            result = self._complete_questions("realtest", prefix, ask, None, lang, result, bool(local))
+            return merge_local(result, local, False)
+        except (AdmissionRejected, DeadlineExceeded):
+            raise
         except json.JSONDecodeError as e:
             raise Exception(f"JSON форматында қате: {str(e)}")
         except Exception as e:
@@ -551,12 +894,19 @@ JSON жауап:"""
 
 
 _gemini_service = None
+_gemini_service_lock = threading.Lock()
 
 
 def get_gemini_service() -> GeminiService:
-    """Get or create Gemini service instance"""
+    """Get or create Gemini service instance (once, even when the warm-up thread races a request)"""
     global _gemini_service
     if _gemini_service is None:
-        _gemini_service = GeminiService()
+        with _gemini_service_lock:
+            if _gemini_service is None:
+                if os.getenv("AI_PROVIDER", "gemini").strip().lower() == "fake":
+                    from services.fake_service import FakeGeminiService
+                    _gemini_service = FakeGeminiService()
+                else:
+                    _gemini_service = GeminiService()
     return _gemini_service
 
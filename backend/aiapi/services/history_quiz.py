@@ -0,0 +1,180 @@
+"""
+History quiz engine (no LLM)
+Builds multiple-choice questions straight from frontend/data/historical-figures.json:
+facts are indexed by language and level, and distractors come from other figures.
+Output uses the same {"questions": [...]} schema as the generated practice sets, so
+history practice keeps working when the provider is slow, down or out of quota.
+"""
+
+import json
+import os
+import random
+import threading
+from typing import Optional
+
+
+LANGS = ("kk", "ru", "en")
+WRONG_OPTIONS = 3
+
+DEFAULT_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "frontend", "data", "historical-figures.json"
+)
+
+_TEMPLATES = {
+    "fact": {
+        "kk": "{name} туралы қай тұжырым дұрыс?",
+        "ru": "Какое утверждение относится к личности: {name}?",
+        "en": "Which statement is about {name}?",
+    },
+    "not_fact": {
+        "kk": "Қай тұжырым {name} туралы ЕМЕС?",
+        "ru": "Какое утверждение НЕ относится к личности: {name}?",
+        "en": "Which statement is NOT about {name}?",
+    },
+    "who": {
+        "kk": "Бұл кім туралы: «{fact}»?",
+        "ru": "О ком идёт речь: «{fact}»?",
+        "en": "Who is this about: “{fact}”?",
+    },
+    "explanation": {
+        "kk": "«{fact}» — {name}",
+        "ru": "«{fact}» — {name}",
+        "en": "“{fact}” — {name}",
+    },
+}
+
+
+class HistoryQuiz:
+    """In-memory index of the figures dataset; generate() is pure CPU and thread-safe"""
+
+    def __init__(self, figures: list):
+        # names[lang][i] is figure i's name; facts[(lang, level)] -> [(i, text)]
+        self.figure_ids: list = []
+        self.names: dict[str, list[str]] = {lang: [] for lang in LANGS}
+        self.facts: dict[tuple, list[tuple[int, str]]] = {}
+        self.levels: set[int] = set()
+        for figure in figures:
+            name = figure.get("name") or {}
+            if not all(name.get(lang) for lang in LANGS):
+                continue
+            idx = len(self.figure_ids)
+            self.figure_ids.append(figure.get("id", idx))
+            for lang in LANGS:
+                self.names[lang].append(name[lang])
+            for fact in figure.get("facts") or []:
+                text = fact.get("text") or {}
+                level = fact.get("level")
+                for lang in LANGS:
+                    if text.get(lang):
+                        self.facts.setdefault((lang, level), []).append((idx, text[lang]))
+                        self.facts.setdefault((lang, None), []).append((idx, text[lang]))
+                self.levels.add(level)
+        # Per-figure view of every (lang, level) list, built once instead of per generate()
+        self.by_figure: dict[tuple, dict[int, list[str]]] = {}
+        for key, facts in self.facts.items():
+            grouped = self.by_figure.setdefault(key, {})
+            for idx, text in facts:
+                grouped.setdefault(idx, []).append(text)
+        self.with_facts = {lang: list(self.by_figure.get((lang, None), {})) for lang in LANGS}
+
+    @classmethod
+    def load(cls, path: str) -> "HistoryQuiz":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("figures") or [])
+
+    def __len__(self) -> int:
+        return len(self.figure_ids)
+
+    def _facts_by_figure(self, lang: str, level: Optional[int]) -> dict[int, list[str]]:
+        return self.by_figure.get((lang, level), {})
+
+    def _other_facts(self, rng: random.Random, lang: str, idx: int, k: int) -> Optional[list[tuple[int, str]]]:
+        """k random (figure, fact) pairs about figures other than idx; None if there are too few"""
+        pool = self.facts.get((lang, None), [])
+        own = len(self._facts_by_figure(lang, None).get(idx, ()))
+        if len(pool) - own < k:
+            return None
+        # At most `own` of the sampled pairs can belong to idx itself
+        picked = [(j, t) for j, t in rng.sample(pool, min(len(pool), k + own)) if j != idx]
+        return picked[:k]
+
+    def generate(self, count: int, lang: str = "kk", level: Optional[int] = None,
+                 figure_ids: Optional[list] = None, seed: Optional[int] = None) -> dict:
+        """
+        Up to `count` distinct questions. Kinds: which statement is about a figure,
+        which one is NOT, and (with at least 4 figures) who a statement is about.
+        `level` limits the facts used as correct answers; `figure_ids` the figures asked about.
+        """
+        lang = lang if lang in LANGS else "kk"
+        rng = random.Random(seed)
+        own = self._facts_by_figure(lang, level)
+        everyone = self._facts_by_figure(lang, None)
+        targets = [idx for idx in own if figure_ids is None or self.figure_ids[idx] in figure_ids]
+        kinds = ["fact", "not_fact"] + (["who"] if len(self) > WRONG_OPTIONS else [])
+
+        questions: list[dict] = []
+        seen: set = set()
+        attempts = 0
+        while targets and len(questions) < count and attempts < count * 20:
+            attempts += 1
+            idx = rng.choice(targets)
+            kind = rng.choice(kinds)
+
+            if kind == "fact":
+                fact = rng.choice(own[idx])
+                other_facts = self._other_facts(rng, lang, idx, WRONG_OPTIONS)
+                if other_facts is None:
+                    continue
+                wrong = [t for _, t in other_facts]
+                question = _TEMPLATES["fact"][lang].format(name=self.names[lang][idx])
+                correct, about = fact, idx
+            elif kind == "not_fact":
+                other_facts = self._other_facts(rng, lang, idx, 1)
+                if len(everyone[idx]) < WRONG_OPTIONS or other_facts is None:
+                    continue
+                about, correct = other_facts[0]
+                wrong = rng.sample(everyone[idx], WRONG_OPTIONS)
+                question = _TEMPLATES["not_fact"][lang].format(name=self.names[lang][idx])
+            else:
+                figures = self.with_facts[lang]
+                if len(figures) - 1 < WRONG_OPTIONS:
+                    continue
+                fact = rng.choice(own[idx])
+                others = [j for j in rng.sample(figures, WRONG_OPTIONS + 1) if j != idx][:WRONG_OPTIONS]
+                wrong = [self.names[lang][j] for j in others]
+                question = _TEMPLATES["who"][lang].format(fact=fact)
+                correct, about = self.names[lang][idx], idx
+                fact_text = fact
+
+            key = (question, correct)
+            if key in seen or correct in wrong:
+                continue
+            seen.add(key)
+            explained = fact_text if kind == "who" else correct
+            questions.append({
+                "id": len(questions) + 1,
+                "question": question,
+                "correct": correct,
+                "wrong": wrong,
+                "explanation": _TEMPLATES["explanation"][lang].format(fact=explained, name=self.names[lang][about]),
+            })
+        return {"questions": questions}
+
+
+_quiz: Optional[HistoryQuiz] = None
+_quiz_lock = threading.Lock()
+
+
+def get_history_quiz() -> Optional[HistoryQuiz]:
+    """Dataset from AI_HISTORY_DATA_PATH (default: the frontend copy), loaded once; None if unavailable"""
+    global _quiz
+    if _quiz is None:
+        with _quiz_lock:
+            if _quiz is None:
+                path = os.getenv("AI_HISTORY_DATA_PATH") or DEFAULT_DATA_PATH
+                try:
+                    _quiz = HistoryQuiz.load(path)
+                except Exception:
+                    return None
+    return _quiz
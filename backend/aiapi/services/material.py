@@ -0,0 +1,122 @@
+"""
+Material handle
+Uploaded text with everything the request path derives from it computed once:
+the SHA-256 digest (cache keys), the \r\n-normalized form (chunking) and the
+[PAGE N] offset index. Material is a str, so code that only needs the text keeps
+working unchanged; plain slicing and summaries give ordinary strings, while
+page_slice() gives a Material for a page range (memoized in a shared, bounded
+store rather than on the handle, so stored materials never grow after upload).
+"""
+
+import hashlib
+import re
+import threading
+from bisect import bisect_right
+from typing import Optional
+
+from services.stores import TrackedDict
+
+
+_PAGE_RE = re.compile(r"\[PAGE (\d+)\]")
+
+MAX_SLICES = 64
+
+# (digest, first, last) -> Material, least recently used first
+_slices = TrackedDict("material_slices")
+_slices_lock = threading.Lock()
+
+
+class Material(str):
+    """Immutable material text plus digest, normalized text and page offsets"""
+
+    def __new__(cls, text: str):
+        if isinstance(text, Material):
+            return text
+        self = super().__new__(cls, text)
+        # Only texts with \r\n get a second, normalized copy; otherwise the handle is it
+        normalized = str.replace(self, "\r\n", "\n") if "\r\n" in self else None
+        object.__setattr__(self, "digest", hashlib.sha256(self.encode("utf-8")).hexdigest())
+        object.__setattr__(self, "_normalized", normalized)
+        object.__setattr__(
+            self, "pages", tuple((int(m.group(1)), m.start()) for m in _PAGE_RE.finditer(normalized or self))
+        )
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Material is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Material is immutable")
+
+    def __reduce__(self):
+        return (Material, (str(self),))
+
+    @property
+    def normalized(self) -> str:
+        return self if self._normalized is None else self._normalized
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    def page_slice(self, first: int, last: int) -> Optional["Material"]:
+        """
+        Material made of the [PAGE first]..[PAGE last] sections (markers included),
+        or None when no page in that range has text. The last MAX_SLICES slices of
+        all materials are memoized, so a chapter keeps one handle (and digest).
+        """
+        key = (self.digest, first, last)
+        with _slices_lock:
+            cached = _slices.get(key)
+            if cached is not None:
+                _slices.move_to_end(key)
+                return cached
+        starts = [(page, start) for page, start in self.pages if first <= page <= last]
+        if not starts:
+            return None
+        after = [start for page, start in self.pages if page > last and start > starts[0][1]]
+        end = after[0] if after else len(self.normalized)
+        piece = Material(self.normalized[starts[0][1]:end].strip())
+        with _slices_lock:
+            _slices[key] = piece
+            while len(_slices) > MAX_SLICES:
+                _slices.popitem(last=False)
+        return piece
+
+    def page_at(self, offset: int) -> Optional[int]:
+        """Page number of the [PAGE N] section containing `offset` of the normalized text"""
+        idx = bisect_right([start for _, start in self.pages], offset) - 1
+        return self.pages[idx][0] if idx >= 0 else None
+
+
+def as_material(text) -> Material:
+    """Wrap raw text from a request; a Material is returned as is"""
+    return text if isinstance(text, Material) else Material(text or "")
+
+
+def material_digest(text: str) -> str:
+    """SHA-256 of the text, precomputed for a Material"""
+    digest = getattr(text, "digest", None)
+    return digest or hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def parse_page_range(value) -> Optional[tuple[int, int]]:
+    """(first, last) from "12-18", "12", [12, 18] or {"from": 12, "to": 18}; None if malformed"""
+    try:
+        if isinstance(value, dict):
+            first, last = value.get("from"), value.get("to", value.get("from"))
+        elif isinstance(value, (list, tuple)) and len(value) in (1, 2):
+            first, last = value[0], value[-1]
+        elif isinstance(value, (str, int)) and not isinstance(value, bool):
+            parts = str(value).replace("–", "-").split("-")
+            if len(parts) not in (1, 2):
+                return None
+            first, last = parts[0], parts[-1]
+        else:
+            return None
+        first, last = int(first), int(last)
+    except (TypeError, ValueError):
+        return None
+    if first < 1 or last < first:
+        return None
+    return first, last
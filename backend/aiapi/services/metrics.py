@@ -0,0 +1,216 @@
+"""
+Prometheus-style metrics
+Minimal thread-safe counters, gauges and histograms rendered in the text exposition format.
+Values are per process; scrape every worker separately.
+"""
+
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+_registry: list["_Metric"] = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: Optional[tuple] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, self.labelnames, k, v) for k, v in self._values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labelnames, key, value in self._samples():
+            lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Increment for the duration of the block (in-flight style gauges)"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(k, {"counts": list(v["counts"]), "sum": v["sum"], "count": v["count"]})
+                     for k, v in self._values.items()]
+        for key, state in items:
+            for bound, count in zip(self.buckets, state["counts"]):
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {state['count']}")
+            plain = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{plain} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{plain} {state['count']}")
+        return "\n".join(lines)
+
+
+def render_all() -> str:
+    """Render every registered metric in Prometheus text format"""
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+def key_label(api_key: Optional[str]) -> str:
+    """Short, non-reversible fingerprint of an API key for use as a label"""
+    if not api_key:
+        return "none"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+def classify_error(error: Exception) -> str:
+    """Bucket provider exceptions into a small, stable set of label values"""
+    text = str(error).lower()
+    if "timeout" in text or "deadline" in text or "504" in text:
+        return "timeout"
+    if "429" in text or "rate" in text or "quota" in text or "resource_exhausted" in text:
+        return "rate_limit"
+    if "500" in text or "502" in text or "503" in text or "overloaded" in text:
+        return "server"
+    return "other"
+
+
+REQUEST_LATENCY = Histogram(
+    "aiapi_request_duration_seconds", "HTTP request latency by endpoint", ("endpoint", "method", "status")
+)
+PROVIDER_LATENCY = Histogram(
+    "aiapi_provider_call_duration_seconds", "Latency of single LLM provider calls", ("provider", "key", "outcome")
+)
+PROVIDER_ERRORS = Counter(
+    "aiapi_provider_errors_total", "LLM provider call failures", ("provider", "key", "kind")
+)
+CACHE_EVENTS = Counter(
+    "aiapi_cache_events_total", "Cache lookups and evictions", ("cache", "event")
+)
+MATERIAL_CHUNKS = Histogram(
+    "aiapi_material_chunks", "Chunks produced per _prepare_large_material call", ("provider",),
+    buckets=(0, 1, 2, 4, 6, 8, 12, 16),
+)
+PDF_COMPACTION = Histogram(
+    "aiapi_pdf_compaction_ratio", "Compacted / raw characters of extracted PDF text",
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0),
+)
+JSON_REPAIRS = Counter(
+    "aiapi_json_repairs_total", "Truncated model outputs patched by _clean_json_response", ("provider",)
+)
+QUESTIONS_DROPPED = Counter(
+    "aiapi_questions_dropped_total", "Generated questions dropped by validation", ("provider",)
+)
+TOPUPS = Counter(
+    "aiapi_question_topups_total", "Follow-up calls for missing questions", ("provider", "outcome")
+)
+LOCAL_QUESTIONS = Counter(
+    "aiapi_local_questions_total", "Questions built locally instead of by the provider", ("kind",)
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "aiapi_rate_limit_rejections_total", "Requests rejected by the per-client rate limiter"
+)
+GENERATIONS_IN_FLIGHT = Gauge(
+    "aiapi_generations_in_flight", "Generations currently running", ("endpoint",)
+)
+ADMISSION_QUEUE = Gauge(
+    "aiapi_admission_queue_length", "Provider calls waiting for an admission slot"
+)
+ADMISSION_WAIT = Histogram(
+    "aiapi_admission_wait_seconds", "Time spent queued for an admission slot", ("priority",)
+)
+ADMISSION_REJECTIONS = Counter(
+    "aiapi_admission_rejections_total", "Provider calls shed by admission control", ("priority", "reason")
+)
+DEADLINE_EVENTS = Counter(
+    "aiapi_deadline_events_total", "Requests served degraded (event=reason) or failed by their time budget", ("endpoint", "event")
+)
@@ -7,8 +7,26 @@ import json
 import os
 import time
 import math
+import threading
 from typing import Optional
-from openai import OpenAI
+
+from services.admission import AdmissionRejected, provider_slot
+from services.chronology import DATES_RULE, merge_local, split_chronology
+from services.deadline import DeadlineExceeded, check, mark_degraded, remaining
+from services.material import Material
+from services.metrics import (
+    JSON_REPAIRS,
+    MATERIAL_CHUNKS,
+    PROVIDER_ERRORS,
+    PROVIDER_LATENCY,
+    QUESTIONS_DROPPED,
+    TOPUPS,
+    classify_error,
+    key_label,
+)
+from services.schemas import output_token_budget
+from services.tracing import record_provider_call, span
+from services.validation import validate_plan, validate_questions
 
 
 class OpenAIService:
@@ -19,7 +37,10 @@ class OpenAIService:
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY is required")
+        self._key_label = key_label(self.api_key)
         
+        from openai import OpenAI  # imported on first use, like the Gemini SDK
+
         self.client = OpenAI(api_key=self.api_key)
         
        
@@ -34,6 +55,14 @@ class OpenAIService:
             self.retry_delay = max(0.0, float(os.getenv("OPENAI_RETRY_DELAY", "2")))
         except Exception:
             self.retry_delay = 2.0
+        try:
+            self.generation_reserve = max(0.0, float(os.getenv("OPENAI_GENERATION_RESERVE_SECONDS", "25")))
+        except Exception:
+            self.generation_reserve = 25.0
+        try:
+            self.topup_rounds = max(0, int(os.getenv("OPENAI_TOPUP_ROUNDS", "1")))
+        except Exception:
+            self.topup_rounds = 1
         
         
         self.system_prompt = """
@@ -77,7 +106,7 @@ IMPORTANT RULES:
         if not text:
             return []
 
-        text = text.replace("\r\n", "\n")
+        text = text.normalized if isinstance(text, Material) else text.replace("\r\n", "\n")
         max_chars = max(2000, int(max_chars))
         overlap = max(0, int(overlap))
         if overlap >= max_chars:
@@ -118,6 +147,7 @@ IMPORTANT RULES:
         max_chars = int(math.ceil(len(material) / max_chunks))
         max_chars = max(20000, min(250000, max_chars))
         chunks = self._chunk_text(material, max_chars=max_chars, overlap=1200)
+        MATERIAL_CHUNKS.observe(len(chunks), provider="openai")
 
         if len(chunks) > max_chunks:
             chunks = chunks[:max_chunks]
@@ -126,8 +156,14 @@ IMPORTANT RULES:
             return material[:target_chars] + "\n\n[Материал қысқартылды (өте үлкен мәтін)]"
 
         notes_parts: list[str] = []
+        map_seconds = 0.0
 
         for idx, chunk in enumerate(chunks, start=1):
+            left = remaining()
+            per_chunk = map_seconds / (idx - 1) if idx > 1 else 0.0
+            if left is not None and left - per_chunk < self.generation_reserve:
+                return self._degraded_material(notes_parts, chunks[idx - 1:], target_chars)
+
             lang_instruction = self._language_instruction(lang)
             prompt = f"""{self.system_prompt}
 {lang_instruction}
@@ -146,7 +182,10 @@ IMPORTANT RULES:
 
 КОНСПЕКТ:"""
 
-            part = self._generate_with_retry(prompt).strip()
+            started = time.perf_counter()
+            with span("map"):
+                part = self._generate_with_retry(prompt).strip()
+            map_seconds += time.perf_counter() - started
             if part:
                 notes_parts.append(part)
 
@@ -155,6 +194,10 @@ IMPORTANT RULES:
         if len(combined_notes) <= target_chars:
             return combined_notes
 
+        left = remaining()
+        if left is not None and left < self.generation_reserve + map_seconds / len(chunks):
+            return self._degraded_material(notes_parts, [], target_chars)
+
         lang_instruction = self._language_instruction(lang)
         reduce_prompt = f"""{self.system_prompt}
 {lang_instruction}
@@ -169,7 +212,29 @@ IMPORTANT RULES:
 
 ЫҚШАМ НӘТИЖЕ:"""
 
-        return self._generate_with_retry(reduce_prompt).strip()
+        with span("reduce"):
+            return self._generate_with_retry(reduce_prompt).strip()
+
+    def _degraded_material(self, notes_parts: list[str], pending: list[str], target_chars: int) -> str:
+        """Deadline fallback: notes so far plus the raw text of skipped chunks, cut to size"""
+        mark_degraded()
+        notes = "\n\n---\n\n".join(notes_parts)
+        tail = "\n\n".join(pending)
+        if notes and tail:
+            material = notes + "\n\n---\n\n" + tail
+        else:
+            material = notes or tail
+        return material[:target_chars] + "\n\n[Материал қысқартылды (уақыт шектеуі)]"
+
+    def _material_prefix(self, material: str) -> str:
+        """
+        Material first, instructions after: with the system prompt this forms a stable
+        prefix across calls, which OpenAI caches automatically (prompts over 1024 tokens)
+        """
+        return f"""МАТЕРИАЛ:
+{material}
+
+"""
 
     def _clean_json_response(self, text: str) -> str:
         """Clean and extract JSON from response text"""
@@ -187,6 +252,7 @@ IMPORTANT RULES:
             open_brackets = text.count('[') - text.count(']')
             
             if open_braces > 0 or open_brackets > 0:
+                JSON_REPAIRS.inc(provider="openai")
                 quote_count = text.count('"') 
                 if quote_count % 2 != 0:
                     last_complete = text.rfind('},')
@@ -203,8 +269,9 @@ IMPORTANT RULES:
         
         return text
     
-    def _generate_with_retry(self, prompt: str, system_prompt: str = None) -> str:
-        """Generate content with retry logic"""
+    def _generate_with_retry(self, prompt: str, system_prompt: str = None, max_tokens: int = 16384,
+                             json_mode: bool = False) -> str:
+        """Generate content with retry logic; json_mode asks for a bare JSON object"""
         last_error = None
         
         messages = []
@@ -213,24 +280,41 @@ IMPORTANT RULES:
         messages.append({"role": "user", "content": prompt})
         
         for attempt in range(self.max_retries):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=16384,
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                last_error = e
-                error_str = str(e).lower()
-                
-                if 'timeout' in error_str or '504' in error_str or '503' in error_str or '500' in error_str or 'rate' in error_str:
-                    if attempt < self.max_retries - 1:
-                        time.sleep(self.retry_delay * (attempt + 1))
-                        continue
-                
-                raise
+            with provider_slot(timeout=check()):
+                timeout = check()
+                started = time.perf_counter()
+                try:
+                    extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+                    response = self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=max_tokens,
+                        timeout=timeout,
+                        **extra,
+                    )
+                    elapsed = time.perf_counter() - started
+                    record_provider_call(elapsed)
+                    PROVIDER_LATENCY.observe(elapsed, provider="openai", key=self._key_label, outcome="ok")
+                    return response.choices[0].message.content
+                except Exception as e:
+                    elapsed = time.perf_counter() - started
+                    record_provider_call(elapsed)
+                    PROVIDER_LATENCY.observe(elapsed, provider="openai", key=self._key_label, outcome="error")
+                    PROVIDER_ERRORS.inc(provider="openai", key=self._key_label, kind=classify_error(e))
+                    last_error = e
+                    error_str = str(e).lower()
+                    retryable = 'timeout' in error_str or '504' in error_str or '503' in error_str or '500' in error_str or 'rate' in error_str
+                    left = remaining()
+                    if left is not None and left <= 0:
+                        raise DeadlineExceeded(f"Request time budget exhausted: {e}") from e
+                    if not retryable or attempt >= self.max_retries - 1:
+                        raise
+                    if left is not None and left <= self.retry_delay * (attempt + 1):
+                        raise DeadlineExceeded(f"Request time budget exhausted: {e}") from e
+            
+            # Back off outside the admission slot so waiting calls can use it
+            time.sleep(self.retry_delay * (attempt + 1))
         
         raise last_error
 
@@ -285,9 +369,6 @@ JSON ФОРМАТ:
   ]
 }}
 
-МАТЕРИАЛ:
-{material}
-
 JSON:"""
         else:
             prompt = f"""Сен - оқу AI. Тек берілген материалды пайдалан.
@@ -313,30 +394,38 @@ JSON:
   ]
 }}
 
-МАТЕРИАЛ:
-{material}
-
 JSON:"""
 
         try:
-            response_text = self._generate_with_retry(prompt, self.system_prompt)
-            json_text = self._clean_json_response(response_text)
-            return json.loads(json_text)
+            with span("generate"):
+                budget = output_token_budget("history" if history_mode else "learn")
+                response_text = self._generate_with_retry(
+                    self._material_prefix(material) + prompt, self.system_prompt, max_tokens=budget, json_mode=True
+                )
+            with span("parse"):
+                json_text = self._clean_json_response(response_text)
+                result = json.loads(json_text)
+                plan = validate_plan(result, history_mode)
+                if not plan:
+                    raise Exception("Оқу жоспары құрылмады")
+                return {**result, "plan": plan}
+        except (AdmissionRejected, DeadlineExceeded):
+            raise
         except json.JSONDecodeError as e:
             raise Exception(f"JSON форматында қате: {str(e)}")
         except Exception as e:
             raise Exception(f"OpenAI API қатесі: {str(e)}")
 
-    async def generate_practice_questions(self, material: str, count: int, exclude_questions: list = None, lang: Optional[str] = None) -> dict:
-        """Generate practice questions."""
-        material = self._prepare_large_material(material, target_chars=50000, lang=lang)
+    def _practice_prompt(self, count: int, exclude_questions: list = None, lang: Optional[str] = None,
+                         skip_dates: bool = False) -> str:
         lang_instruction = self._language_instruction(lang)
 
         exclude_text = ""
         if exclude_questions:
             exclude_text = f"\n\nБҰЛ СҰРАҚТАРДЫ ҚАЙТАЛАМА:\n" + "\n".join(exclude_questions)
+        dates_rule = f"\n{DATES_RULE}" if skip_dates else ""
 
-        prompt = f"""{lang_instruction}
+        return f"""{lang_instruction}
 
 ТАПСЫРМА: Материал бойынша {count} практика сұрақтарын құр.
 
@@ -357,29 +446,21 @@ JSON:"""
 - Нақты {count} сұрақ құр
 - Қате жауаптар шатастыратын болсын (ЕНТ стилінде)
 - Қате жауаптардың ұзындығы дұрыс жауаппен шамалас болсын
-- Әр сұраққа түсіндірме жаз
+- Әр сұраққа түсіндірме жаз{dates_rule}
 {exclude_text}
 
-МАТЕРИАЛ:
-{material}
-
 JSON жауап:"""
 
-        try:
-            response_text = self._generate_with_retry(prompt, self.system_prompt)
-            json_text = self._clean_json_response(response_text)
-            return json.loads(json_text)
-        except json.JSONDecodeError as e:
-            raise Exception(f"JSON форматында қате: {str(e)}")
-        except Exception as e:
-            raise Exception(f"OpenAI API қатесі: {str(e)}")
-
-    async def generate_realtest_questions(self, material: str, count: int, lang: Optional[str] = None) -> dict:
-        """Generate real test questions."""
-        material = self._prepare_large_material(material, target_chars=50000, lang=lang)
+    def _realtest_prompt(self, count: int, exclude_questions: list = None, lang: Optional[str] = None,
+                         skip_dates: bool = False) -> str:
         lang_instruction = self._language_instruction(lang)
 
-        prompt = f"""{lang_instruction}
+        exclude_text = ""
+        if exclude_questions:
+            exclude_text = f"\n\nБҰЛ СҰРАҚТАРДЫ ҚАЙТАЛАМА:\n" + "\n".join(exclude_questions)
+        dates_rule = f"\n{DATES_RULE}" if skip_dates else ""
+
+        return f"""{lang_instruction}
 
 ТАПСЫРМА: Материал бойынша {count} тест сұрақтарын құр (нақты ЕНТ форматында).
 
@@ -400,32 +481,118 @@ JSON жауап:"""
 - Сұрақтар ЕНТ деңгейінде болсын (күрделі)
 - Қате жауаптар өте шатастыратын болсын
 - Қате жауаптардың ұзындығы дұрыс жауаппен шамалас болсын
-- Тек материалдағы фактілерді пайдалан
-
-МАТЕРИАЛ:
-{material}
+- Тек материалдағы фактілерді пайдалан{dates_rule}
+{exclude_text}
 
 JSON жауап:"""
 
+    def _parse_questions(self, response_text: str) -> dict:
+        result = json.loads(self._clean_json_response(response_text))
+        return result if isinstance(result, dict) else {"questions": result}
+
+    def _complete_questions(self, kind: str, prefix: str, count: int, exclude_questions: list,
+                            lang: Optional[str], result: dict, skip_dates: bool = False) -> dict:
+        """
+        Validate the parsed questions and, if some are missing, ask only for the missing
+        ones (OPENAI_TOPUP_ROUNDS follow-up calls at most) and merge them in.
+        """
+        with_explanation = kind == "practice"
+        build_prompt = self._practice_prompt if kind == "practice" else self._realtest_prompt
+        questions, missing = validate_questions(result.get("questions"), count, with_explanation)
+        dropped = len(result.get("questions") or []) - len(questions)
+        if dropped > 0:
+            QUESTIONS_DROPPED.inc(dropped, provider="openai")
+
+        for _ in range(self.topup_rounds):
+            if missing <= 0:
+                break
+            known = list(exclude_questions or []) + [q["question"] for q in questions]
+            ask = missing + max(1, missing // 5)
+            prompt = build_prompt(ask, known, lang, skip_dates)
+            try:
+                with span("topup"):
+                    response_text = self._generate_with_retry(
+                        prefix + prompt, self.system_prompt, max_tokens=output_token_budget(kind, ask), json_mode=True
+                    )
+                extra = self._parse_questions(response_text).get("questions") or []
+            except Exception:
+                TOPUPS.inc(provider="openai", outcome="error")
+                break
+            questions, missing = validate_questions(questions + extra, count, with_explanation)
+            TOPUPS.inc(provider="openai", outcome="ok" if missing <= 0 else "short")
+
+        if not questions:
+            raise Exception("Сұрақтар құрылмады")
+        if missing > 0:
+            mark_degraded("incomplete")
+        return {**result, "questions": questions}
+
+    async def generate_practice_questions(self, material: str, count: int, exclude_questions: list = None, lang: Optional[str] = None,
+                                          history_mode: bool = False) -> dict:
+        """Generate practice questions."""
+        local, count = split_chronology(material, count, exclude_questions, self._normalize_lang(lang), True, history_mode)
+        if count <= 0:
+            return {"questions": local}
+        material = self._prepare_large_material(material, target_chars=50000, lang=lang)
+        prefix = self._material_prefix(material)
+        prompt = self._practice_prompt(count, exclude_questions, lang, bool(local))
+
         try:
-            response_text = self._generate_with_retry(prompt, self.system_prompt)
-            json_text = self._clean_json_response(response_text)
-            return json.loads(json_text)
+            with span("generate"):
+                budget = output_token_budget("practice", count)
+                response_text = self._generate_with_retry(
+                    prefix + prompt, self.system_prompt, max_tokens=budget, json_mode=True
+                )
+            with span("parse"):
+                result = self._parse_questions(response_text)
+            result = self._complete_questions("practice", prefix, count, exclude_questions, lang, result, bool(local))
+            return merge_local(result, local, True)
+        except (AdmissionRejected, DeadlineExceeded):
+            raise
         except json.JSONDecodeError as e:
             raise Exception(f"JSON форматында қате: {str(e)}")
         except Exception as e:
             raise Exception(f"OpenAI API қатесі: {str(e)}")
 
+    async def generate_realtest_questions(self, material: str, count: int, lang: Optional[str] = None,
+                                          history_mode: bool = False) -> dict:
+        """Generate real test questions."""
+        local, count = split_chronology(material, count, None, self._normalize_lang(lang), False, history_mode)
+        if count <= 0:
+            return {"questions": local}
+        material = self._prepare_large_material(material, target_chars=50000, lang=lang)
+        prefix = self._material_prefix(material)
+        prompt = self._realtest_prompt(count, None, lang, bool(local))
+
+        try:
+            with span("generate"):
+                budget = output_token_budget("realtest", count)
+                response_text = self._generate_with_retry(
+                    prefix + prompt, self.system_prompt, max_tokens=budget, json_mode=True
+                )
+            with span("parse"):
+                result = self._parse_questions(response_text)
+            result = self._complete_questions("realtest", prefix, count, None, lang, result, bool(local))
+            return merge_local(result, local, False)
+        except (AdmissionRejected, DeadlineExceeded):
+            raise
+        except json.JSONDecodeError as e:
+            raise Exception(f"JSON форматында қате: {str(e)}")
+        except Exception as e:
+            raise Exception(f"OpenAI API қатесі: {str(e)}")
 
 
 _openai_service = None
+_openai_service_lock = threading.Lock()
 
 
 def get_openai_service() -> OpenAIService:
-    """Get or create OpenAI service instance"""
+    """Get or create OpenAI service instance (once, even under concurrent first use)"""
     global _openai_service
     if _openai_service is None:
-        _openai_service = OpenAIService()
+        with _openai_service_lock:
+            if _openai_service is None:
+                _openai_service = OpenAIService()
     return _openai_service
 
 
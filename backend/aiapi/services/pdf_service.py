@@ -1,10 +1,26 @@
 """
 PDF Processing Service
-Uses PyMuPDF (fitz) to extract text from PDF files
+Uses PyMuPDF (fitz) to extract text from PDF files, then compacts it: running
+headers/footers, page numbers, line-break hyphens and whitespace runs are stripped
+so they do not count against generation budgets.
 """
 
-import fitz  # PyMuPDF
 import io
+import os
+import re
+
+from services.metrics import PDF_COMPACTION
+
+
+def _fitz():
+    """PyMuPDF, imported on first use so text-only workers start faster"""
+    import fitz  # PyMuPDF
+    return fitz
+
+
+def warm_up() -> None:
+    """Import PyMuPDF ahead of the first PDF upload"""
+    _fitz()
 
 
 def extract_text_from_pdf(pdf_file) -> str:
@@ -17,6 +33,19 @@ def extract_text_from_pdf(pdf_file) -> str:
     Returns:
         Extracted text as string
     """
+    return extract_pdf_text(pdf_file)[0]
+
+
+def extract_pdf_text(pdf_file) -> tuple[str, dict]:
+    """
+    Extract text from a PDF file, compacted unless AI_PDF_COMPACT=false.
+    
+    Args:
+        pdf_file: File object or bytes containing PDF data
+        
+    Returns:
+        (text with [PAGE N] markers, compaction stats - see compact_pages)
+    """
     try:
         
         if hasattr(pdf_file, 'read'):
@@ -30,24 +59,139 @@ def extract_text_from_pdf(pdf_file) -> str:
             pdf_bytes = pdf_file
             
       
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        doc = _fitz().open(stream=pdf_bytes, filetype="pdf")
         
-        text_content = []
+        pages = []
         
         for page_num in range(len(doc)):
             page = doc.load_page(page_num)
-            text = page.get_text("text")
-            if text.strip():
-                
-                text_content.append(f"[PAGE {page_num + 1}]\n{text.strip()}")
+            pages.append((page_num + 1, page.get_text("text")))
         
         doc.close()
         
-        return "\n\n".join(text_content)
-        
     except Exception as e:
         raise Exception(f"Ошибка при чтении PDF: {str(e)}")
 
+    if os.getenv("AI_PDF_COMPACT", "true").strip().lower() in ("1", "true", "yes"):
+        stats = compact_pages(pages)
+    else:
+        stats = None
+
+    # Each page is replaced by its final piece, so raw and formatted text never coexist
+    for idx, (num, text) in enumerate(pages):
+        text = text.strip()
+        pages[idx] = f"[PAGE {num}]\n{text}" if text else ""
+    text = "\n\n".join([piece for piece in pages if piece])
+    if stats is not None:
+        stats["chars"] = len(text)
+        stats["ratio"] = round(len(text) / stats["raw_chars"], 3) if stats["raw_chars"] else 1.0
+        PDF_COMPACTION.observe(stats["ratio"])
+    return text, stats
+
+
+# Running headers/footers are looked for among the first and last EDGE_LINES lines of
+# each page. Digits are masked only in short page-number-like lines, so "Тарих — 12"
+# and "Тарих — 13" count as one line while "1-тарау" / "Chapter 2" / "§ 5" must match exactly
+EDGE_LINES = 3
+MAX_NUMBERED_HEADER = 60
+_DIGITS_RE = re.compile(r"\d+")
+# "Тарих — 12", "12 | Тарих"; a bare hyphen is a suffix ("1-тарау"), so it needs spaces around it
+_NUMBER_SEP = r"(?:\s*[|—–·•]\s*|\s+[-/:]\s+)"
+_RUNNING_NUMBER_RE = re.compile(rf"^\d{{1,4}}{_NUMBER_SEP}\S.*$|^.*\S{_NUMBER_SEP}\d{{1,4}}$")
+_PAGE_NUMBER_RE = re.compile(
+    r"^[^\w§№]*(?:(?:бет|стр\.?|страница|page|p\.)\s*)?\d{1,4}(?:\s*(?:-?бет|бет|стр\.?))?[\W_]*$",
+    re.IGNORECASE,
+)
+# Literal first (much faster to scan for); the letter before the hyphen is checked in _join_hyphen
+_HYPHEN_RE = re.compile(r"[-\u00ad]\n(?=[a-zа-яёәғқңөұүһі])")
+
+
+def _line_key(line: str) -> str:
+    key = line.casefold()
+    if len(line) <= MAX_NUMBERED_HEADER and (_RUNNING_NUMBER_RE.match(line) or _PAGE_NUMBER_RE.match(line)):
+        return _DIGITS_RE.sub("#", key)
+    return key
+
+
+def _page_lines(text: str) -> list[str]:
+    """Lines with whitespace runs (tabs, NBSP, ...) collapsed; str.split is far cheaper than a regex here"""
+    if "\u200b" in text:
+        text = text.replace("\u200b", "")
+    return [" ".join(line.split()) for line in text.split("\n")]
+
+
+def _join_hyphen(match: re.Match) -> str:
+    start = match.start()
+    return "" if start and match.string[start - 1].isalpha() else match.group(0)
+
+
+def _edge_lines(lines: list[str]) -> set[str]:
+    """Lines where headers and footers sit (normalized); on short pages only the first and last one"""
+    content = [line for line in lines if line and not line.isspace()]
+    width = EDGE_LINES if len(content) > 2 * EDGE_LINES else 1
+    return {" ".join(line.split()) for line in content[:width] + content[-width:]}
+
+
+def compact_pages(pages: list[tuple[int, str]]) -> dict:
+    """
+    Strip PDF noise from extracted pages: running headers/footers repeated on at
+    least AI_PDF_REPEAT_SHARE of the pages (default 0.5, min 3 pages), bare page
+    numbers at the page edges, soft hyphens and words hyphenated across lines,
+    whitespace runs. Pages are rewritten in place (so a big book is not held twice);
+    pages left empty get empty text. Returns stats: raw_chars, pages and the counts
+    of what was removed.
+    """
+    try:
+        share = float(os.getenv("AI_PDF_REPEAT_SHARE", "0.5"))
+    except Exception:
+        share = 0.5
+
+    # Two passes over the raw pages (count edge lines, then strip them); lines are
+    # split per page on the fly so a big book is not held as millions of line strings
+    raw_chars = 0
+    counts: dict[str, int] = {}
+    for _, text in pages:
+        raw_chars += len(text)
+        for key in {_line_key(line) for line in _edge_lines(text.split("\n"))}:
+            counts[key] = counts.get(key, 0) + 1
+    threshold = max(3, int(len(pages) * share))
+    repeated = {key for key, n in counts.items() if n >= threshold}
+
+    removed_lines = 0
+    page_numbers = 0
+    empty_pages = 0
+    for idx, (num, text) in enumerate(pages):
+        lines = _page_lines(text)
+        edge = _edge_lines(lines)
+        kept = []
+        for line in lines:
+            if not line:
+                # Blank lines collapse to one paragraph break
+                if kept and kept[-1]:
+                    kept.append(line)
+                continue
+            if line in edge:
+                if _line_key(line) in repeated:
+                    removed_lines += 1
+                    continue
+                if len(line) <= 24 and _PAGE_NUMBER_RE.match(line):
+                    page_numbers += 1
+                    continue
+            kept.append(line)
+        text = "\n".join(kept).replace("\u00ad\n", "").replace("\u00ad", "")
+        text = _HYPHEN_RE.sub(_join_hyphen, text).strip()
+        empty_pages += not text
+        pages[idx] = (num, text)
+
+    stats = {
+        "raw_chars": raw_chars,
+        "pages": len(pages),
+        "empty_pages": empty_pages,
+        "repeated_lines": removed_lines,
+        "page_numbers": page_numbers,
+    }
+    return stats
+
 
 def get_pdf_info(pdf_file) -> dict:
     """
@@ -66,7 +210,7 @@ def get_pdf_info(pdf_file) -> dict:
         else:
             pdf_bytes = pdf_file
             
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        doc = _fitz().open(stream=pdf_bytes, filetype="pdf")
         
         info = {
             "page_count": len(doc),
@@ -0,0 +1,80 @@
+"""
+Opt-in per-request profiler
+WSGI middleware that runs a single request under cProfile when it carries the
+admin secret in the X-Profile header, and writes the profile to disk.
+
+Installed only when AI_PROFILE_DIR and AI_ADMIN_TOKEN are both set, so normal
+deployments do not pay anything; when installed, unprofiled requests cost one
+dict lookup.
+"""
+
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import re
+import threading
+import time
+
+
+CACHE_KEY_ENVIRON = "aiapi.cache_key"
+
+
+class ProfilerMiddleware:
+    """Profile requests that send `X-Profile: <admin token>`"""
+
+    def __init__(self, wsgi_app, profile_dir: str, secret: str, top: int = 60):
+        self.wsgi_app = wsgi_app
+        self.profile_dir = profile_dir
+        self.secret = secret
+        self.top = top
+        # cProfile cannot run two profilers at once reliably; extra requests run unprofiled
+        self._busy = threading.Lock()
+        os.makedirs(self.profile_dir, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        token = environ.get("HTTP_X_PROFILE")
+        if not token or not hmac.compare_digest(token.encode("utf-8"), self.secret.encode("utf-8")):
+            return self.wsgi_app(environ, start_response)
+        if not self._busy.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+        try:
+            return self._profile(environ, start_response)
+        finally:
+            self._busy.release()
+
+    def _profile(self, environ, start_response):
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                body = b"".join(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            self._dump(profiler, environ, elapsed)
+        return [body]
+
+    def _dump(self, profiler: cProfile.Profile, environ, elapsed: float) -> None:
+        path_info = environ.get("PATH_INFO", "/")
+        slug = re.sub(r"[^a-zA-Z0-9]+", "-", path_info).strip("-") or "root"
+        cache_key = environ.get(CACHE_KEY_ENVIRON) or "nokey"
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        base = os.path.join(self.profile_dir, f"{stamp}_{slug}_{cache_key[:16]}_{int(elapsed * 1000)}ms")
+
+        profiler.dump_stats(base + ".prof")
+
+        out = io.StringIO()
+        out.write(f"path: {path_info}\n")
+        out.write(f"cache_key: {cache_key}\n")
+        out.write(f"elapsed_ms: {elapsed * 1000:.1f}\n\n")
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats("cumulative").print_stats(self.top)
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(out.getvalue())
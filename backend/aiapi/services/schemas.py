@@ -0,0 +1,142 @@
+"""
+Output schemas and token budgets for JSON generations
+Response schemas (OpenAPI subset understood by Gemini's response_schema) for each
+generation kind, and an output-token budget sized from the question count, so a
+10-question request does not reserve the same budget as a full history plan.
+"""
+
+import os
+from typing import Optional
+
+
+def _question_schema(with_explanation: bool) -> dict:
+    properties = {
+        "id": {"type": "INTEGER"},
+        "question": {"type": "STRING"},
+        "correct": {"type": "STRING"},
+        "wrong": {"type": "ARRAY", "items": {"type": "STRING"}},
+    }
+    required = ["question", "correct", "wrong"]
+    if with_explanation:
+        properties["explanation"] = {"type": "STRING"}
+        required.append("explanation")
+    return {"type": "OBJECT", "properties": properties, "required": required}
+
+
+def _questions_schema(with_explanation: bool) -> dict:
+    return {
+        "type": "OBJECT",
+        "properties": {"questions": {"type": "ARRAY", "items": _question_schema(with_explanation)}},
+        "required": ["questions"],
+    }
+
+
+def _plan_schema(content: dict) -> dict:
+    return {
+        "type": "OBJECT",
+        "properties": {
+            "plan": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "title": {"type": "STRING"},
+                        "content": content,
+                        "questions": {"type": "ARRAY", "items": _question_schema(True)},
+                    },
+                    "required": ["title", "content", "questions"],
+                },
+            }
+        },
+        "required": ["plan"],
+    }
+
+
+# Learn content is either text or a list; a schema field has one type, so list
+# items come back in "items" and are moved into "data" by normalize_learn_plan()
+LEARN_CONTENT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "type": {"type": "STRING", "enum": ["text", "list"]},
+        "data": {"type": "STRING", "description": "Study text (type=text)"},
+        "items": {"type": "ARRAY", "items": {"type": "STRING"}, "description": "List items (type=list)"},
+    },
+    "required": ["type"],
+}
+
+HISTORY_CONTENT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "general": {"type": "STRING"},
+        "summary": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "timeline": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"period": {"type": "STRING"}, "event": {"type": "STRING"}},
+                "required": ["period", "event"],
+            },
+        },
+    },
+    "required": ["general", "summary", "timeline"],
+}
+
+RESPONSE_SCHEMAS = {
+    "practice": _questions_schema(True),
+    "realtest": _questions_schema(False),
+    "learn": _plan_schema(LEARN_CONTENT_SCHEMA),
+    "history": _plan_schema(HISTORY_CONTENT_SCHEMA),
+}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def output_token_budget(kind: str, count: Optional[int] = None, thinking: bool = False) -> int:
+    """
+    max_output_tokens for one generation. Question sets scale with count
+    (AI_OUTPUT_TOKENS_PER_QUESTION, ~60% of it without explanations); plans use
+    fixed budgets. The visible output is capped at AI_OUTPUT_TOKENS_MAX.
+
+    Thinking models (gemini-3-flash-preview) count their thinking tokens against
+    max_output_tokens too, so with thinking=True AI_OUTPUT_THINKING_TOKENS (default
+    8192) is added on top; without it a 10-question set can stop at MAX_TOKENS with
+    little or no visible JSON.
+    """
+    try:
+        count = max(1, int(count)) if count else 10
+    except Exception:
+        count = 10
+    cap = _env_int("AI_OUTPUT_TOKENS_MAX", 16384)
+    per_question = _env_int("AI_OUTPUT_TOKENS_PER_QUESTION", 350)
+    if kind == "history":
+        budget = _env_int("AI_OUTPUT_TOKENS_HISTORY", 16384)
+    elif kind == "learn":
+        budget = _env_int("AI_OUTPUT_TOKENS_LEARN", 8192)
+    elif kind == "realtest":
+        budget = 1024 + int(count * per_question * 0.6)
+    else:
+        budget = 1024 + count * per_question
+    budget = max(256, min(cap, budget))
+    if thinking:
+        budget += max(0, _env_int("AI_OUTPUT_THINKING_TOKENS", 8192))
+    return budget
+
+
+def normalize_learn_plan(result: dict) -> dict:
+    """Move schema-mode list items back into content.data, the shape the frontend renders"""
+    for section in (result.get("plan") or []) if isinstance(result, dict) else []:
+        content = section.get("content") if isinstance(section, dict) else None
+        if not isinstance(content, dict):
+            continue
+        items = content.pop("items", None)
+        if content.get("type") == "list" and items:
+            content["data"] = items
+        elif "data" not in content and items:
+            content["type"] = "list"
+            content["data"] = items
+    return result
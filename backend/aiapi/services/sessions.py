@@ -0,0 +1,93 @@
+"""
+Server-side practice sessions
+Remember which questions a student has been served for a material, so "continue"
+requests carry only a session id. Served questions are kept as 8-byte fingerprints
+in a set, plus a short window of recent texts that is shown to the model; older
+repeats are caught by filtering the result against the fingerprints.
+"""
+
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import threading
+import time
+from collections import deque
+
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+# Session ids are keyed with a server secret so they cannot be derived from a user
+# and material id; AI_SESSION_SECRET keeps them stable across restarts and workers
+_SECRET = os.getenv("AI_SESSION_SECRET", "").encode("utf-8") or secrets.token_bytes(32)
+
+
+def recent_limit() -> int:
+    """How many recent question texts go into the prompt (AI_SESSION_PROMPT_EXCLUDE)"""
+    try:
+        return max(0, int(os.getenv("AI_SESSION_PROMPT_EXCLUDE", "30")))
+    except Exception:
+        return 30
+
+
+def question_fingerprint(text: str) -> int:
+    """64-bit hash of a question, insensitive to case, punctuation and spacing"""
+    normalized = _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", str(text).casefold())).strip()
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def session_id_for(client_key: str, material_id: str) -> str:
+    """One session per user and material"""
+    return hmac.new(_SECRET, f"{client_key}\n{material_id}".encode("utf-8"), hashlib.sha256).hexdigest()[:24]
+
+
+class PracticeSession:
+    def __init__(self, session_id: str, material_id: str):
+        self.session_id = session_id
+        self.material_id = material_id
+        self.served: set[int] = set()
+        self.recent: deque = deque(maxlen=recent_limit())
+        self.rounds = 0
+        self.created = time.time()
+        self.updated = self.created
+        self._lock = threading.Lock()
+
+    def exclusions(self) -> list[str]:
+        with self._lock:
+            return list(self.recent)
+
+    def filter_new(self, questions: list) -> list:
+        """Drop questions already served in this session (and repeats within the batch)"""
+        seen = set()
+        fresh = []
+        with self._lock:
+            for q in questions:
+                if not isinstance(q, dict) or not q.get("question"):
+                    fresh.append(q)
+                    continue
+                fp = question_fingerprint(q["question"])
+                if fp in self.served or fp in seen:
+                    continue
+                seen.add(fp)
+                fresh.append(q)
+        return fresh
+
+    def record(self, questions: list) -> None:
+        with self._lock:
+            for q in questions:
+                if isinstance(q, dict) and q.get("question"):
+                    self.served.add(question_fingerprint(q["question"]))
+                    self.recent.append(q["question"])
+            self.rounds += 1
+            self.updated = time.time()
+
+    def as_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "material_id": self.material_id,
+            "served": len(self.served),
+            "rounds": self.rounds,
+            "created": self.created,
+            "updated": self.updated,
+        }
@@ -0,0 +1,273 @@
+"""
+In-process stores with memory accounting
+Dict-like containers that keep a running estimate of the bytes they hold, so the
+admin memory report can tell which store is growing, plus a compressed LRU cache
+bounded by that estimate.
+"""
+
+import gzip
+import json
+import sys
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+
+
+_stores: "list[weakref.ref]" = []
+_containers: "dict[str, Callable]" = {}
+_MISSING = object()
+
+
+def approx_size(obj, _depth: int = 0) -> int:
+    """Approximate deep size of JSON-like data (str/bytes/numbers/dicts/lists/deques)"""
+    size = sys.getsizeof(obj)
+    if _depth > 32:
+        return size
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += approx_size(k, _depth + 1) + approx_size(v, _depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        for item in obj:
+            size += approx_size(item, _depth + 1)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        size += approx_size(vars(obj), _depth + 1)
+    return size
+
+
+class TrackedDict(OrderedDict):
+    """OrderedDict that tracks the approximate byte footprint of its entries"""
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+        self.nbytes = 0
+        self._sizes: dict = {}
+        _stores.append(weakref.ref(self))
+
+    def __setitem__(self, key, value):
+        size = approx_size(key) + approx_size(value)
+        old = self._sizes.get(key)
+        if old is not None:
+            self.nbytes -= old
+        self._sizes[key] = size
+        self.nbytes += size
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.nbytes -= self._sizes.pop(key, 0)
+
+    def pop(self, key, default=_MISSING):
+        if key in self:
+            value = super().pop(key)
+            self.nbytes -= self._sizes.pop(key, 0)
+            return value
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+
+    def popitem(self, last: bool = True):
+        key, value = super().popitem(last=last)
+        self.nbytes -= self._sizes.pop(key, 0)
+        return key, value
+
+    def clear(self):
+        super().clear()
+        self._sizes.clear()
+        self.nbytes = 0
+
+    def resize(self, key) -> None:
+        """Re-measure an entry whose value was mutated in place"""
+        if key in self:
+            size = approx_size(key) + approx_size(super().__getitem__(key))
+            self.nbytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+
+    def largest(self, n: int = 5) -> list[dict]:
+        top = sorted(self._sizes.items(), key=lambda kv: kv[1], reverse=True)[:max(0, n)]
+        return [{"key": str(k)[:64], "bytes": size} for k, size in top]
+
+    def stats(self, top: int = 0) -> dict:
+        info = {"entries": len(self), "bytes": self.nbytes}
+        if top:
+            info["largest"] = self.largest(top)
+        return info
+
+
+def track(name: str, getter: Callable) -> None:
+    """
+    Include a plain container (dict, set, list, deque) in memory_report under `name`.
+    getter returns it; it is measured when the report is built, not on every change.
+    """
+    _containers[name] = getter
+
+
+def _container_stats(container, top: int = 0) -> dict:
+    if isinstance(container, dict):
+        sizes = [(k, approx_size(k) + approx_size(v)) for k, v in list(container.items())]
+    else:
+        sizes = [(i, approx_size(item)) for i, item in enumerate(list(container))]
+    info = {"entries": len(sizes), "bytes": sys.getsizeof(container) + sum(size for _, size in sizes)}
+    if top:
+        largest = sorted(sizes, key=lambda kv: kv[1], reverse=True)[:top]
+        info["largest"] = [{"key": str(k)[:64], "bytes": size} for k, size in largest]
+    return info
+
+
+def memory_report(top: int = 5) -> dict:
+    """
+    Entry counts and approximate bytes for every live TrackedDict, merged by name,
+    and for the containers registered with track()
+    """
+    report: dict = {}
+    _stores[:] = [ref for ref in _stores if ref() is not None]
+    for ref in list(_stores):
+        store = ref()
+        if store is None:
+            continue
+        stats = store.stats(top)
+        existing = report.get(store.name)
+        if existing is None:
+            report[store.name] = stats
+            continue
+        existing["entries"] += stats["entries"]
+        existing["bytes"] += stats["bytes"]
+        if top:
+            merged = existing.get("largest", []) + stats.get("largest", [])
+            existing["largest"] = sorted(merged, key=lambda e: e["bytes"], reverse=True)[:top]
+    for name, getter in list(_containers.items()):
+        try:
+            report[name] = _container_stats(getter(), top)
+        except Exception:
+            continue
+    return report
+
+
+class CompressedCache(TrackedDict):
+    """
+    LRU cache whose values are stored compressed and bounded by total bytes.
+    Entries are {"ts", "kind", "data", "raw", "crc"} dicts; use put() to add, lookup() to read
+    and decode() on hit. Those two (and resize) hold the cache lock, so concurrent
+    requests never see a half-evicted entry or skew the byte counts.
+    With fmt="gzip" the stored data is a valid gzip body that can be sent to clients as-is.
+    """
+
+    def __init__(self, name: str, *, max_bytes: int, max_entries: int = 0, level: int = 6, fmt: str = "zlib"):
+        super().__init__(name)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.level = max(0, min(9, level))
+        self.fmt = fmt
+        self.raw_bytes = 0
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def encode(self, value) -> dict:
+        """Build a cache entry without storing it"""
+        if isinstance(value, bytes):
+            kind, raw = "bytes", value
+        elif isinstance(value, str):
+            kind, raw = "text", value.encode("utf-8")
+        else:
+            kind, raw = "json", json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if self.fmt == "gzip":
+            data = gzip.compress(raw, compresslevel=self.level, mtime=0)
+        else:
+            data = zlib.compress(raw, self.level)
+        # crc32 of the uncompressed bytes, taken here so ETags never need a decompress
+        return {"ts": time.time(), "kind": kind, "data": data, "raw": len(raw), "crc": zlib.crc32(raw)}
+
+    def raw(self, entry: dict) -> bytes:
+        if self.fmt == "gzip":
+            return gzip.decompress(entry["data"])
+        return zlib.decompress(entry["data"])
+
+    def decode(self, entry: dict):
+        raw = self.raw(entry)
+        if entry["kind"] == "bytes":
+            return raw
+        if entry["kind"] == "text":
+            return raw.decode("utf-8")
+        return json.loads(raw)
+
+    def lookup(self, key, max_age: float = 0) -> tuple[Optional[dict], str]:
+        """
+        Read an entry and mark it recently used in one step: (entry, "hit"), (None, "miss"),
+        or (None, "expired") for an entry older than max_age seconds, which is dropped
+        """
+        with self._lock:
+            entry = OrderedDict.get(self, key)
+            if entry is None:
+                return None, "miss"
+            if max_age > 0 and time.time() - entry["ts"] > max_age:
+                self.pop(key, None)
+                return None, "expired"
+            self.move_to_end(key)
+            return entry, "hit"
+
+    def put(self, key, value) -> int:
+        """Store a value; returns how many old entries were evicted to stay in budget"""
+        if not self.enabled:
+            return 0
+        return self.put_entry(key, self.encode(value))
+
+    def put_entry(self, key, entry: dict) -> int:
+        if not self.enabled:
+            return 0
+        with self._lock:
+            if len(entry["data"]) > self.max_bytes:
+                self.pop(key, None)
+                return 0
+            self[key] = entry
+            self.move_to_end(key)
+            evicted = 0
+            while len(self) > 1 and (
+                self.nbytes > self.max_bytes or (self.max_entries > 0 and len(self) > self.max_entries)
+            ):
+                self.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def resize(self, key) -> None:
+        with self._lock:
+            super().resize(key)
+
+    def __setitem__(self, key, value):
+        old = OrderedDict.get(self, key)
+        if old is not None:
+            self.raw_bytes -= old.get("raw", 0)
+        super().__setitem__(key, value)
+        self.raw_bytes += value.get("raw", 0)
+
+    def __delitem__(self, key):
+        old = OrderedDict.get(self, key)
+        super().__delitem__(key)
+        if old is not None:
+            self.raw_bytes -= old.get("raw", 0)
+
+    def pop(self, key, default=_MISSING):
+        old = OrderedDict.get(self, key)
+        if old is not None:
+            self.raw_bytes -= old.get("raw", 0)
+        return super().pop(key, default)
+
+    def popitem(self, last: bool = True):
+        key, value = super().popitem(last=last)
+        self.raw_bytes -= value.get("raw", 0)
+        return key, value
+
+    def clear(self):
+        super().clear()
+        self.raw_bytes = 0
+
+    def stats(self, top: int = 0) -> dict:
+        info = super().stats(top)
+        info["uncompressed_bytes"] = self.raw_bytes
+        info["max_bytes"] = self.max_bytes
+        return info
@@ -0,0 +1,112 @@
+"""
+Per-request span timing
+Collects stage durations (extract, map, reduce, generate, parse, ...) for the current
+request and renders them as a Server-Timing header or a structured log line.
+
+The active trace lives in a context variable, so service code can record spans
+without the trace being passed around. Outside a request every call is a no-op.
+"""
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+
+_current: ContextVar[Optional["RequestTrace"]] = ContextVar("aiapi_request_trace", default=None)
+
+_logger = logging.getLogger("aiapi.timing")
+
+
+class RequestTrace:
+    """Accumulated span durations for one request (same-name spans are summed)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: dict[str, list] = {}
+        self.provider_calls = 0
+        self.provider_seconds = 0.0
+
+    def add(self, name: str, seconds: float) -> None:
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def add_provider_call(self, seconds: float) -> None:
+        self.provider_calls += 1
+        self.provider_seconds += seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        parts = []
+        for name, (seconds, count) in self.spans.items():
+            part = f"{name};dur={seconds * 1000:.1f}"
+            if count > 1:
+                part += f';desc="x{count}"'
+            parts.append(part)
+        if self.provider_calls:
+            parts.append(f'provider;dur={self.provider_seconds * 1000:.1f};desc="{self.provider_calls} calls"')
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def as_dict(self) -> dict:
+        return {
+            "total_ms": round(self.elapsed() * 1000, 1),
+            "spans": {name: {"ms": round(sec * 1000, 1), "count": count} for name, (sec, count) in self.spans.items()},
+            "provider_calls": self.provider_calls,
+            "provider_ms": round(self.provider_seconds * 1000, 1),
+        }
+
+
+def start_trace() -> RequestTrace:
+    trace = RequestTrace()
+    _current.set(trace)
+    return trace
+
+
+def end_trace() -> None:
+    _current.set(None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage of the current request"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+def record_provider_call(seconds: float) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.add_provider_call(seconds)
+
+
+def log_trace(trace: RequestTrace, **fields) -> None:
+    """Emit one JSON line with the request's stage breakdown"""
+    if not _logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _logger.addHandler(handler)
+        _logger.setLevel(logging.INFO)
+        _logger.propagate = False
+    payload = dict(fields)
+    payload.update(trace.as_dict())
+    _logger.info(json.dumps(payload, ensure_ascii=False))
@@ -0,0 +1,118 @@
+"""
+Validation of generated questions and learn plans
+Malformed items are dropped instead of being passed to the frontend, answer options
+are deduplicated, and complete questions are salvaged from truncated output, so a
+short result can be topped up with a small follow-up call rather than regenerated.
+"""
+
+import json
+from typing import Optional
+
+from services.sessions import question_fingerprint
+
+
+WRONG_OPTIONS = 3
+
+
+def _text(value) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)
+    return value.strip() if isinstance(value, str) else ""
+
+
+def validate_question(item, with_explanation: bool) -> Optional[dict]:
+    """Cleaned copy of one question, or None when it cannot be shown as a 4-option item"""
+    if not isinstance(item, dict):
+        return None
+    question = _text(item.get("question"))
+    correct = _text(item.get("correct"))
+    if not question or not correct:
+        return None
+
+    seen = {correct.casefold()}
+    wrong = []
+    for option in item.get("wrong") or []:
+        option = _text(option)
+        if option and option.casefold() not in seen:
+            seen.add(option.casefold())
+            wrong.append(option)
+    if len(wrong) < WRONG_OPTIONS:
+        return None
+
+    cleaned = {**item, "question": question, "correct": correct, "wrong": wrong[:WRONG_OPTIONS]}
+    if with_explanation:
+        explanation = _text(item.get("explanation"))
+        if not explanation:
+            return None
+        cleaned["explanation"] = explanation
+    return cleaned
+
+
+def validate_questions(items, count, with_explanation: bool) -> tuple[list[dict], int]:
+    """
+    Keep valid, distinct questions (at most `count`) renumbered from 1.
+    Returns (questions, missing) where missing is how many a top-up should ask for.
+    """
+    try:
+        count = max(1, int(count))
+    except Exception:
+        count = 10
+    questions: list[dict] = []
+    seen = set()
+    for item in items if isinstance(items, list) else []:
+        cleaned = validate_question(item, with_explanation)
+        if cleaned is None:
+            continue
+        fp = question_fingerprint(cleaned["question"])
+        if fp in seen:
+            continue
+        seen.add(fp)
+        cleaned["id"] = len(questions) + 1
+        questions.append(cleaned)
+        if len(questions) >= count:
+            break
+    return questions, count - len(questions)
+
+
+def validate_plan(result, history_mode: bool) -> list[dict]:
+    """Sections with a title and usable content; their questions validated like practice ones"""
+    plan = result.get("plan") if isinstance(result, dict) else None
+    sections = []
+    for section in plan if isinstance(plan, list) else []:
+        if not isinstance(section, dict) or not _text(section.get("title")):
+            continue
+        content = section.get("content")
+        if history_mode:
+            if not isinstance(content, dict) or not (
+                content.get("general") or content.get("summary") or content.get("timeline")
+            ):
+                continue
+        elif not content or (isinstance(content, dict) and not content.get("data")):
+            continue
+        questions = section.get("questions")
+        section = {**section, "questions": validate_questions(questions, len(questions or []) or 1, True)[0]}
+        sections.append(section)
+    return sections
+
+
+def salvage_questions(text: str) -> list:
+    """Complete question objects from a truncated {"questions": [...]} response"""
+    start = text.find('"questions"')
+    if start == -1:
+        return []
+    pos = text.find("[", start)
+    if pos == -1:
+        return []
+    decoder = json.JSONDecoder()
+    items = []
+    pos += 1
+    while True:
+        pos = text.find("{", pos)
+        if pos == -1:
+            break
+        try:
+            item, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            break
+        items.append(item)
+    return items
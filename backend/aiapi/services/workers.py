@@ -0,0 +1,68 @@
+"""
+Bounded background worker pools
+Thread pools with a cap on queued + running tasks, so background work
+(cache refreshes, precompute, jobs) can never pile up without limit.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+
+class BoundedExecutor:
+    """ThreadPoolExecutor that refuses new work once `max_pending` tasks are queued or running"""
+
+    def __init__(self, name: str, max_workers: int, max_pending: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"aiapi-{name}")
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Optional[Future]:
+        """Schedule fn; returns None (without running it) when the pool is saturated"""
+        if not self._slots.acquire(blocking=False):
+            return None
+        with self._lock:
+            self.pending += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _f: self._release())
+        return future
+
+    def _release(self) -> None:
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+
+_executors: dict[str, BoundedExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str, default_workers: int = 2, default_pending: int = 32) -> BoundedExecutor:
+    """
+    Shared pool by name. Sizes come from AI_<NAME>_WORKERS / AI_<NAME>_QUEUE_MAX
+    (e.g. AI_REFRESH_WORKERS), falling back to the given defaults.
+    """
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            prefix = f"AI_{name.upper()}"
+            try:
+                workers = int(os.getenv(f"{prefix}_WORKERS", str(default_workers)))
+            except Exception:
+                workers = default_workers
+            try:
+                pending = int(os.getenv(f"{prefix}_QUEUE_MAX", str(default_pending)))
+            except Exception:
+                pending = default_pending
+            executor = BoundedExecutor(name, workers, pending)
+            _executors[name] = executor
+        return executor
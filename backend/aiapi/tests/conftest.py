@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Tests import the app modules the same way app.py does ("from services...")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# App-level tests run against the offline fake provider, without the warm-up thread
+os.environ.setdefault("AI_PROVIDER", "fake")
+os.environ.setdefault("AI_WARMUP", "off")
+os.environ.setdefault("FAKE_LLM_LATENCY_MS", "0")
+os.environ.setdefault("AI_RATE_LIMIT_ENABLED", "false")
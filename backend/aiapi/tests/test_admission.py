@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from services.admission import AdmissionController, AdmissionRejected, admission_priority
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def _queue(controller, priority, results):
+    def run():
+        try:
+            with admission_priority(priority):
+                with controller.slot():
+                    results.append(priority)
+        except AdmissionRejected as e:
+            results.append(f"{priority}:{e.reason}")
+
+    thread = threading.Thread(target=run)
+    waiting = len(controller._waiters)
+    thread.start()
+    _wait_for(lambda: len(controller._waiters) > waiting or results)
+    return thread
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    controller = AdmissionController(max_concurrent=1, max_queue=8, max_wait=5, retry_after=3)
+    results = []
+    controller.acquire("interactive")
+    threads = [_queue(controller, p, results) for p in ("background", "interactive", "realtest", "interactive")]
+    controller.release()
+    for t in threads:
+        t.join(5)
+    assert results == ["realtest", "interactive", "interactive", "background"]
+    assert controller.active == 0
+
+
+def test_full_queue_sheds_lower_priority_or_rejects():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, max_wait=5, retry_after=3)
+    results = []
+    controller.acquire("interactive")
+    background = _queue(controller, "background", results)
+    interactive = _queue(controller, "interactive", results)
+    background.join(5)
+    assert results == ["background:shed"]
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("interactive")
+    assert rejected.value.reason == "queue full" and rejected.value.retry_after == 3
+
+    controller.release()
+    interactive.join(5)
+    assert results == ["background:shed", "interactive"]
+
+
+def test_waiter_times_out():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, max_wait=0.05, retry_after=1)
+    controller.acquire("interactive")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("interactive")
+    assert rejected.value.reason == "timeout"
+    assert not controller._waiters
@@ -0,0 +1,255 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import app as api
+
+
+MATERIAL = "Абай Құнанбайұлы 1845 жылы дүниеге келген. " * 20
+
+
+@pytest.fixture(autouse=True)
+def _clean_state():
+    api._pending_generations.clear()
+    api._precompute_status.clear()
+    api._cache.clear()
+    yield
+    api._pending_generations.clear()
+
+
+def _practice_step(material=MATERIAL):
+    params = {"material": api.as_material(material), "language": "kk", "count": 10, "exclude_questions": []}
+    return "practice", params, api._cache_key("practice", params)
+
+
+def test_await_precompute_cancels_queued_step_and_drops_it():
+    future = Future()
+    api._pending_generations["k"] = future
+    assert api._await_precompute("k") is None
+    assert future.cancelled()
+    assert "k" not in api._pending_generations
+
+
+def test_cancelled_precompute_step_is_released():
+    endpoint, params, key = _practice_step()
+    future = Future()
+    api._pending_generations[key] = future
+    api._set_precompute_status("m1", {"status": "queued", "steps": {"prepare": "queued", endpoint: "queued"}})
+    future.cancel()
+
+    api._run_precompute("m1", params["material"], "ip:test", "kk", False, [(endpoint, params, key)], {key: future})
+
+    assert api._precompute_status["m1"]["steps"][endpoint] == "cancelled"
+    assert key not in api._pending_generations
+
+
+def test_precompute_after_cancel_schedules_the_step_again(monkeypatch):
+    endpoint, params, key = _practice_step()
+    queued = Future()
+    api._pending_generations[key] = queued
+    assert api._await_precompute(key) is None
+
+    monkeypatch.setenv("AI_PRECOMPUTE_MODES", "practice")
+    monkeypatch.setenv("AI_PRECOMPUTE_COUNT", "10")
+    status = api._start_precompute("m2", params["material"], client_key="ip:test", language="kk",
+                                   mode=None, history_mode=False)
+    assert endpoint in status["steps"]
+    pending = api._pending_generations.get(key)
+    assert pending is not None and pending is not queued
+    assert pending.result(timeout=10)["etag"]
+
+
+def test_cache_hits_are_not_charged_to_the_rate_limit(monkeypatch):
+    monkeypatch.setenv("AI_RATE_LIMIT_ENABLED", "true")
+    monkeypatch.setenv("AI_RATE_LIMIT_PER_WINDOW", "1")
+    api._rate_limits.clear()
+    client = api.app.test_client()
+    body = {"material": MATERIAL, "count": 10, "user_id": "u1"}
+
+    assert client.post("/api/generate/practice", json=body).status_code == 200
+    assert client.post("/api/generate/practice", json=body).status_code == 200
+    assert client.post("/api/generate/practice", json={**body, "count": 15}).status_code == 429
+    assert api._rate_limits["user:u1"]["count"] == 2
+
+
+def test_matching_if_none_match_is_304_on_get_and_412_on_post():
+    client = api.app.test_client()
+    body = {"material": MATERIAL, "count": 10}
+    first = client.post("/api/generate/practice", json=body)
+    etag = first.headers["ETag"]
+
+    again = client.post("/api/generate/practice", json=body, headers={"If-None-Match": etag})
+    assert again.status_code == 412
+
+    job = client.post("/api/jobs/practice", json=body).get_json()
+    assert client.get(job["result_url"], headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(job["result_url"], headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def _job_result(client, job, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        response = client.get(job["result_url"])
+        if response.status_code != 202 or time.monotonic() > deadline:
+            return response
+        time.sleep(0.01)
+
+
+def test_job_ids_are_per_client():
+    client = api.app.test_client()
+    body = {"material": MATERIAL, "count": 10}
+    first = client.post("/api/jobs/practice", json={**body, "user_id": "a"}).get_json()
+    second = client.post("/api/jobs/practice", json={**body, "user_id": "b"}).get_json()
+    again = client.post("/api/jobs/practice", json={**body, "user_id": "a"}).get_json()
+    assert first["job_id"] != second["job_id"]
+    assert first["job_id"] == again["job_id"]
+
+
+def test_jobs_charge_the_rate_limit_only_for_new_generations(monkeypatch):
+    monkeypatch.setenv("AI_RATE_LIMIT_ENABLED", "true")
+    monkeypatch.setenv("AI_RATE_LIMIT_PER_WINDOW", "1")
+    api._rate_limits.clear()
+    client = api.app.test_client()
+    body = {"material": MATERIAL, "count": 10, "user_id": "u3"}
+
+    job = client.post("/api/jobs/practice", json=body).get_json()
+    assert client.post("/api/jobs/practice", json=body).get_json()["job_id"] == job["job_id"]
+    assert _job_result(client, job).status_code == 200
+    api._jobs.clear()
+    # A fresh job over a cached generation does not reach the provider
+    assert client.post("/api/jobs/practice", json=body).status_code == 200
+    assert api._rate_limits["user:u3"]["count"] == 1
+    assert client.post("/api/jobs/practice", json={**body, "count": 15}).status_code == 429
+
+
+def test_session_job_result_skips_served_questions():
+    client = api.app.test_client()
+    session = client.post("/api/sessions", json={"material": MATERIAL, "served_questions": ["Served one?"]}).get_json()
+    params = api._generation_params("practice", {"session_id": session["session_id"], "count": 10})
+    item = {"correct": "a", "wrong": ["b", "c", "d"], "explanation": "e"}
+    api._cache_set(api._cache_key("practice", params), {"questions": [
+        {**item, "id": 1, "question": "Served one?"}, {**item, "id": 2, "question": "New one?"},
+    ]})
+
+    job = client.post("/api/jobs/practice", json={"session_id": session["session_id"], "count": 10}).get_json()
+    questions = [q["question"] for q in _job_result(client, job).get_json()["questions"]]
+    assert "Served one?" not in questions
+    assert "New one?" in questions
+    # Polling again serves the same batch without filtering it against itself
+    assert [q["question"] for q in client.get(job["result_url"]).get_json()["questions"]] == questions
+
+
+def test_practice_prefetches_the_next_continue_batch(monkeypatch):
+    monkeypatch.setenv("AI_PREFETCH_ENABLED", "true")
+    client = api.app.test_client()
+    body = {"material": MATERIAL, "count": 10, "language": "kk"}
+    served = [q["question"] for q in client.post("/api/generate/practice", json=body).get_json()["questions"]]
+
+    follow_up = {**body, "previous_questions": served}
+    key = api._cache_key("continue", api._generation_params("continue", follow_up))
+    deadline = time.monotonic() + 10
+    while key not in api._cache:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    assert api._cache[key].get("prefetched")
+    assert client.post("/api/generate/continue", json=follow_up).status_code == 200
+
+
+def test_prefetch_is_charged_to_the_client_rate_limit(monkeypatch):
+    monkeypatch.setenv("AI_PREFETCH_ENABLED", "true")
+    monkeypatch.setenv("AI_RATE_LIMIT_ENABLED", "true")
+    monkeypatch.setenv("AI_RATE_LIMIT_PER_WINDOW", "1")
+    api._rate_limits.clear()
+    client = api.app.test_client()
+    body = {"material": MATERIAL, "count": 10, "language": "kk", "user_id": "u2"}
+    served = [q["question"] for q in client.post("/api/generate/practice", json=body).get_json()["questions"]]
+
+    deadline = time.monotonic() + 10
+    while api._rate_limits["user:u2"]["count"] < 2 or api.get_executor("prefetch").pending:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    follow_up = {**body, "previous_questions": served}
+    key = api._cache_key("continue", api._generation_params("continue", follow_up))
+    assert key not in api._cache
+    assert key not in api._pending_generations
+    assert client.post("/api/generate/continue", json=follow_up).status_code == 429
+
+
+def test_default_precompute_caches_practice_and_learn(monkeypatch):
+    monkeypatch.setenv("AI_PRECOMPUTE_MODES", "practice,learn")
+    material = api.as_material(MATERIAL)
+    status = api._start_precompute("m3", material, client_key="ip:test", language="kk",
+                                   mode=None, history_mode=False)
+    assert {"practice", "learn"} <= set(status["steps"])
+
+    learn_key = api._cache_key("learn", {"material": material, "language": "kk", "history_mode": False})
+    future = api._pending_generations.get(learn_key)
+    if future is not None:
+        future.result(timeout=10)
+    deadline = time.monotonic() + 10
+    while api._precompute_status["m3"]["status"] not in ("done", "failed"):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert api._precompute_status["m3"]["steps"]["learn"] == "done"
+    assert api._cache_lookup(learn_key)[0] is not None
+
+
+def test_bundle_fills_the_other_views_from_one_call(monkeypatch):
+    monkeypatch.setenv("AI_BUNDLE_ENABLED", "true")
+    model = api.get_gemini_service().model
+    client = api.app.test_client()
+    body = {"material": MATERIAL, "count": 10, "language": "kk"}
+
+    calls = model.calls
+    practice = client.post("/api/generate/practice", json=body).get_json()["questions"]
+    assert model.calls == calls + 1
+    realtest = client.post("/api/generate/realtest", json=body).get_json()["questions"]
+    flashcards = client.post("/api/generate/flashcards", json=body).get_json()["flashcards"]
+    assert model.calls == calls + 1
+
+    assert [q["id"] for q in practice] == [q["id"] for q in realtest] == list(range(1, 11))
+    assert all(q.get("explanation") for q in practice)
+    assert not any("explanation" in q for q in realtest)
+    # Realtest is the tail of the 2 * count pool, so the two sets do not overlap
+    assert not {q["question"] for q in practice} & {q["question"] for q in realtest}
+    assert [(c["front"], c["back"]) for c in flashcards] == [(q["question"], q["correct"]) for q in practice]
+
+
+def test_metrics_are_prometheus_text_behind_the_token(monkeypatch):
+    client = api.app.test_client()
+    client.get("/api/health")
+    response = client.get("/api/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert "# TYPE aiapi_request_duration_seconds histogram" in text
+    assert 'aiapi_request_duration_seconds_count{endpoint="/api/health",method="GET",status="200"}' in text
+    assert "Server-Timing" not in response.headers
+
+    monkeypatch.setenv("AI_METRICS_TOKEN", "s3cret")
+    assert client.get("/api/metrics").status_code == 401
+    assert client.get("/api/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get("/api/metrics", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+
+
+def _timing(response) -> dict:
+    parts = [part.strip().split(";") for part in response.headers["Server-Timing"].split(",")]
+    return {name: dict(field.split("=", 1) for field in fields) for name, *fields in parts}
+
+
+def test_server_timing_breaks_down_generations(monkeypatch):
+    client = api.app.test_client()
+    body = {"material": MATERIAL, "count": 10}
+    miss = _timing(client.post("/api/generate/practice", json=body))
+    assert {"cache", "generate", "parse", "provider", "total"} <= set(miss)
+    assert miss["provider"]["desc"] == '"1 calls"'
+    assert float(miss["total"]["dur"]) >= float(miss["generate"]["dur"])
+
+    hit = _timing(client.post("/api/generate/practice", json=body))
+    assert "provider" not in hit and "total" in hit
+
+    monkeypatch.setenv("AI_SERVER_TIMING", "false")
+    assert "Server-Timing" not in client.post("/api/generate/practice", json=body).headers
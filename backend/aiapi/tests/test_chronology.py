@@ -0,0 +1,43 @@
+from services.chronology import extract_events, local_share, timeline
+from services.material import Material
+
+
+WRAPPED = (
+    "[PAGE 3]\n"
+    "Қазақ хандығы\n"
+    "\n"
+    "1465 жылы Керей мен Жәнібек сұлтандар\n"
+    "Қазақ хандығын құрып, Шу өңіріне\n"
+    "қоныстанды. Тәуке хан тұсында 1710\n"
+    "жылы Қарақұм жиыны өтті.\n"
+    "\n"
+    "[PAGE 4]\n"
+    "В 1731 году Абулхаир хан принял\n"
+    "российское подданство.\n"
+)
+
+
+def test_wrapped_lines_are_joined_into_sentences():
+    events = extract_events(WRAPPED)
+    assert [(e.year, e.page) for e in events] == [(1465, 3), (1710, 3), (1731, 4)]
+    assert events[0].text == "1465 жылы Керей мен Жәнібек сұлтандар Қазақ хандығын құрып, Шу өңіріне қоныстанды."
+    assert "\n" not in events[1].masked and "1710" not in events[1].masked
+
+
+def test_heading_is_not_glued_to_paragraph():
+    events = extract_events(WRAPPED)
+    assert not any(e.text.startswith("Қазақ хандығы ") for e in events)
+
+
+def test_cache_is_keyed_by_digest():
+    material = Material(WRAPPED)
+    assert extract_events(material) is extract_events(str(WRAPPED))
+    assert [row["year"] for row in timeline(material)] == [1465, 1710, 1731]
+
+
+def test_local_share_only_for_history_unless_opted_in(monkeypatch):
+    material = " ".join(f"{1700 + i} жылы маңызды оқиға болып, келісім жасалды." for i in range(10))
+    assert local_share(material, 10) == 0
+    assert local_share(material, 10, history_mode=True) == 3
+    monkeypatch.setenv("AI_CHRONOLOGY_SHARE_OTHER", "0.2")
+    assert local_share(material, 10) == 2
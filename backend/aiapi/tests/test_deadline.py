@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+import app as api
+from services.deadline import DeadlineExceeded, check, degraded_reason, mark_degraded, remaining, request_budget
+
+
+def test_no_budget_means_no_deadline():
+    assert remaining() is None
+    with request_budget(None):
+        assert check() is None
+        mark_degraded()
+        assert degraded_reason() == "deadline"
+    assert degraded_reason() is None
+
+
+def test_exhausted_budget_raises_and_first_reason_wins():
+    with request_budget(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            check()
+        mark_degraded("incomplete")
+        mark_degraded("deadline")
+        assert degraded_reason() == "incomplete"
+
+
+def test_request_budget_is_opt_in(monkeypatch):
+    monkeypatch.delenv("AI_REQUEST_BUDGET_SECONDS", raising=False)
+    with api.app.test_request_context("/api/generate/practice", method="POST"):
+        assert api._request_budget() is None
+    with api.app.test_request_context("/api/generate/practice", method="POST", headers={"X-Request-Budget": "5"}):
+        assert 0 < api._request_budget() <= 5
+    monkeypatch.setenv("AI_REQUEST_BUDGET_SECONDS", "3")
+    with api.app.test_request_context("/api/generate/practice", method="POST", headers={"X-Request-Budget": "5"}):
+        assert 0 < api._request_budget() <= 3
@@ -0,0 +1,40 @@
+import asyncio
+
+from services.fake_service import FakeGeminiService
+
+
+MATERIAL = "Абай Құнанбайұлы 1845 жылы дүниеге келген. " * 60
+
+
+def _two_batches(service):
+    first = asyncio.run(service.generate_practice_questions(MATERIAL, 5))
+    served = [q["question"] for q in first["questions"]]
+    asyncio.run(service.generate_practice_questions(MATERIAL, 5, served))
+    return service.model
+
+
+def test_material_prefix_is_cached_once_and_reused(monkeypatch):
+    monkeypatch.setenv("GEMINI_CONTEXT_CACHE_MIN_CHARS", "1000")
+    cached = _two_batches(FakeGeminiService())
+    assert cached.calls == 2
+    assert cached.contexts_created == 1
+    assert cached.context_calls == 2
+
+    monkeypatch.setenv("FAKE_LLM_CONTEXT_CACHE", "false")
+    plain = _two_batches(FakeGeminiService())
+    assert plain.context_calls == 0
+    assert cached.input_chars < plain.input_chars
+    # Only the per-call suffix goes out once the prefix is registered
+    prefix = len(FakeGeminiService()._material_prefix(MATERIAL))
+    assert plain.input_chars - cached.input_chars == 2 * prefix
+
+
+def test_topup_fills_the_requested_count_without_duplicates(monkeypatch):
+    monkeypatch.setenv("FAKE_LLM_DEFECT_RATE", "0.4")
+    monkeypatch.setenv("GEMINI_TOPUP_ROUNDS", "3")
+    service = FakeGeminiService()
+    questions = asyncio.run(service.generate_practice_questions(MATERIAL, 10))["questions"]
+    assert service.model.calls > 1
+    assert len(questions) == 10
+    assert len({q["question"] for q in questions}) == 10
+    assert [q["id"] for q in questions] == list(range(1, 11))
@@ -0,0 +1,36 @@
+from services.history_quiz import HistoryQuiz, get_history_quiz
+
+
+def _figure(idx, facts):
+    return {
+        "id": idx,
+        "name": {"kk": f"Тұлға {idx}", "ru": f"Личность {idx}", "en": f"Figure {idx}"},
+        "facts": [{"level": 1, "text": {"kk": t, "ru": t, "en": t}} for t in facts],
+    }
+
+
+def test_who_questions_need_enough_figures_with_facts():
+    # Four figures, but only two have facts: the "who" kind is enabled and must not crash
+    figures = [_figure(1, ["a1", "a2", "a3"]), _figure(2, ["b1", "b2", "b3"]), _figure(3, []), _figure(4, [])]
+    result = HistoryQuiz(figures).generate(10, seed=1)
+    assert all(len(q["wrong"]) == 3 and q["correct"] not in q["wrong"] for q in result["questions"])
+
+
+def test_dataset_quiz_uses_questions_schema():
+    quiz = get_history_quiz()
+    result = quiz.generate(15, lang="ru", seed=7)
+    assert len(result["questions"]) == 15
+    assert [q["id"] for q in result["questions"]] == list(range(1, 16))
+    assert all({"question", "correct", "wrong", "explanation"} <= q.keys() for q in result["questions"])
+
+
+def test_distractors_come_from_other_figures():
+    figures = [_figure(i, [f"f{i}-{k}" for k in range(4)]) for i in range(1, 7)]
+    quiz = HistoryQuiz(figures)
+    for q in quiz.generate(30, lang="en", seed=3)["questions"]:
+        if q["question"].startswith("Which statement is about"):
+            owner = q["correct"].split("-")[0]
+            assert all(not w.startswith(owner + "-") for w in q["wrong"])
+        elif q["question"].startswith("Which statement is NOT"):
+            owner = q["wrong"][0].split("-")[0]
+            assert not q["correct"].startswith(owner + "-")
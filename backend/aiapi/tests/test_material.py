@@ -0,0 +1,34 @@
+from services.material import Material, parse_page_range
+from services.stores import TrackedDict, memory_report
+
+
+BOOK = "\n\n".join(f"[PAGE {n}]\nТарау {n} мәтіні." for n in range(1, 21))
+
+
+def test_page_slice_keeps_one_handle_per_range():
+    material = Material(BOOK)
+    piece = material.page_slice(3, 5)
+    assert piece.startswith("[PAGE 3]") and "[PAGE 6]" not in piece
+    assert [page for page, _ in piece.pages] == [3, 4, 5]
+    assert material.page_slice(3, 5) is piece
+    assert Material(BOOK).page_slice(3, 5) is piece
+    assert material.page_slice(30, 40) is None
+
+
+def test_slicing_does_not_grow_stored_material():
+    store = TrackedDict("test_materials")
+    store["m"] = Material(BOOK)
+    before = store.nbytes
+    for first in range(1, 15):
+        store["m"].page_slice(first, first + 5)
+    store.resize("m")
+    assert store.nbytes == before
+    assert memory_report()["material_slices"]["entries"] > 0
+
+
+def test_parse_page_range():
+    assert parse_page_range("12-18") == (12, 18)
+    assert parse_page_range([4]) == (4, 4)
+    assert parse_page_range({"from": 2, "to": 3}) == (2, 3)
+    assert parse_page_range("5-2") is None
+    assert parse_page_range(True) is None
@@ -0,0 +1,24 @@
+from services.pdf_service import compact_pages
+
+
+def _book(headings):
+    pages = []
+    for num, heading in enumerate(headings, start=1):
+        body = "\n".join(f"Қазақ хандығы туралы {num}-беттегі {i}-сөйлем." for i in range(5))
+        pages.append((num, f"Қазақстан тарихы — {num + 10}\n{heading}\n{body}\n{num + 10}"))
+    return pages
+
+
+def test_running_header_and_page_number_are_removed():
+    pages = _book([f"{n}-тарау" for n in range(1, 7)])
+    stats = compact_pages(pages)
+    assert stats["repeated_lines"] + stats["page_numbers"] == 12
+    assert all(text.split("\n")[0].endswith("-тарау") for _, text in pages)
+    assert all(text.endswith("4-сөйлем.") for _, text in pages)
+
+
+def test_heading_that_changes_per_page_is_kept():
+    headings = [f"Chapter {n}" for n in range(1, 7)] + [f"§ {n}" for n in range(1, 7)] + [f"{n}-тарау" for n in range(1, 7)]
+    pages = _book(headings)
+    compact_pages(pages)
+    assert [text.split("\n")[0] for _, text in pages] == headings
@@ -0,0 +1,23 @@
+from werkzeug.test import Client
+
+import app as api
+from services.profiling import ProfilerMiddleware
+
+
+def test_only_requests_with_the_admin_token_are_profiled(tmp_path):
+    client = Client(ProfilerMiddleware(api.app.wsgi_app, str(tmp_path), "s3cret"))
+    body = {"material": "Абай Құнанбайұлы 1845 жылы дүниеге келген. " * 20, "count": 10}
+
+    assert client.post("/api/generate/practice", json=body).status_code == 200
+    assert client.get("/api/health", headers={"X-Profile": "wrong"}).status_code == 200
+    assert not list(tmp_path.iterdir())
+
+    response = client.post("/api/generate/practice", json=body, headers={"X-Profile": "s3cret"})
+    assert response.status_code == 200
+    assert response.get_json()["questions"]
+    profiles = sorted(p.suffix for p in tmp_path.iterdir())
+    assert profiles == [".prof", ".txt"]
+    report = next(tmp_path.glob("*.txt")).read_text(encoding="utf-8")
+    assert report.startswith("path: /api/generate/practice\ncache_key: ")
+    assert "cache_key: nokey" not in report
+    assert "cumulative" in report
@@ -0,0 +1,9 @@
+from services.schemas import output_token_budget
+
+
+def test_thinking_reserve_is_added_on_top_of_the_visible_cap(monkeypatch):
+    monkeypatch.setenv("AI_OUTPUT_TOKENS_MAX", "4096")
+    monkeypatch.setenv("AI_OUTPUT_THINKING_TOKENS", "2000")
+    assert output_token_budget("practice", 10) == 4096
+    assert output_token_budget("practice", 10, thinking=True) == 6096
+    assert output_token_budget("realtest", 10, thinking=True) == 1024 + 2100 + 2000
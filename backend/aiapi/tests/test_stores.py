@@ -0,0 +1,76 @@
+import random
+import threading
+from collections import deque
+
+from services import stores
+from services.stores import CompressedCache, approx_size, memory_report, track
+
+
+def test_concurrent_lookup_and_put_keep_accounting_exact():
+    cache = CompressedCache("test", max_bytes=20000, max_entries=16)
+    errors = []
+
+    def worker(seed):
+        try:
+            for i in range(400):
+                key = f"k{(seed * 7 + i) % 40}"
+                if i % 3:
+                    cache.lookup(key, max_age=60)
+                else:
+                    cache.put(key, {"questions": [f"q{seed}-{i}"] * (i % 9)})
+        except Exception as e:  # pragma: no cover - the assertion below reports it
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert len(cache) <= 16
+    assert cache.nbytes == sum(approx_size(k) + approx_size(v) for k, v in cache.items())
+    assert cache.raw_bytes == sum(v["raw"] for v in cache.values())
+
+
+def test_lookup_drops_expired_entries():
+    cache = CompressedCache("test", max_bytes=20000)
+    cache.put("a", {"x": 1})
+    cache["a"]["ts"] -= 120
+    assert cache.lookup("a", max_age=60) == (None, "expired")
+    assert cache.lookup("a") == (None, "miss")
+    assert len(cache) == 0 and cache.raw_bytes == 0
+
+
+def test_report_counts_deques_and_tracked_containers(monkeypatch):
+    # Local registry, so the test container does not outlive the test
+    monkeypatch.setattr(stores, "_containers", {})
+    assert approx_size(deque(["x" * 1000])) > 1000
+    queue = ["y" * 2000]
+    track("test_queue", lambda: queue)
+    report = memory_report(1)["test_queue"]
+    assert report["entries"] == 1 and report["bytes"] > 2000
+    assert report["largest"][0]["bytes"] > 2000
+
+
+def test_byte_budget_counts_compressed_size_and_evicts_least_recently_used():
+    noise = random.Random(7)
+    cache = CompressedCache("test", max_bytes=10000, fmt="gzip")
+    # Repetitive JSON compresses far below its raw size, so many entries fit
+    for n in range(5):
+        cache.put(f"text{n}", {"questions": ["Абай Құнанбайұлы 1845 жылы"] * 200})
+    assert len(cache) == 5 and cache.raw_bytes > cache.max_bytes
+    assert cache.decode(cache.lookup("text0")[0]) == {"questions": ["Абай Құнанбайұлы 1845 жылы"] * 200}
+    cache.clear()
+
+    for key in "abc":
+        assert cache.put(key, noise.randbytes(2500)) == 0
+    cache.lookup("a")
+    assert cache.put("d", noise.randbytes(2500)) == 1
+    assert list(cache) == ["c", "a", "d"]
+    assert cache.nbytes <= cache.max_bytes
+
+    # An entry over the whole budget is not stored and does not flush the others
+    assert cache.put("huge", noise.randbytes(20000)) == 0
+    assert "huge" not in cache and len(cache) == 3
+    assert CompressedCache("off", max_bytes=0).put("a", b"x") == 0
@@ -0,0 +1,40 @@
+import json
+
+from services.validation import salvage_questions, validate_questions
+
+
+def _item(question, correct="Иә", wrong=("Жоқ", "Мүмкін", "Белгісіз"), **extra):
+    return {"question": question, "correct": correct, "wrong": list(wrong), "explanation": "Себебі.", **extra}
+
+
+def test_invalid_options_and_duplicates_are_dropped():
+    items = [
+        _item("Бірінші?", wrong=("Жоқ", "иә", "жоқ", "Мүмкін", "Белгісіз", "Тағы")),
+        _item("бірінші?"),
+        _item("Екінші?", wrong=("Жоқ", "Жоқ", "Иә")),
+        _item("Үшінші?", correct=""),
+        {"question": "Төртінші?", "correct": "Иә", "wrong": ["А", "Б", "В"]},
+        "not a question",
+    ]
+    questions, missing = validate_questions(items, 5, with_explanation=True)
+    assert [q["question"] for q in questions] == ["Бірінші?"]
+    assert questions[0]["wrong"] == ["Жоқ", "Мүмкін", "Белгісіз"]
+    assert missing == 4
+    # Without explanations the fourth item is usable
+    assert len(validate_questions(items, 5, with_explanation=False)[0]) == 2
+
+
+def test_extra_questions_are_cut_to_the_count_and_renumbered():
+    items = [_item(f"Сұрақ {n}?", id=n * 7) for n in range(8)]
+    questions, missing = validate_questions(items, 5, with_explanation=True)
+    assert [q["id"] for q in questions] == [1, 2, 3, 4, 5]
+    assert missing == 0
+    assert validate_questions(items, "many", with_explanation=True)[1] == 2
+
+
+def test_salvage_recovers_complete_items_from_truncated_json():
+    text = json.dumps({"questions": [_item("Бірінші?"), _item("Екінші?"), _item("Үшінші?")]}, ensure_ascii=False)
+    cut = text[: text.index("Үшінші?") + 4]
+    with_fence = "```json\n" + cut
+    assert [q["question"] for q in salvage_questions(with_fence)] == ["Бірінші?", "Екінші?"]
+    assert salvage_questions('{"plan": [') == []
@@ -624,6 +624,7 @@ const i18n = {
         exit: 'Шығу',
         uploadError: 'Жүктеу қатесі',
         generationError: 'Генерация қатесі',
+        historyQuizFallback: 'AI сервері қолжетімсіз: сұрақтар сіздің материалыңыздан емес, тарихи тұлғалар базасынан алынды',
         noPlanFound: 'Оқу жоспары табылмады',
         selectPdf: 'PDF файлын таңдаңыз',
         continue: 'Жалғастыру',
@@ -989,6 +990,7 @@ const i18n = {
         exit: 'Выход',
         uploadError: 'Ошибка загрузки',
         generationError: 'Ошибка генерации',
+        historyQuizFallback: 'AI-сервер недоступен: вопросы взяты не из вашего материала, а из базы исторических личностей',
         noPlanFound: 'План обучения не найден',
         selectPdf: 'Выберите PDF файл',
         continue: 'Продолжить',
@@ -1354,6 +1356,7 @@ const i18n = {
         exit: 'Exit',
         uploadError: 'Upload error',
         generationError: 'Generation error',
+        historyQuizFallback: 'AI server unavailable: these questions come from the historical figures dataset, not your material',
         noPlanFound: 'Learning plan not found',
         selectPdf: 'Select PDF file',
         continue: 'Continue',
@@ -8279,6 +8282,7 @@ const AITeacher = {
     flashcardsData: [],
     questionsData: [],
     previousQuestions: [],
+    sessionId: null,
     questionCount: 10,
     
     
@@ -8316,6 +8320,9 @@ const AITeacherAPI = {
         } else {
             formData.append('text', material);
         }
+        formData.append('language', currentLang);
+        formData.append('mode', AITeacher.currentMode || '');
+        formData.append('history_mode', AITeacher.historyMode ? 'true' : 'false');
         
         const response = await fetch(`${AI_TEACHER_API_URL}/upload`, {
             method: 'POST',
@@ -8343,11 +8350,67 @@ const AITeacherAPI = {
         return response.json();
     },
     
-    async generatePractice(materialId, count, excludeQuestions = []) {
-        const response = await fetch(`${AI_TEACHER_API_URL}/generate/practice`, {
+    async createSession(materialId, servedQuestions = []) {
+        const response = await fetch(`${AI_TEACHER_API_URL}/sessions`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ material_id: materialId, count, exclude_questions: excludeQuestions, language: currentLang })
+            body: JSON.stringify({ material_id: materialId, user_id: currentUser?.id, served_questions: servedQuestions })
+        });
+        
+        if (!response.ok) return null;
+        const data = await response.json();
+        return data.session_id || null;
+    },
+    
+    async generatePractice(materialId, count, excludeQuestions = [], sessionId = null) {
+        const send = (id) => fetch(`${AI_TEACHER_API_URL}/generate/practice`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(id
+                ? { session_id: id, count, language: currentLang, history_mode: AITeacher.historyMode }
+                : { material_id: materialId, count, exclude_questions: excludeQuestions, language: currentLang, history_mode: AITeacher.historyMode })
+        });
+        let response = await send(sessionId);
+        
+        // Sessions live in server memory and expire: start a new one that already
+        // knows the served questions and retry once (without a session if that fails)
+        if (response.status === 404 && sessionId) {
+            AITeacher.sessionId = await this.createSession(materialId, excludeQuestions).catch(() => null);
+            sessionId = AITeacher.sessionId;
+            response = await send(sessionId);
+        }
+        
+        // Server busy (admission 503): wait as told and retry once if the wait is short
+        if (response.status === 503) {
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+            if (retryAfter > 0 && retryAfter <= 30) {
+                await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+                response = await send(sessionId);
+            }
+        }
+        
+        // History material and the provider failed or timed out: serve the quiz built
+        // locally from the historical figures dataset instead, and say so
+        if ([500, 502, 504].includes(response.status) && AITeacher.historyMode) {
+            const quiz = await this.generateHistoryQuiz(count).catch(() => null);
+            if (quiz) {
+                showToast(t('historyQuizFallback'), 'warning');
+                return quiz;
+            }
+        }
+        
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.error || t('generationError') || 'Generation error');
+        }
+        return response.json();
+    },
+    
+    async generateHistoryQuiz(count) {
+        const response = await fetch(`${AI_TEACHER_API_URL}/quiz/history`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ count, language: currentLang })
         });
         
         if (!response.ok) {
@@ -8361,7 +8424,7 @@ const AITeacherAPI = {
         const response = await fetch(`${AI_TEACHER_API_URL}/generate/realtest`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ material_id: materialId, count, language: currentLang })
+            body: JSON.stringify({ material_id: materialId, count, language: currentLang, history_mode: AITeacher.historyMode })
         });
         
         if (!response.ok) {
@@ -8397,7 +8460,8 @@ function selectAIMaterialType(type) {
     closeModal('aiTeacherMaterialModal');
     
     
-    const showHistoryMode = AITeacher.currentMode === 'learn';
+    // Learn uses it for the 3-view format, practice for the local history quiz fallback
+    const showHistoryMode = AITeacher.currentMode === 'learn' || AITeacher.currentMode === 'practice';
     
     if (type === 'text') {
         const historyToggleText = document.getElementById('aiHistoryModeToggle');
@@ -8437,7 +8501,7 @@ async function submitAIMaterial() {
     }
     
     
-    if (AITeacher.currentMode === 'learn') {
+    if (AITeacher.currentMode === 'learn' || AITeacher.currentMode === 'practice') {
         const historyCheckbox = document.getElementById('aiHistoryModeText');
         AITeacher.historyMode = historyCheckbox ? historyCheckbox.checked : false;
     } else {
@@ -8455,7 +8519,7 @@ async function submitAIPdf() {
     }
     
     
-    if (AITeacher.currentMode === 'learn') {
+    if (AITeacher.currentMode === 'learn' || AITeacher.currentMode === 'practice') {
         const historyCheckbox = document.getElementById('aiHistoryModePdf');
         AITeacher.historyMode = historyCheckbox ? historyCheckbox.checked : false;
     } else {
@@ -8528,7 +8592,8 @@ async function continueAIPractice(count) {
         const data = await AITeacherAPI.generatePractice(
             AITeacher.materialId, 
             count, 
-            AITeacher.previousQuestions
+            AITeacher.previousQuestions,
+            AITeacher.sessionId
         );
         
         AITeacher.flashcardsData = data.flashcards || [];
@@ -8845,7 +8910,8 @@ async function startAIPracticeMode() {
     showAILoading();
     
     try {
-        const data = await AITeacherAPI.generatePractice(AITeacher.materialId, AITeacher.questionCount);
+        AITeacher.sessionId = await AITeacherAPI.createSession(AITeacher.materialId).catch(() => null);
+        const data = await AITeacherAPI.generatePractice(AITeacher.materialId, AITeacher.questionCount, [], AITeacher.sessionId);
 
         AITeacher.mathMode = detectMathInValue({ questions: data.questions, flashcards: data.flashcards });
         AITeacher.flashcardsData = data.flashcards || [];